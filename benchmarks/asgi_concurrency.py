@@ -0,0 +1,130 @@
+"""
+Concurrency benchmark of the Flask app (sync gunicorn workers) against the ASGI app (uvicorn
+workers), with fast clients sending small JSON requests while slow clients upload big files.
+
+Requires gunicorn, uvicorn and the pickled model in src/app/pickle (or PICKLE_DIR).
+
+Example use:
+python benchmarks/asgi_concurrency.py --data data/raw/test.csv --clients 32 --slow-clients 4
+"""
+import common
+import os
+import json
+import time
+import socket
+import argparse
+import threading
+import http.client
+import numpy as np
+import pandas as pd
+
+SERVERS = {
+    'flask': ['main:app'],
+    'asgi': ['-k', 'uvicorn.workers.UvicornWorker', 'asgi:app']
+}
+
+
+def _fast_client(port, body, stop, latencies, errors):
+    """ Sends small JSON requests back to back until stopped """
+
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            connection.request('POST', '/predict', body, {'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            response.read()
+            if response.status != 200:
+                errors.append(response.status)
+            else:
+                latencies.append(time.perf_counter() - start)
+        except (OSError, http.client.HTTPException):
+            errors.append('connection')
+            connection.close()
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    connection.close()
+
+
+def _slow_client(port, csv_body, stop, chunk_bytes=1024, delay=0.05):
+    """ Uploads a CSV file slowly (chunk_bytes every delay seconds), over and over """
+
+    boundary = 'benchmark-boundary'
+    body = (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="data"; filename="data.csv"\r\n'
+        f'Content-Type: text/csv\r\n\r\n'
+    ).encode() + csv_body + f'\r\n--{boundary}--\r\n'.encode()
+    headers = (
+        f'POST /predict HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: close\r\n'
+        f'Content-Type: multipart/form-data; boundary={boundary}\r\n'
+        f'Content-Length: {len(body)}\r\n\r\n'
+    ).encode()
+
+    while not stop.is_set():
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=60) as sock:
+                sock.sendall(headers)
+                for start in range(0, len(body), chunk_bytes):
+                    if stop.is_set():
+                        break
+                    sock.sendall(body[start:start + chunk_bytes])
+                    time.sleep(delay)
+                sock.recv(65536)
+        except OSError:
+            pass
+
+
+def run(name, port, workers, data, clients, slow_clients, duration):
+    """ Returns throughput and latency percentiles of the fast clients for one app """
+
+    json_body = json.dumps({'data': json.loads(data.head(1).to_json(orient='records'))})
+    csv_body = data.to_csv(index=False).encode()
+    latencies, errors = [], []
+    stop = threading.Event()
+
+    with common.server(port, ['--workers', str(workers)] + SERVERS[name]):
+        threads = [
+            threading.Thread(target=_slow_client, args=(port, csv_body, stop))
+            for _ in range(slow_clients)
+        ] + [
+            threading.Thread(target=_fast_client, args=(port, json_body, stop, latencies, errors))
+            for _ in range(clients)
+        ]
+        for thread in threads:
+            thread.start()
+        time.sleep(duration)
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    latencies = np.array(latencies) * 1000
+    return {
+        'app': name,
+        'requests_per_s': len(latencies) / duration,
+        'p50_ms': np.percentile(latencies, 50) if len(latencies) else None,
+        'p95_ms': np.percentile(latencies, 95) if len(latencies) else None,
+        'p99_ms': np.percentile(latencies, 99) if len(latencies) else None,
+        'errors': len(errors)
+    }
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--data', default=os.path.join(common.ROOT_DIR, 'data/raw/test.csv'))
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--slow-clients', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--output', help='Optional JSON file for the results')
+    args = parser.parse_args()
+
+    data = pd.read_csv(args.data)
+    results = [
+        run(name, args.port, args.workers, data, args.clients, args.slow_clients, args.duration)
+        for name in SERVERS
+    ]
+    print(pd.DataFrame(results).to_string(index=False))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,124 @@
+import os
+import sys
+import time
+import socket
+import subprocess
+import tracemalloc
+import numpy as np
+import pandas as pd
+from contextlib import contextmanager
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC_DIR = os.path.join(ROOT_DIR, 'src')
+APP_DIR = os.path.join(SRC_DIR, 'app')
+
+# Source modules import each other as top-level modules (the app folder is flattened in docker)
+for path in [SRC_DIR, APP_DIR]:
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+
+TRAIN_CSV = os.path.join(ROOT_DIR, 'data/raw/train.csv')
+_synthesizer = {}
+
+
+def synthetic_raw(n_rows, seed=0):
+    """
+    Synthetic raw rows. Learned from data/raw/train.csv when it exists (see synthetic.py),
+    otherwise random rows with the columns used by the PreProcessor, plus Id and SalePrice.
+    """
+
+    if os.path.exists(TRAIN_CSV):
+        if 'fitted' not in _synthesizer:
+            from synthetic import HouseSynthesizer
+            _synthesizer['fitted'] = HouseSynthesizer().fit(pd.read_csv(TRAIN_CSV))
+        return _synthesizer['fitted'].sample(n_rows, np.random.default_rng(seed))
+
+    rng = np.random.RandomState(seed)
+    return pd.DataFrame({
+        'Id': np.arange(1, n_rows + 1),
+        'MSSubClass': rng.choice([20, 30, 50, 60, 70, 80, 90, 120, 160, 190], n_rows),
+        'Neighborhood': rng.choice(['NAmes', 'CollgCr', 'OldTown', 'Edwards', 'Somerst',
+                                    'Gilbert', 'NridgHt', 'Sawyer', 'NWAmes'], n_rows),
+        'OverallQual': rng.randint(1, 11, n_rows),
+        'YearBuilt': rng.randint(1880, 2010, n_rows),
+        'Foundation': rng.choice(['PConc', 'CBlock', 'BrkTil', 'Slab'], n_rows),
+        'TotalBsmtSF': rng.randint(0, 3000, n_rows).astype(float),
+        '1stFlrSF': rng.randint(300, 3000, n_rows),
+        '2ndFlrSF': rng.randint(0, 2000, n_rows),
+        'FullBath': rng.randint(0, 4, n_rows),
+        'KitchenQual': rng.choice(['Ex', 'Gd', 'TA', 'Fa'], n_rows),
+        'Fireplaces': rng.randint(0, 4, n_rows),
+        'GarageCars': rng.randint(0, 5, n_rows).astype(float),
+        'SalePrice': rng.randint(50000, 500000, n_rows)
+    })
+
+
+def measure(fn, repeats=5, warmup=1):
+    """
+    Calls fn() warmup + repeats times.
+    Returns the latencies (seconds) of the timed calls and the peak traced memory (bytes) of
+    one extra call. Memory is measured separately because tracemalloc slows calls down.
+    """
+
+    for _ in range(warmup):
+        fn()
+
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return np.array(latencies), peak
+
+
+def summarize(latencies, n_rows, peak_bytes=None):
+    """ Throughput (rows/s), latency percentiles (ms) and peak memory (MB) """
+
+    latencies = np.asarray(latencies)
+    return {
+        'rows_per_s': n_rows / np.median(latencies),
+        'p50_ms': np.percentile(latencies, 50) * 1000,
+        'p95_ms': np.percentile(latencies, 95) * 1000,
+        'p99_ms': np.percentile(latencies, 99) * 1000,
+        'peak_mb': None if peak_bytes is None else peak_bytes / 2**20
+    }
+
+
+@contextmanager
+def server(port, args):
+    """
+    Runs gunicorn with the app folder as working directory until the context exits.
+    args are extra gunicorn arguments, ending with the app (e.g. ['--workers', '2', 'main:app']).
+    """
+
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([SRC_DIR, APP_DIR]))
+    command = [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}',
+               '--chdir', APP_DIR] + list(args)
+    process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL)
+    try:
+        _wait_for_port(port)
+        yield process
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def _wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'Server did not start on port {port}')
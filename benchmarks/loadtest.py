@@ -0,0 +1,184 @@
+"""
+Load test of the prediction service (src/app/main.py) running locally under gunicorn.
+
+Replays a mix of single-record JSON requests, small JSON batches and large CSV uploads at a
+fixed open-loop arrival rate (Poisson arrivals: requests are sent on schedule whether or not
+earlier ones have completed, and latency is measured from the scheduled time). Sweeps the
+gunicorn worker and thread counts and the arrival rate, and reports the highest rate each
+configuration sustains within the error rate and p99 latency objectives.
+
+Requires gunicorn and the pickled model in src/app/pickle (or PICKLE_DIR).
+
+Example use:
+python benchmarks/loadtest.py --workers 1 2 4 --threads 1 4 --rates 20 50 100 --duration 30
+"""
+import common
+import json
+import time
+import argparse
+import threading
+import http.client
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+
+# Traffic type: (share of requests, rows per request)
+TRAFFIC_MIX = {
+    'single': (0.80, 1),
+    'small_batch': (0.18, 50),
+    'csv_upload': (0.02, 5000)
+}
+BOUNDARY = 'loadtest-boundary'
+
+
+def _payloads(mix, seed=0):
+    """ Request body and content type of each traffic type, from synthetic rows """
+
+    payloads = {}
+    for name, (_, n_rows) in mix.items():
+        rows = common.synthetic_raw(n_rows, seed).drop('SalePrice', axis=1)
+        if name == 'csv_upload':
+            body = (
+                f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="data"; '
+                f'filename="data.csv"\r\nContent-Type: text/csv\r\n\r\n'
+            ).encode() + rows.to_csv(index=False).encode() + f'\r\n--{BOUNDARY}--\r\n'.encode()
+            payloads[name] = (body, f'multipart/form-data; boundary={BOUNDARY}')
+        else:
+            records = json.loads(rows.to_json(orient='records'))
+            payloads[name] = (json.dumps({'data': records}).encode(), 'application/json')
+    return payloads
+
+
+def _send(port, body, content_type, scheduled):
+    """ Returns (status, latency from the scheduled send time) """
+
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    try:
+        connection.request('POST', '/predict', body, {'Content-Type': content_type})
+        response = connection.getresponse()
+        response.read()
+        status = response.status
+    except (OSError, http.client.HTTPException):
+        status = None
+    finally:
+        connection.close()
+    return status, time.perf_counter() - scheduled
+
+
+def warm_up(port, payloads, n_requests):
+    """ Sends n_requests of each traffic type concurrently, so every worker loads the model """
+
+    with ThreadPoolExecutor(n_requests) as executor:
+        for body, content_type in payloads.values():
+            list(executor.map(lambda _: _send(port, body, content_type, time.perf_counter()),
+                              range(n_requests)))
+
+
+def replay(port, rate, duration, mix, payloads, seed=0, max_in_flight=512):
+    """ Sends requests at `rate` per second on average for `duration` seconds """
+
+    rng = np.random.RandomState(seed)
+    n_requests = rng.poisson(rate * duration)
+    arrivals = np.sort(rng.uniform(0, duration, n_requests))
+    names = list(mix)
+    kinds = rng.choice(names, n_requests, p=[mix[name][0] for name in names])
+
+    results = []
+    lock = threading.Lock()
+
+    def run(kind, scheduled):
+        status, latency = _send(port, *payloads[kind], scheduled)
+        with lock:
+            results.append((kind, status, latency))
+
+    with ThreadPoolExecutor(max_in_flight) as executor:
+        start = time.perf_counter()
+        for kind, arrival in zip(kinds, arrivals):
+            scheduled = start + arrival
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(run, kind, scheduled)
+
+    return pd.DataFrame(results, columns=['kind', 'status', 'latency'])
+
+
+def summarize(results, rate, duration):
+    """ Error rate and latency percentiles (ms), overall and per traffic type """
+
+    summary = []
+    for kind, group in [('all', results)] + list(results.groupby('kind')):
+        ok = group[group['status'] == 200]['latency'] * 1000
+        summary.append({
+            'kind': kind,
+            'offered_rate': rate,
+            'achieved_rate': len(ok) / duration,
+            'requests': len(group),
+            'error_rate': 1 - len(ok) / len(group) if len(group) else 0,
+            'p50_ms': ok.quantile(0.50) if len(ok) else None,
+            'p95_ms': ok.quantile(0.95) if len(ok) else None,
+            'p99_ms': ok.quantile(0.99) if len(ok) else None
+        })
+    return summary
+
+
+def sweep(port, workers, threads, rates, duration, mix, max_error_rate, slo_ms):
+    """ Runs every configuration and rate, stopping a configuration at its first failing rate """
+
+    payloads = _payloads(mix)
+    rows = []
+    for n_workers in workers:
+        for n_threads in threads:
+            args = ['--workers', str(n_workers), '--threads', str(n_threads), 'main:app']
+            with common.server(port, args):
+                warm_up(port, payloads, 2 * n_workers * n_threads)
+                for rate in rates:
+                    results = replay(port, rate, duration, mix, payloads)
+                    summary = summarize(results, rate, duration)
+                    for row in summary:
+                        row.update(workers=n_workers, threads=n_threads)
+                    rows.extend(summary)
+
+                    overall = summary[0]
+                    p99, error_rate = overall['p99_ms'], overall['error_rate']
+                    sustained = error_rate <= max_error_rate and p99 is not None and p99 <= slo_ms
+                    print(f'workers={n_workers} threads={n_threads} rate={rate}/s: '
+                          f'p99={p99} ms, errors={error_rate:.1%}')
+                    if not sustained:
+                        break
+    return pd.DataFrame(rows)
+
+
+def best_configuration(runs, max_error_rate, slo_ms):
+    """ Configuration sustaining the highest rate within the objectives (lowest p99 on ties) """
+
+    overall = runs[runs['kind'] == 'all']
+    sustained = overall[(overall['error_rate'] <= max_error_rate) & (overall['p99_ms'] <= slo_ms)]
+    if sustained.empty:
+        return None
+    best = sustained.sort_values(['offered_rate', 'p99_ms'], ascending=[False, True]).iloc[0]
+    return best[['workers', 'threads', 'offered_rate', 'p99_ms', 'error_rate']].to_dict()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--port', type=int, default=8091)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--rates', type=float, nargs='+', default=[10, 20, 50, 100, 200])
+    parser.add_argument('--duration', type=float, default=30, help='Seconds per rate')
+    parser.add_argument('--mix', type=json.loads, help=(
+        'Traffic mix as JSON {"single": [share, rows], ...}, defaults to TRAFFIC_MIX'))
+    parser.add_argument('--max-error-rate', type=float, default=0.01)
+    parser.add_argument('--slo-ms', type=float, default=500, help='p99 latency objective')
+    parser.add_argument('--output', help='Optional JSON file for all runs')
+    args = parser.parse_args()
+
+    mix = {name: tuple(value) for name, value in args.mix.items()} if args.mix else TRAFFIC_MIX
+    runs = sweep(args.port, args.workers, args.threads, args.rates, args.duration, mix,
+                 args.max_error_rate, args.slo_ms)
+    print(runs.to_string(index=False))
+    print('Best configuration:', best_configuration(runs, args.max_error_rate, args.slo_ms))
+    if args.output:
+        runs.to_json(args.output, orient='records', indent=2)
@@ -0,0 +1,155 @@
+"""
+Benchmark suite for preprocessing, inference, database I/O, request / response encoding, drift
+monitoring and the /predict endpoint.
+
+Runs every subsystem on synthetic data at several scales against a local SQLite database and
+reports throughput, latency percentiles and peak memory. Results are written as JSON. With
+--compare, results are checked against a saved baseline and the exit code is 1 on regression.
+
+Example use:
+python benchmarks/run.py --output benchmarks/results.json
+python benchmarks/run.py --compare benchmarks/baseline.json --threshold 0.2
+"""
+import common
+import os
+import sys
+import json
+import logging
+import argparse
+import platform
+import tempfile
+import datetime
+import pandas as pd
+
+import codec
+import drift
+import database
+import scoring
+from main import app
+from model import model
+from sklearn.base import clone
+from preprocessing import PreProcessor
+
+SUBSYSTEMS = ['preprocess', 'predict', 'db_save', 'db_load', 'decode_rows', 'decode_columns',
+              'encode', 'encode_gzip', 'drift', 'http', 'http_columns']
+
+
+def _fit(n_rows=2000):
+    """ Preprocessor and model with the production parameters, fitted on synthetic data """
+
+    train = common.synthetic_raw(n_rows, seed=1)
+    pp = PreProcessor().fit(train)
+    fitted = clone(model).fit(pp.transform(train), train['SalePrice'])
+    return train, pp, fitted
+
+
+def run(scales, repeats, subsystems=SUBSYSTEMS):
+    """ Returns one result dict per subsystem and scale """
+
+    train, pp, fitted = _fit()
+    scoring.state.update(preprocessor=pp, model=fitted, version='benchmark')
+    monitor = drift.DriftMonitor(drift.build_baseline(
+        train, fitted.predict(pp.transform(train)), pp.raw_features))
+    logging.getLogger('house_prices').setLevel(logging.WARNING)
+    client = app.test_client()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        db = os.path.join(tmp, 'benchmark.sqlite')
+        for n_rows in scales:
+            raw = common.synthetic_raw(n_rows)
+            X_pp = pp.transform(raw)
+            records = raw.drop('SalePrice', axis=1).to_dict('records')
+            columns = raw.drop('SalePrice', axis=1).to_dict('list')
+            rows_body = codec.dumps({'data': records})
+            columns_body = codec.dumps({'columns': columns})
+            response = {'status': 'success', 'data': fitted.predict(X_pp)}
+            database.save(raw, 'sqlite:///', db, None, 'raw')
+
+            benchmarks = {
+                'preprocess': lambda: pp.transform(raw),
+                'predict': lambda: fitted.predict(X_pp),
+                'db_save': lambda: database.save(raw, 'sqlite:///', db, None, 'raw'),
+                'db_load': lambda: database.load('sqlite:///', db, None, 'raw'),
+                'decode_rows': lambda: pd.DataFrame(codec.loads(rows_body)['data']),
+                'decode_columns': lambda: codec.frame(codec.loads(columns_body)['columns']),
+                'encode': lambda: codec.dumps(response),
+                'encode_gzip': lambda: codec.compress(codec.dumps(response), 'gzip'),
+                'drift': lambda: monitor.update(raw, response['data']),
+                'http': lambda: _post(client, {'data': records}),
+                'http_columns': lambda: _post(client, {'columns': columns})
+            }
+            for name in subsystems:
+                latencies, peak = common.measure(benchmarks[name], repeats)
+                result = {'subsystem': name, 'rows': n_rows}
+                result.update(common.summarize(latencies, n_rows, peak))
+                results.append(result)
+                print(f'{name:>10} {n_rows:>8} rows: {result["p50_ms"]:10.1f} ms (p50)')
+
+    return results
+
+
+def _post(client, payload):
+    response = client.post('/predict', json=payload)
+    assert response.status_code == 200, response.data
+
+
+def compare(results, baseline, threshold):
+    """
+    Returns the results that regressed by more than threshold (relative) against the baseline:
+    lower throughput, or higher p50 latency or peak memory
+    """
+
+    baseline = {(r['subsystem'], r['rows']): r for r in baseline}
+    regressions = []
+    for result in results:
+        base = baseline.get((result['subsystem'], result['rows']))
+        if base is None:
+            continue
+        changes = {
+            'rows_per_s': base['rows_per_s'] / result['rows_per_s'] - 1,
+            'p50_ms': result['p50_ms'] / base['p50_ms'] - 1,
+            'peak_mb': result['peak_mb'] / base['peak_mb'] - 1 if base['peak_mb'] else 0
+        }
+        for metric, change in changes.items():
+            if change > threshold:
+                regressions.append({
+                    'subsystem': result['subsystem'], 'rows': result['rows'], 'metric': metric,
+                    'baseline': base[metric], 'current': result[metric], 'change': change
+                })
+    return regressions
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--scales', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--subsystems', nargs='+', choices=SUBSYSTEMS, default=SUBSYSTEMS)
+    parser.add_argument('--output', default=os.path.join(common.ROOT_DIR, 'benchmarks',
+                                                         'results.json'))
+    parser.add_argument('--compare', metavar='BASELINE', help='Baseline results JSON file')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Relative change counted as a regression')
+    args = parser.parse_args()
+
+    results = run(args.scales, args.repeats, args.subsystems)
+    with open(args.output, 'w') as f:
+        json.dump({
+            'created': datetime.datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'results': results
+        }, f, indent=2)
+    print(pd.DataFrame(results).to_string(index=False))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print('Regressions:')
+            print(pd.DataFrame(regressions).to_string(index=False))
+            sys.exit(1)
+        print('No regressions')
@@ -0,0 +1,65 @@
+"""
+Comparison of a forest per group of neighborhoods (sharding.ShardedModel) with the single global
+forest: hold-out RMSE, model size and prediction latency / peak memory by batch size.
+
+Example use:
+python benchmarks/sharding.py --rows 20000 --groups 2 4 8
+"""
+import common
+import pickle
+import argparse
+import numpy as np
+import pandas as pd
+
+import model
+import sharding
+from preprocessing import PreProcessor
+
+
+def _nodes(fitted):
+    if isinstance(fitted, sharding.ShardedModel):
+        return sum(fitted.summary().values())
+    return sum(tree.tree_.node_count for tree in fitted.estimators_)
+
+
+def run(n_rows, groups, batch_sizes, repeats):
+
+    # Synthetic training rows and a hold-out set, preprocessed as float matrices
+    raw = common.synthetic_raw(n_rows, seed=1)
+    holdout = common.synthetic_raw(max(batch_sizes + [2000]), seed=2)
+    pp = PreProcessor().fit(raw)
+    X, X_holdout = pp.transform(raw), pp.transform(holdout)
+    y, y_holdout = raw['SalePrice'].to_numpy(), holdout['SalePrice'].to_numpy()
+
+    fitted = {'single': model.fit(X.to_numpy(np.float32), y)[0]}
+    for n_groups in groups:
+        fitted[f'sharded_{n_groups}'] = sharding.fit(X, y, n_groups)
+
+    results = []
+    for name, estimator in fitted.items():
+        errors = estimator.predict(X_holdout.to_numpy(np.float32)) - y_holdout
+        for batch_size in batch_sizes:
+            batch = X_holdout.to_numpy(np.float32)[:batch_size]
+            latencies, peak = common.measure(lambda: estimator.predict(batch), repeats)
+            results.append(dict(
+                model=name, rows=batch_size,
+                rmse=float(np.sqrt(np.mean(errors ** 2))),
+                nodes=_nodes(estimator),
+                size_mb=len(pickle.dumps(estimator, protocol=4)) / 2**20,
+                **common.summarize(latencies, batch_size, peak)
+            ))
+    return results
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--groups', type=int, nargs='+', default=[2, 4, 8])
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 100, 10000])
+    parser.add_argument('--repeats', type=int, default=20)
+    args = parser.parse_args()
+
+    results = run(args.rows, args.groups, args.batch_sizes, args.repeats)
+    columns = ['model', 'rows', 'rmse', 'nodes', 'size_mb', 'p50_ms', 'p95_ms', 'peak_mb']
+    print(pd.DataFrame(results)[columns].to_string(index=False))
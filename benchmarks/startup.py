@@ -0,0 +1,132 @@
+"""
+Start-up benchmark of the serving process: import time of the Flask app, model loading time and
+time to first prediction, each measured in a fresh interpreter.
+
+Also reports the slowest imports (python -X importtime) and checks that serving does not import
+modules it doesn't need (database / SQLAlchemy). With --max-seconds, the exit code is 1 when the
+median time to first prediction is slower, or when a forbidden module was imported.
+
+Example use:
+python benchmarks/startup.py --repeats 5 --max-seconds 5
+"""
+import common
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+import pandas as pd
+import joblib
+
+from model import model
+from sklearn.base import clone
+from preprocessing import PreProcessor
+
+# Modules the serving process should never import
+FORBIDDEN_MODULES = ['database', 'sqlalchemy', 'sqlalchemy_utils']
+
+# Run in a fresh interpreter: imports the app, loads the model and scores one request
+_CHILD = '''
+import sys
+import json
+import time
+start = time.perf_counter()
+import main
+import scoring
+imported = time.perf_counter()
+scoring.load_model()
+loaded = time.perf_counter()
+with open(sys.argv[1]) as f:
+    records = json.load(f)
+response = main.app.test_client().post('/predict', json={'data': records})
+assert response.status_code == 200, response.data
+predicted = time.perf_counter()
+print(json.dumps({
+    'import_s': imported - start,
+    'load_model_s': loaded - imported,
+    'first_request_s': predicted - loaded,
+    'forbidden': [name for name in sys.argv[2:] if name in sys.modules]
+}))
+'''
+
+
+def _write_pickles(pickle_dir, n_rows=2000):
+    """ Preprocessor and model with the production parameters, fitted on synthetic data """
+
+    train = common.synthetic_raw(n_rows, seed=1)
+    pp = PreProcessor().fit(train)
+    fitted = clone(model).fit(pp.transform(train), train['SalePrice'])
+    joblib.dump(pp, os.path.join(pickle_dir, 'PreProcessor.pkl'))
+    joblib.dump(fitted, os.path.join(pickle_dir, 'Model.pkl'))
+
+
+def _run_child(records_path, pickle_dir, importtime=False):
+    """ Returns the child's timings, its total wall time and its -X importtime report """
+
+    env = dict(os.environ, PICKLE_DIR=pickle_dir, PRELOAD_MODEL='0',
+               PYTHONPATH=os.pathsep.join([common.SRC_DIR, common.APP_DIR]))
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else [])
+    command += ['-c', _CHILD, records_path] + FORBIDDEN_MODULES
+    start = time.perf_counter()
+    result = subprocess.run(command, env=env, cwd=common.APP_DIR, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    timings['first_prediction_s'] = time.perf_counter() - start
+    return timings, result.stderr
+
+
+def slowest_imports(report, n=15):
+    """ Top-level imports with the largest cumulative time (ms), from a -X importtime report """
+
+    rows = []
+    for line in report.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Nested imports are indented
+        if not name[1:].startswith(' '):
+            rows.append({'module': name.strip(), 'cumulative_ms': int(cumulative) / 1000})
+    return pd.DataFrame(rows).sort_values('cumulative_ms', ascending=False).head(n)
+
+
+def run(repeats):
+    """ Returns the timings of each run and the import report of an extra run """
+
+    with tempfile.TemporaryDirectory() as tmp:
+        _write_pickles(tmp)
+        records_path = os.path.join(tmp, 'records.json')
+        records = common.synthetic_raw(10).drop('SalePrice', axis=1).to_dict('records')
+        with open(records_path, 'w') as f:
+            json.dump(records, f, default=int)
+
+        results = [_run_child(records_path, tmp)[0] for _ in range(repeats)]
+        _, report = _run_child(records_path, tmp, importtime=True)
+    return pd.DataFrame(results), slowest_imports(report)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--max-seconds', type=float,
+                        help='Fail if the median time to first prediction is slower')
+    args = parser.parse_args()
+
+    results, imports = run(args.repeats)
+    print('Slowest imports:')
+    print(imports.to_string(index=False))
+    print(results.drop('forbidden', axis=1).describe().loc[['50%', 'max']].to_string())
+
+    failed = False
+    forbidden = sorted(set(np.concatenate(results['forbidden'].tolist())))
+    if forbidden:
+        print('Serving imported:', ', '.join(forbidden))
+        failed = True
+    median = results['first_prediction_s'].median()
+    if args.max_seconds is not None and median > args.max_seconds:
+        print(f'Time to first prediction {median:.2f}s > {args.max_seconds}s')
+        failed = True
+    sys.exit(1 if failed else 0)
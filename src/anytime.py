@@ -0,0 +1,111 @@
+import os
+import time
+import numpy as np
+import pandas as pd
+import joblib
+
+DIR = os.path.abspath(os.path.dirname(__file__))
+PICKLE_DIR = os.path.join(DIR, '../pickle')
+
+
+def _tree_predictors(model):
+    """
+    Returns one prediction function per tree, in the fixed evaluation order.
+    Works with a fitted RandomForestRegressor or a compression.CompactForest.
+    """
+
+    if hasattr(model, 'estimators_'):
+        return [
+            lambda X, tree=tree: tree.predict(X, check_input=False)
+            for tree in model.estimators_
+        ]
+    return [
+        lambda X, i=i: model.predict(X, trees=[i])
+        for i in range(model.n_estimators)
+    ]
+
+
+def predict_anytime(model, X, deadline=None, calibration=None):
+    """
+    Averages trees in a fixed order until the deadline (time.perf_counter() value) has passed.
+    At least one tree is always evaluated.
+
+    Returns the partial forest average, the number of trees used and the estimated error bound
+    of the partial average relative to the full forest. The bound comes from the offline
+    calibration when available, otherwise from the spread of the evaluated tree predictions.
+    """
+
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    predictors = _tree_predictors(model)
+    n_total = len(predictors)
+
+    # Running mean and variance of the tree predictions (Welford)
+    mean = np.zeros(len(X))
+    m2 = np.zeros(len(X))
+    n_trees = 0
+    for predict in predictors:
+        y_tree = predict(X)
+        n_trees += 1
+        delta = y_tree - mean
+        mean += delta / n_trees
+        m2 += delta * (y_tree - mean)
+        if deadline is not None and time.perf_counter() >= deadline:
+            break
+
+    # Estimated error of the partial average
+    if calibration is not None and n_trees in calibration.index:
+        error = calibration.loc[n_trees, 'rmse_vs_full']
+        error_bound = np.full(len(X), error)
+    elif n_trees > 1:
+        # Standard error with finite population correction (trees are drawn without replacement)
+        std = np.sqrt(m2 / (n_trees - 1))
+        error_bound = std / np.sqrt(n_trees) * np.sqrt(1 - n_trees / n_total)
+    else:
+        error_bound = np.full(len(X), np.nan)
+
+    return mean, n_trees, error_bound
+
+
+def calibrate(model, X_val, y_val):
+    """
+    Measures the accuracy lost per number of trees on a validation set.
+    Returns a DataFrame indexed by n_trees with the RMSE against the true target and
+    the RMSE against the full forest prediction.
+    """
+
+    X_val = np.ascontiguousarray(X_val, dtype=np.float32)
+    y_val = np.asarray(y_val)
+    tree_preds = np.array([predict(X_val) for predict in _tree_predictors(model)])
+
+    n_trees = np.arange(1, len(tree_preds) + 1)
+    partial = np.cumsum(tree_preds, axis=0) / n_trees[:, None]
+    full = partial[-1]
+
+    calibration = pd.DataFrame({
+        'n_trees': n_trees,
+        'rmse': np.sqrt(np.mean((partial - y_val) ** 2, axis=1)),
+        'rmse_vs_full': np.sqrt(np.mean((partial - full) ** 2, axis=1))
+    })
+    return calibration.set_index('n_trees')
+
+
+if __name__ == "__main__":
+    import database as db
+    from model import fit
+    from sklearn.model_selection import train_test_split
+
+    # Load data and split off a validation set
+    db_config = db.get_config()
+    train_pp = db.load(*db_config, 'processed_train')
+    X_train_pp = train_pp.drop('SalePrice', axis=1)
+    y_train = train_pp['SalePrice']
+    X_fit, X_val, y_fit, y_val = train_test_split(X_train_pp, y_train, test_size=0.2,
+                                                  random_state=0)
+
+    # Calibrate on a forest with the serving model's parameters which has not seen X_val
+    holdout_model, _ = fit(X_fit, y_fit)
+    calibration = calibrate(holdout_model, X_val, y_val)
+    print(calibration.to_string())
+
+    # Save calibration next to the serving model
+    joblib.dump(calibration, os.path.join(PICKLE_DIR, 'Calibration.pkl'))
@@ -0,0 +1,182 @@
+import os
+import asyncio
+import threading
+import collections
+from contextlib import contextmanager
+
+# Requests with more rows are rejected outright
+MAX_ROWS = int(os.environ.get('ADMISSION_MAX_ROWS', 1000000))
+
+# Requests with at most INTERACTIVE_MAX_ROWS rows use the interactive lane, others the batch lane
+INTERACTIVE_MAX_ROWS = int(os.environ.get('ADMISSION_INTERACTIVE_MAX_ROWS', 100))
+INTERACTIVE_CONCURRENCY = int(os.environ.get('ADMISSION_INTERACTIVE_CONCURRENCY', 8))
+INTERACTIVE_QUEUE = int(os.environ.get('ADMISSION_INTERACTIVE_QUEUE', 32))
+BATCH_CONCURRENCY = int(os.environ.get('ADMISSION_BATCH_CONCURRENCY', 1))
+BATCH_QUEUE = int(os.environ.get('ADMISSION_BATCH_QUEUE', 2))
+
+# Maximum time a queued request waits for a scoring slot, and the Retry-After sent on overload
+QUEUE_TIMEOUT = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 5))
+RETRY_AFTER = int(os.environ.get('ADMISSION_RETRY_AFTER', 1))
+
+
+class Overloaded(Exception):
+    """ Raised when a request is not admitted. Carries the HTTP status and headers to send. """
+
+    def __init__(self, status, message, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.retry_after = retry_after
+
+    @property
+    def headers(self):
+        return {} if self.retry_after is None else {'Retry-After': str(self.retry_after)}
+
+    @property
+    def response(self):
+        return {'status': 'error', 'message': self.message}
+
+
+class _Lane():
+    """ Limits concurrent scoring jobs, with a bounded number of requests waiting for a slot """
+
+    def __init__(self, name, max_concurrent, max_queue):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self.queued = 0
+
+    def acquire(self, timeout, retry_after):
+        """ Takes a scoring slot, waiting at most timeout seconds in the queue """
+
+        if self._slots.acquire(blocking=False):
+            return
+
+        # Fail fast when the queue is full
+        with self._lock:
+            if self.queued >= self.max_queue:
+                raise Overloaded(429, f'Too many {self.name} requests queued', retry_after)
+            self.queued += 1
+
+        try:
+            acquired = self._slots.acquire(timeout=timeout)
+        finally:
+            with self._lock:
+                self.queued -= 1
+        if not acquired:
+            raise Overloaded(503, f'Timed out waiting for a {self.name} scoring slot',
+                             retry_after)
+
+    def release(self):
+        self._slots.release()
+
+
+class _AsyncLane():
+    """
+    Same limits as _Lane for the ASGI app: queued requests wait on the event loop instead of
+    holding a thread. Slots are handed over to waiters in arrival order. Must only be used from
+    the event loop thread; its futures are created in the running loop, so it isn't bound to one.
+    """
+
+    def __init__(self, name, max_concurrent, max_queue):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.active = 0
+        self.queued = 0
+        self._waiters = collections.deque()
+
+    async def acquire(self, timeout, retry_after):
+        """ Takes a scoring slot, waiting at most timeout seconds in the queue """
+
+        if self.active < self.max_concurrent and not self._waiters:
+            self.active += 1
+            return
+
+        # Fail fast when the queue is full
+        if self.queued >= self.max_queue:
+            raise Overloaded(429, f'Too many {self.name} requests queued', retry_after)
+        waiter = asyncio.get_event_loop().create_future()
+        self._waiters.append(waiter)
+        self.queued += 1
+
+        # release() passes its slot on by resolving the waiter. It skips cancelled waiters
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            raise Overloaded(503, f'Timed out waiting for a {self.name} scoring slot',
+                             retry_after)
+        finally:
+            self.queued -= 1
+
+    def release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+
+class AdmissionController():
+    """
+    Admission control for /predict.
+    Single-record and small requests go through the interactive lane and larger ones through
+    the batch lane, so batch load cannot take the slots of interactive requests.
+    The Flask app takes slots with acquire / admit and the ASGI app with acquire_async.
+    """
+
+    def __init__(self, max_rows=MAX_ROWS, interactive_max_rows=INTERACTIVE_MAX_ROWS,
+                 interactive_concurrency=INTERACTIVE_CONCURRENCY,
+                 interactive_queue=INTERACTIVE_QUEUE, batch_concurrency=BATCH_CONCURRENCY,
+                 batch_queue=BATCH_QUEUE, queue_timeout=QUEUE_TIMEOUT, retry_after=RETRY_AFTER):
+        self.max_rows = max_rows
+        self.interactive_max_rows = interactive_max_rows
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.lanes = {
+            'interactive': _Lane('interactive', interactive_concurrency, interactive_queue),
+            'batch': _Lane('batch', batch_concurrency, batch_queue)
+        }
+        self.async_lanes = {
+            'interactive': _AsyncLane('interactive', interactive_concurrency, interactive_queue),
+            'batch': _AsyncLane('batch', batch_concurrency, batch_queue)
+        }
+
+    def _lane_name(self, n_rows):
+        if n_rows > self.max_rows:
+            raise Overloaded(413, f'Too many rows: {n_rows} > {self.max_rows}')
+        return 'interactive' if n_rows <= self.interactive_max_rows else 'batch'
+
+    def lane(self, n_rows):
+        return self.lanes['interactive' if n_rows <= self.interactive_max_rows else 'batch']
+
+    def acquire(self, n_rows):
+        """
+        Returns the lane holding a scoring slot for a request with n_rows rows (release it when
+        scoring is done), or raises Overloaded
+        """
+
+        lane = self.lanes[self._lane_name(n_rows)]
+        lane.acquire(self.queue_timeout, self.retry_after)
+        return lane
+
+    async def acquire_async(self, n_rows):
+        """ Same as acquire, waiting on the event loop (ASGI app) """
+
+        lane = self.async_lanes[self._lane_name(n_rows)]
+        await lane.acquire(self.queue_timeout, self.retry_after)
+        return lane
+
+    @contextmanager
+    def admit(self, n_rows):
+        lane = self.acquire(n_rows)
+        try:
+            yield lane
+        finally:
+            lane.release()
+
+
+controller = AdmissionController()
@@ -0,0 +1,321 @@
+"""
+Asynchronous ASGI entry point exposing the same /predict contract as the Flask app in main.py.
+
+Request bodies are received without blocking a worker, CPU-bound scoring runs in a bounded
+thread pool, and small requests arriving within COALESCE_WINDOW_MS of each other are scored
+as a single batch. Requests go through the same admission control as the Flask app.
+
+Example use:
+uvicorn --app-dir app --port 8080 asgi:app
+gunicorn -k uvicorn.workers.UvicornWorker --bind 0.0.0.0:8080 --chdir app asgi:app
+"""
+import io
+import os
+import time
+import asyncio
+import numpy as np
+import pandas as pd
+import codec
+import scoring
+import admission
+import metrics
+import logs
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.formparser import FormDataParser
+from werkzeug.http import parse_options_header
+
+# Maximum number of requests scored at the same time
+SCORING_THREADS = int(os.environ.get('SCORING_THREADS', os.cpu_count()))
+
+# Bodies larger than MAX_CONTENT_MB are rejected with a 413 error, like in the Flask app
+MAX_CONTENT_LENGTH = int(float(os.environ.get('MAX_CONTENT_MB', 512)) * 2**20)
+
+# Requests with at most COALESCE_MAX_ROWS rows are batched across connections
+COALESCE_WINDOW_MS = float(os.environ.get('COALESCE_WINDOW_MS', 2))
+COALESCE_MAX_ROWS = int(os.environ.get('COALESCE_MAX_ROWS', 100))
+COALESCE_BATCH_ROWS = int(os.environ.get('COALESCE_BATCH_ROWS', 5000))
+
+_executor = ThreadPoolExecutor(SCORING_THREADS)
+logger = logs.get_logger()
+metrics.mark_startup('imported')
+
+
+class _Coalescer():
+    """
+    Collects small requests during a short window and scores them together, in one batch per
+    model version: each request is scored by the model it arrived with, even if the default
+    model was swapped meanwhile.
+    If a batch fails (e.g. one request has invalid values), its requests are scored separately
+    so that a bad request only fails itself.
+    """
+
+    def __init__(self, window, batch_rows):
+        self.window = window
+        self.batch_rows = batch_rows
+        self._pending = []
+        self._rows = 0
+        self._timer = None
+
+    async def predict(self, X, model):
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self._pending.append((X, future, model))
+        self._rows += len(X)
+
+        if self._rows >= self.batch_rows:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending, self._pending, self._rows = self._pending, [], 0
+        batches = {}
+        for X, future, model in pending:
+            batches.setdefault(model['version'], (model, []))[1].append((X, future))
+        for model, batch in batches.values():
+            asyncio.ensure_future(self._score(batch, model))
+
+    async def _score(self, batch, model):
+        loop = asyncio.get_event_loop()
+        try:
+            X = pd.concat([X for X, _ in batch], ignore_index=True, sort=False)
+            y_pred = await loop.run_in_executor(_executor, scoring.predict, X, model)
+        except Exception:
+            for X, future in batch:
+                try:
+                    future.set_result(
+                        await loop.run_in_executor(_executor, scoring.predict, X, model))
+                except Exception as e:
+                    future.set_exception(e)
+            return
+
+        splits = np.cumsum([len(X) for X, _ in batch])[:-1]
+        for (_, future), y in zip(batch, np.split(y_pred, splits)):
+            future.set_result(y)
+
+
+_coalescer = _Coalescer(COALESCE_WINDOW_MS / 1000, COALESCE_BATCH_ROWS)
+
+
+async def _read_body(receive, headers):
+    """
+    Receives the full request body without blocking the event loop.
+    Returns None if it is larger than MAX_CONTENT_LENGTH, without reading the rest of it
+    """
+    try:
+        if int(headers.get(b'content-length', 0)) > MAX_CONTENT_LENGTH:
+            return None
+    except ValueError:
+        pass
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        size += len(chunks[-1])
+        if size > MAX_CONTENT_LENGTH:
+            return None
+        if not message.get('more_body', False):
+            return b''.join(chunks)
+
+
+def _parse_request(body, content_type):
+    """
+    Returns the raw DataFrame, house Ids, latency budget (seconds) and requested model version
+    of a JSON or multipart request: (X, None, budget, name) for data, (None, ids, None, name)
+    for Ids, or (None, None, None, None) when no data was sent. Data is sent as a list of rows
+    ('data'), as columns ('columns', see codec.frame) or as a CSV file.
+    Raises ValueError if the JSON is invalid or not an object, the Ids are not integers or the
+    columns don't have the same length.
+    """
+
+    with metrics.timed('parse'):
+        return _parse_body(body, content_type)
+
+
+def _parse_body(body, content_type):
+    mimetype, options = parse_options_header(content_type)
+    if mimetype == 'application/json':
+        payload = codec.loads(body)
+        if not isinstance(payload, dict):
+            raise ValueError('The JSON body should be an object')
+        name = payload.get('model_version')
+        if 'ids' in payload:
+            return None, scoring.parse_ids(payload['ids']), None, name
+        if 'columns' in payload:
+            X = codec.frame(payload['columns'])
+        elif 'data' in payload:
+            X = pd.DataFrame(payload['data'])
+        else:
+            return None, None, None, None
+        budget_ms = payload.get('budget_ms')
+
+    elif mimetype == 'multipart/form-data':
+        _, form, files = FormDataParser().parse(io.BytesIO(body), mimetype, len(body), options)
+        if 'data' not in files:
+            return None, None, None, None
+        budget_ms = form.get('budget_ms')
+        name = form.get('model_version')
+        X = pd.read_csv(files['data'])
+
+    else:
+        return None, None, None, None
+
+    return X, None, scoring.parse_budget(budget_ms), name
+
+
+async def _send_json(send, status, response, headers=None, version='', accept_encoding=None):
+    with metrics.timed('serialize', version):
+        body, encoding_headers = codec.compress(codec.dumps(response), accept_encoding)
+    headers = dict(headers or {}, **encoding_headers)
+    headers = [(k.lower().encode(), v.encode()) for k, v in headers.items()]
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'),
+                    (b'content-length', str(len(body)).encode())] + headers
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _send_metrics(send):
+    await asyncio.get_event_loop().run_in_executor(_executor, scoring.drift_report)
+    body = metrics.registry.expose().encode()
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [(b'content-type', metrics.CONTENT_TYPE.encode()),
+                    (b'content-length', str(len(body)).encode())]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _predict(scope, receive, send):
+    """ Handles a /predict POST request """
+
+    start = time.perf_counter()
+    loop = asyncio.get_event_loop()
+    headers = dict(scope['headers'])
+    content_type = headers.get(b'content-type', b'').decode('latin-1')
+    body = await _read_body(receive, headers)
+    if body is None:
+        metrics.ERRORS.inc(status='413')
+        response = {'status': 'error',
+                    'message': f'Request body larger than {MAX_CONTENT_LENGTH} bytes'}
+        return await _send_json(send, 413, response)
+
+    # Parsing large bodies is CPU-bound too, so it also runs in the executor
+    try:
+        X, ids, budget, name = await loop.run_in_executor(_executor, _parse_request, body,
+                                                          content_type)
+    except ValueError as e:
+        metrics.ERRORS.inc(status='400')
+        return await _send_json(send, 400, {'status': 'error', 'message': str(e)})
+    if X is None and ids is None:
+        metrics.ERRORS.inc(status='400')
+        response = {
+            'status': 'error',
+            'message': 'Send data as file or json in a POST request'
+        }
+        return await _send_json(send, 400, response)
+
+    # Model version to score with, kept for the whole request even if the default is swapped
+    try:
+        model = scoring.artifacts(name)
+    except KeyError:
+        metrics.ERRORS.inc(status='404')
+        response = {'status': 'error', 'message': f'Unknown model version: {name}'}
+        return await _send_json(send, 404, response)
+
+    # Waiting for a scoring slot happens on the event loop, not in a thread
+    n_rows = len(X) if ids is None else len(ids)
+    try:
+        lane = await admission.controller.acquire_async(n_rows)
+    except admission.Overloaded as e:
+        metrics.ERRORS.inc(status=str(e.status))
+        logger.warning(e.message, extra={'fields': {'status': e.status, 'rows': n_rows}})
+        return await _send_json(send, e.status, e.response, e.headers)
+
+    # Requests with missing columns are not coalesced: missing values would be imputed instead.
+    # Neither are requests for a specific model version, which are rare
+    coalesce = False
+    if ids is None and name is None and budget is None:
+        coalesce = len(X) <= COALESCE_MAX_ROWS and scoring.has_raw_features(X, model)
+    try:
+        if ids is not None:
+            response = await loop.run_in_executor(_executor, scoring.score_ids, ids, model)
+        elif coalesce:
+            y_pred = await _coalescer.predict(X, model)
+            response = {'status': 'success', 'data': y_pred}
+        else:
+            response = await loop.run_in_executor(_executor, scoring.score, X, budget, start,
+                                                  model)
+    except scoring.StaleFeatures as e:
+        metrics.ERRORS.inc(status='409')
+        return await _send_json(send, 409, {'status': 'error', 'message': str(e)})
+    finally:
+        lane.release()
+
+    # Id requests need a feature store
+    if response is None:
+        metrics.ERRORS.inc(status='404')
+        response = {'status': 'error', 'message': 'No feature store to look up Ids in'}
+        return await _send_json(send, 404, response)
+
+    version = model['version']
+    metrics.ROWS.observe(n_rows, model_version=version)
+    metrics.REQUESTS.inc(model_version=version)
+    metrics.mark_startup('first_prediction')
+    logger.info('Scored data', extra={'fields': {
+        'rows': n_rows, 'model_version': version, 'seconds': time.perf_counter() - start
+    }})
+    accept_encoding = headers.get(b'accept-encoding', b'').decode('latin-1')
+    await _send_json(send, 200, response, version=version, accept_encoding=accept_encoding)
+
+
+async def app(scope, receive, send):
+    """ ASGI application """
+
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await asyncio.get_event_loop().run_in_executor(_executor, scoring.load_model)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                _executor.shutdown()
+                scoring.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    if scope['path'] == '/metrics':
+        return await _send_metrics(send)
+    if scope['path'] == '/drift':
+        report = await asyncio.get_event_loop().run_in_executor(_executor, scoring.drift_report)
+        if report is None:
+            return await _send_json(send, 404, {'status': 'error', 'message': 'No drift baseline'})
+        return await _send_json(send, 200, {'status': 'success', 'data': report})
+    if scope['path'] == '/shadow':
+        summary = scoring.shadow_summary()
+        if summary is None:
+            return await _send_json(send, 404, {'status': 'error', 'message': 'No shadow models'})
+        return await _send_json(send, 200, {'status': 'success', 'data': summary})
+    if scope['path'] == '/models':
+        models = await asyncio.get_event_loop().run_in_executor(_executor, scoring.versions)
+        return await _send_json(send, 200, {'status': 'success', 'data': models})
+    if scope['path'] != '/predict':
+        return await _send_json(send, 404, {'status': 'error', 'message': 'Not found'})
+    if scope['method'] != 'POST':
+        return await _send_json(send, 405, {'status': 'error', 'message': 'Method not allowed'})
+
+    try:
+        await _predict(scope, receive, send)
+    except Exception as e:
+        metrics.ERRORS.inc(status='500')
+        logger.exception('Failed to score data')
+        await _send_json(send, 500, {'status': 'error', 'message': str(e)})
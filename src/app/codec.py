@@ -0,0 +1,74 @@
+"""
+JSON encoding and decoding of /predict requests and responses.
+
+orjson is used when it is installed (pip install orjson, or the fast-json extra): it parses
+request bodies several times faster than the json module and serializes NumPy arrays directly.
+Otherwise arrays are converted with tolist() and serialized with the json module.
+"""
+import os
+import json
+import gzip
+import numpy as np
+import pandas as pd
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Responses of at least GZIP_MIN_BYTES are compressed for clients that accept gzip
+GZIP_MIN_BYTES = int(os.environ.get('GZIP_MIN_BYTES', 16384))
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', 1))
+
+
+def _default(obj):
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+def loads(body):
+    """ Parses a JSON request body (bytes). An empty body is an empty object """
+    if not body:
+        return {}
+    if orjson is not None:
+        try:
+            return orjson.loads(body)
+        except orjson.JSONDecodeError as e:
+            raise ValueError(str(e))
+    return json.loads(body)
+
+
+def dumps(response):
+    """ Serializes a response to JSON bytes. NumPy arrays and scalars are written directly """
+    if orjson is not None:
+        return orjson.dumps(response, default=_default, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(response, default=_default).encode()
+
+
+def frame(columns):
+    """
+    Returns the raw DataFrame of a column-oriented payload: {column name: list of values}.
+    Raises ValueError if the columns don't all have the same length.
+    """
+
+    if not isinstance(columns, dict):
+        raise ValueError('columns should map column names to lists of values')
+    lengths = {len(values) if isinstance(values, list) else -1 for values in columns.values()}
+    if len(lengths) > 1 or -1 in lengths:
+        raise ValueError('columns should be lists of the same length')
+    return pd.DataFrame(columns)
+
+
+def compress(body, accept_encoding):
+    """
+    Returns (body, extra headers): the body compressed with gzip if it is large and the client
+    accepts gzip (Accept-Encoding header), otherwise the body unchanged
+    """
+
+    accepted = [part.split(';')[0].strip() for part in (accept_encoding or '').split(',')]
+    if len(body) < GZIP_MIN_BYTES or 'gzip' not in accepted:
+        return body, {}
+    return gzip.compress(body, GZIP_LEVEL), {'Content-Encoding': 'gzip', 'Vary': 'Accept-Encoding'}
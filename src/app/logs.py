@@ -0,0 +1,45 @@
+import sys
+import json
+import queue
+import atexit
+import logging
+from logging.handlers import QueueHandler, QueueListener
+
+
+class JsonFormatter(logging.Formatter):
+    """ Formats log records as one JSON object per line, including the record's 'fields' extra """
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def get_logger(name='house_prices', stream=sys.stdout, level=logging.INFO):
+    """
+    Returns a logger whose records are put on an in-memory queue by the calling thread and
+    formatted / written by a background listener thread, so logging never blocks on I/O
+    """
+
+    logger = logging.getLogger(name)
+    if logger.handlers:
+        return logger
+
+    log_queue = queue.Queue(-1)
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(JsonFormatter())
+    listener = QueueListener(log_queue, handler)
+    listener.start()
+    atexit.register(listener.stop)
+
+    logger.addHandler(QueueHandler(log_queue))
+    logger.setLevel(level)
+    logger.propagate = False
+    return logger
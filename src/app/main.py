@@ -1,74 +1,232 @@
 import os
+import time
 import pandas as pd
-import joblib
+import codec
+import scoring
+import admission
+import metrics
+import logs
 
-from flask import Flask, request
+from flask import Flask, Response, request
 from flask_restful import Api, Resource
 
-DIR = os.path.abspath(os.path.dirname(__file__))
-PICKLE_DIR = os.path.join(DIR, 'pickle')
+logger = logs.get_logger()
 
 
-# Start RESTful app
+# Start RESTful app. Bodies larger than MAX_CONTENT_MB are rejected before being parsed.
 app = Flask(__name__)
+app.config['MAX_CONTENT_LENGTH'] = int(float(os.environ.get('MAX_CONTENT_MB', 512)) * 2**20)
 api = Api(app)
 
 
-def load_model():
-    app.config['preprocessor'] = joblib.load(os.path.join(PICKLE_DIR, 'PreProcessor.pkl'))
-    app.config['model'] = joblib.load(os.path.join(PICKLE_DIR, 'Model.pkl'))
+def get_option(name, payload):
+    """ Returns an optional request argument, sent in the JSON body or as a form field """
+    if payload and name in payload.keys():
+        return payload[name]
+    return request.form.get(name)
+
+
+def get_budget(payload):
+    """
+    Returns the optional latency budget in seconds, sent as 'budget_ms'.
+    Raises ValueError if it is not a positive number (see scoring.parse_budget)
+    """
+    return scoring.parse_budget(get_option('budget_ms', payload))
 
 
 class Predict(Resource):
     """
     Returns predictions using the trained model (data will be processed first)
-    The POST request needs to contain a 'data' argument, sent as a file or in JSON format.
+    The POST request needs to contain a 'data' argument, sent as a file or in JSON format
+    (a list of rows), or a 'columns' argument in JSON format (column name -> list of values,
+    faster to parse for large batches), or an 'ids' argument in JSON format with the Ids of
+    houses in the feature store: their precomputed features (and predictions) are then looked
+    up instead of sending raw data.
+    An optional 'budget_ms' argument sets a latency budget: trees are then evaluated in a fixed
+    order until the budget is spent, and the response also contains the number of trees used
+    and the estimated error bound of each prediction.
+    An optional 'model_version' argument scores with another model version loaded from the
+    model registry (see GET /models) instead of the default.
+    Requests are rejected with 413 when they have too many rows, and with 429 / 503 and a
+    Retry-After header when the service is overloaded (see admission.py).
+    Large responses are compressed with gzip when the client accepts it.
 
     Example use:
     curl -X POST -F data=@data/raw/test.csv http://127.0.0.1:8080/predict
+    curl -X POST -F data=@data/raw/test.csv -F budget_ms=50 http://127.0.0.1:8080/predict
+    curl -X POST -H 'Content-Type: application/json' -d '{"ids": [1461, 1462]}' \
+        http://127.0.0.1:8080/predict
+    curl -X POST -H 'Content-Type: application/json' --compressed \
+        -d '{"columns": {"OverallQual": [7, 5], "Neighborhood": ["NAmes", "OldTown"]}}' \
+        http://127.0.0.1:8080/predict
+    curl -X POST -F data=@data/raw/test.csv -F model_version=20200601-120000 \
+        http://127.0.0.1:8080/predict
     """
 
     def post(self):
         """
         Handles post request
         """
+        start = time.perf_counter()
+        try:
+            return self._post(start)
+        except Exception:
+            metrics.ERRORS.inc(status='500')
+            logger.exception('Failed to score data')
+            raise
 
-        # Load model
-        if not app.config.get('model'):
-            load_model()
+    def _post(self, start):
 
         # Load data
-        if request.json and 'data' in request.json.keys():
-            print('JSON data received. Scoring data...')
-            X = pd.DataFrame(request.json['data'])
-
-        elif request.files and 'data' in request.files.keys():
-            print('File received. Scoring data...')
-            X = pd.read_csv(request.files['data'])
+        try:
+            with metrics.timed('parse'):
+                payload = codec.loads(request.get_data()) if request.is_json else None
+                files = request.files
+        except ValueError as e:
+            metrics.ERRORS.inc(status='400')
+            return {'status': 'error', 'message': f'Invalid JSON: {e}'}, 400
+        if payload is not None and not isinstance(payload, dict):
+            metrics.ERRORS.inc(status='400')
+            return {'status': 'error', 'message': 'The JSON body should be an object'}, 400
+        X = ids = None
+        if payload and 'ids' in payload.keys():
+            try:
+                ids = scoring.parse_ids(payload['ids'])
+            except ValueError as e:
+                metrics.ERRORS.inc(status='400')
+                return {'status': 'error', 'message': str(e)}, 400
+            source = 'ids'
+
+        elif payload and 'columns' in payload.keys():
+            try:
+                with metrics.timed('dataframe'):
+                    X = codec.frame(payload['columns'])
+            except ValueError as e:
+                metrics.ERRORS.inc(status='400')
+                return {'status': 'error', 'message': str(e)}, 400
+            source = 'columns'
+
+        elif payload and 'data' in payload.keys():
+            with metrics.timed('dataframe'):
+                X = pd.DataFrame(payload['data'])
+            source = 'json'
+
+        elif files and 'data' in files.keys():
+            with metrics.timed('dataframe'):
+                X = pd.read_csv(files['data'])
+            source = 'file'
 
         # Check that data has been sent as a file or as json
-        elif not (request.files or request.json):
+        else:
+            metrics.ERRORS.inc(status='400')
             response = {
                 'status': 'error',
                 'message': 'Send data as file or json in a POST request'
             }
             return response, 400
 
-        # Preprocess data and make predictions
-        X_pp = app.config['preprocessor'].transform(X)
-        y_pred = app.config['model'].predict(X_pp)
+        # Latency budget, validated before the request waits for a scoring slot
+        try:
+            budget = None if ids is not None else get_budget(payload)
+        except ValueError as e:
+            metrics.ERRORS.inc(status='400')
+            return {'status': 'error', 'message': str(e)}, 400
+
+        # Model version to score with, kept for the whole request even if the default is swapped
+        name = get_option('model_version', payload)
+        try:
+            model = scoring.artifacts(name)
+        except KeyError:
+            metrics.ERRORS.inc(status='404')
+            return {'status': 'error', 'message': f'Unknown model version: {name}'}, 404
+
+        # Preprocess data and make predictions, within the latency budget if one was sent
+        n_rows = len(X) if ids is None else len(ids)
+        try:
+            with admission.controller.admit(n_rows):
+                if ids is None:
+                    response = scoring.score(X, budget, start, model)
+                else:
+                    response = scoring.score_ids(ids, model)
+        except admission.Overloaded as e:
+            metrics.ERRORS.inc(status=str(e.status))
+            logger.warning(e.message, extra={'fields': {'status': e.status, 'rows': n_rows}})
+            return e.response, e.status, e.headers
+        except scoring.StaleFeatures as e:
+            metrics.ERRORS.inc(status='409')
+            return {'status': 'error', 'message': str(e)}, 409
+
+        # Id requests need a feature store
+        if response is None:
+            metrics.ERRORS.inc(status='404')
+            return {'status': 'error', 'message': 'No feature store to look up Ids in'}, 404
 
         # Respond with predictions
-        print('Successfully scored data using model.')
-        response = {
-            'status': 'success',
-            'data': list(y_pred)
-        }
-        return response, 200
+        version = model['version']
+        with metrics.timed('serialize', version):
+            body, headers = codec.compress(codec.dumps(response),
+                                           request.headers.get('Accept-Encoding'))
+        metrics.ROWS.observe(n_rows, model_version=version)
+        metrics.REQUESTS.inc(model_version=version)
+        metrics.mark_startup('first_prediction')
+        logger.info('Scored data', extra={'fields': {
+            'source': source, 'rows': n_rows, 'model_version': version,
+            'seconds': time.perf_counter() - start
+        }})
+        return Response(body, 200, headers=headers, mimetype='application/json')
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """ Metrics of this worker process in the Prometheus text format """
+    scoring.drift_report()
+    return Response(metrics.registry.expose(), content_type=metrics.CONTENT_TYPE)
+
+
+@app.route('/drift')
+def drift():
+    """ Drift of the raw features and predictions against the training data, for all workers """
+    report = scoring.drift_report()
+    if report is None:
+        return {'status': 'error', 'message': 'No drift baseline'}, 404
+    return {'status': 'success', 'data': report}
+
+
+@app.route('/models')
+def models():
+    """ Loaded model versions, and which one is the default """
+    return {'status': 'success', 'data': scoring.versions()}
+
+
+@app.route('/shadow')
+def shadow_summary():
+    """ Prediction differences and latencies of the shadow models (SHADOW_MODELS) """
+    summary = scoring.shadow_summary()
+    if summary is None:
+        return {'status': 'error', 'message': 'No shadow models'}, 404
+    return {'status': 'success', 'data': summary}
+
+
+@app.route('/profile')
+def step_profile():
+    """
+    PreProcessor step profile of this worker process, when started with PROFILE_STEPS=1.
+    ?format=csv (default), collapsed (flame graph folded stacks) or chrome (trace events)
+    """
+    report = scoring.profile_report(request.args.get('format', 'csv'))
+    if report is None:
+        return {'status': 'error', 'message': 'Step profiling is disabled'}, 404
+    content_type, body = report
+    return Response(body, content_type=content_type)
 
 
 # Add endpoints to RESTful api
 api.add_resource(Predict, '/predict')
+metrics.mark_startup('imported')
+
+# Load the model when the worker starts instead of on the first request
+if os.environ.get('PRELOAD_MODEL', '0') == '1':
+    scoring.load_model()
 
 # For local debugging only
 if __name__ == '__main__':
@@ -0,0 +1,184 @@
+import os
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Fallback process start time, when /proc is not available
+_imported = time.time()
+
+# Default histogram buckets (seconds)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+ROW_BUCKETS = (1, 10, 100, 1000, 10000, 100000, 1000000)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = [(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in pairs]
+    return '{' + ','.join(f'{k}="{v}"' for k, v in escaped) + '}'
+
+
+class _Metric():
+
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(labels.get(name, '') for name in self.labels)
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._expose_value(key, value))
+        return lines
+
+    def _expose_value(self, key, value):
+        return [f'{self.name}{_format_labels(self.labels, key)} {value}']
+
+
+class Counter(_Metric):
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    """ Cumulative histogram: per label set, counts per bucket plus the sum of observations """
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.))
+            counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def observe_many(self, values, **labels):
+        """ Observes each of a list of values """
+        key = self._key(labels)
+        indices = [bisect_left(self.buckets, value) for value in values]
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.))
+            for i in indices:
+                counts[i] += 1
+            self._values[key] = (counts, total + sum(values))
+
+    def _expose_value(self, key, value):
+        counts, total = value
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets + ('+Inf',), counts):
+            cumulative += count
+            labels = _format_labels(self.labels, key, [('le', bound)])
+            lines.append(f'{self.name}_bucket{labels} {cumulative}')
+        labels = _format_labels(self.labels, key)
+        lines.append(f'{self.name}_sum{labels} {total}')
+        lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class Registry():
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def expose(self):
+        """ Returns all metrics in the Prometheus text exposition format """
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.expose())
+        return '\n'.join(lines) + '\n'
+
+
+# Metrics of the serving process
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+registry = Registry()
+STAGE_SECONDS = registry.register(Histogram(
+    'predict_stage_seconds', 'Time spent in each /predict stage', ['stage', 'model_version']))
+STEP_SECONDS = registry.register(Histogram(
+    'preprocess_step_seconds', 'Time spent in each PreProcessor pipeline step', ['step']))
+ROWS = registry.register(Histogram(
+    'predict_rows', 'Rows per /predict request', ['model_version'], buckets=ROW_BUCKETS))
+REQUESTS = registry.register(Counter(
+    'predict_requests_total', 'Successful /predict requests', ['model_version']))
+ERRORS = registry.register(Counter(
+    'predict_errors_total', 'Failed /predict requests by HTTP status', ['status']))
+MODEL_INFO = registry.register(Gauge(
+    'model_info', 'Loaded model version', ['model_version']))
+DRIFT_PSI = registry.register(Gauge(
+    'drift_psi', 'Population stability index of each feature against the training data',
+    ['feature']))
+STARTUP_SECONDS = registry.register(Gauge(
+    'startup_seconds', 'Seconds from process start to each startup phase', ['phase']))
+_startup_phases = set()
+
+
+def process_start_time():
+    """ Unix time at which the process started (Linux), or else when this module was imported """
+    try:
+        with open('/proc/self/stat') as f:
+            start_ticks = float(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return time.time() - uptime + start_ticks / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return _imported
+
+
+def mark_startup(phase):
+    """
+    Records the time from process start to a startup phase (imported, model_loaded,
+    first_prediction) the first time it is reached
+    """
+    if phase not in _startup_phases:
+        _startup_phases.add(phase)
+        STARTUP_SECONDS.set(time.time() - process_start_time(), phase=phase)
+
+
+@contextmanager
+def timed(stage, model_version=''):
+    """ Observes the duration of the block in the predict_stage_seconds histogram """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage,
+                              model_version=model_version)
+
+
+def observe_step(record):
+    """ PreProcessor step hook (see preprocessing.add_step_hook) """
+    if record['method'] == 'transform':
+        STEP_SECONDS.observe(record['seconds'], step=record['step'])
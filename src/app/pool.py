@@ -0,0 +1,105 @@
+import os
+import math
+import tempfile
+import numpy as np
+import pandas as pd
+import joblib
+from concurrent.futures import ProcessPoolExecutor
+
+# Shard data is exchanged through memory-mapped files, in RAM (tmpfs) when available
+SHM_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+# Worker process state: preprocessor and model loaded once by the pool initializer
+_worker = {}
+
+
+def _init_worker(pickle_dir):
+    _worker['preprocessor'] = joblib.load(os.path.join(pickle_dir, 'PreProcessor.pkl'))
+    _worker['model'] = joblib.load(os.path.join(pickle_dir, 'Model.pkl'))
+
+
+def _share_frame(X, directory):
+    """
+    Writes each column of X to a .npy file that worker processes can memory-map.
+    String columns are stored as integer codes; their categories are returned for the workers.
+    Missing values keep their type (code -1 for NaN, -2 for None) as the preprocessor treats
+    them differently.
+    Returns a list of (column name, path, categories or None).
+    """
+
+    columns = []
+    for i, (name, column) in enumerate(X.items()):
+        path = os.path.join(directory, f'{i}.npy')
+        if column.dtype.kind in 'biuf':
+            np.save(path, column.to_numpy())
+            columns.append((name, path, None))
+        else:
+            codes, categories = pd.factorize(column)
+            codes[column.to_numpy() == None] = -2
+            np.save(path, codes.astype(np.int32))
+            columns.append((name, path, np.asarray(categories, dtype=object)))
+    return columns
+
+
+def _load_shard(columns, start, stop):
+    """ Rebuilds rows start:stop of the shared DataFrame from memory-mapped columns """
+
+    data = {}
+    for name, path, categories in columns:
+        values = np.load(path, mmap_mode='r')[start:stop]
+        if categories is not None:
+            # Negative codes index the trailing missing values: -1 -> NaN, -2 -> None
+            lookup = np.concatenate([categories, np.array([None, np.nan], dtype=object)])
+            values = lookup.take(values)
+        data[name] = values
+    return pd.DataFrame(data)
+
+
+def _score_shard(columns, output_path, start, stop):
+    """ Preprocesses and scores one shard, writing predictions into the shared output array """
+
+    X = _load_shard(columns, start, stop)
+    X_pp = _worker['preprocessor'].transform(X)
+    y_pred = np.load(output_path, mmap_mode='r+')
+    y_pred[start:stop] = _worker['model'].predict(X_pp)
+    y_pred.flush()
+
+
+class ScoringPool():
+    """
+    Persistent process pool with the preprocessor and model preloaded in each worker.
+    Large payloads are split into contiguous shards, one task per shard. Input columns and
+    predictions are exchanged through memory-mapped files instead of being pickled, and
+    each shard writes to its own slice of the output, so results come back in order.
+    """
+
+    def __init__(self, pickle_dir, n_workers=None, min_shard_rows=1000):
+        self.n_workers = n_workers or os.cpu_count()
+        self.min_shard_rows = min_shard_rows
+        self._executor = ProcessPoolExecutor(self.n_workers, initializer=_init_worker,
+                                             initargs=(pickle_dir,))
+
+    def predict(self, X):
+        """ Returns the predictions for all rows of the raw DataFrame X """
+
+        n_rows = len(X)
+        n_shards = max(1, min(self.n_workers, math.ceil(n_rows / self.min_shard_rows)))
+        bounds = np.linspace(0, n_rows, n_shards + 1).astype(int)
+
+        with tempfile.TemporaryDirectory(dir=SHM_DIR) as directory:
+            columns = _share_frame(X, directory)
+            output_path = os.path.join(directory, 'y_pred.npy')
+            np.lib.format.open_memmap(output_path, mode='w+', dtype=np.float64,
+                                      shape=(n_rows,)).flush()
+
+            futures = [
+                self._executor.submit(_score_shard, columns, output_path, start, stop)
+                for start, stop in zip(bounds[:-1], bounds[1:])
+            ]
+            for future in futures:
+                future.result()
+
+            return np.array(np.load(output_path, mmap_mode='r'))
+
+    def close(self):
+        self._executor.shutdown()
@@ -0,0 +1,219 @@
+import os
+import time
+import pickle
+import threading
+import collections
+import numpy as np
+import pandas as pd
+import metrics
+import logs
+
+logger = logs.get_logger()
+
+LOGGED_ROWS = metrics.registry.register(metrics.Counter(
+    'prediction_log_rows_total', 'Predictions logged to the database, by outcome', ['outcome']))
+
+
+def to_frame(records):
+    """
+    Returns the rows written to the prediction log table for a list of logged requests:
+    time logged, model version, latency, prediction and the request's features as JSON
+    """
+
+    frames = []
+    for logged_at, X, y_pred, version, seconds in records:
+        frames.append(pd.DataFrame({
+            'logged_at': pd.Timestamp(logged_at, unit='s'),
+            'model_version': version,
+            'latency_ms': 1000 * seconds,
+            'prediction': np.asarray(y_pred, dtype=float),
+            'features': X.to_json(orient='records', lines=True).splitlines()
+        }))
+    return pd.concat(frames, ignore_index=True)
+
+
+class PredictionLogger():
+    """
+    Write-behind log of served predictions.
+
+    log() only appends the request to an in-memory buffer. A background thread writes the
+    buffer with write(DataFrame) (e.g. an append to a database table) in batches of up to
+    batch_rows rows, at least every flush_seconds.
+    At most max_rows rows are buffered. When the buffer is full (the database is slow or down),
+    requests are dropped with policy='drop', or written to spill_dir with policy='spill'.
+    Spilling happens on the writer thread too: log() hands overflowing requests over in a second
+    buffer of at most max_spill_rows rows (default: max_rows), and drops them when it is full.
+    Batches which fail to be written are also spilled (or dropped). Spilled batches are written
+    to the database again once writes succeed, by any process sharing spill_dir.
+    stop() flushes the buffer before returning.
+    """
+
+    def __init__(self, write, max_rows=100000, batch_rows=5000, flush_seconds=1.,
+                 policy='drop', spill_dir=None, max_spill_rows=None):
+        if policy not in ('drop', 'spill'):
+            raise ValueError(f'Unknown policy: {policy}')
+        if policy == 'spill' and not spill_dir:
+            raise ValueError('The spill policy needs a spill_dir')
+        self.write = write
+        self.max_rows = max_rows
+        self.batch_rows = batch_rows
+        self.flush_seconds = flush_seconds
+        self.policy = policy
+        self.spill_dir = spill_dir
+        self.max_spill_rows = max_rows if max_spill_rows is None else max_spill_rows
+        self._records = collections.deque()
+        self._rows = 0
+        self._overflowing = []
+        self._overflow_rows = 0
+        self._condition = threading.Condition()
+        self._stopping = False
+        self._thread = None
+        self._n_spilled = 0
+
+    def log(self, X, y_pred, version, seconds):
+        """
+        Logs a served request: raw rows X (DataFrame), predictions, model version and latency.
+        Returns False if the request was dropped or spilled because the buffer is full.
+        """
+
+        record = (time.time(), X, y_pred, version, seconds)
+        with self._condition:
+            if self._rows + len(X) <= self.max_rows:
+                self._records.append(record)
+                self._rows += len(X)
+                if self._rows >= self.batch_rows:
+                    self._condition.notify()
+                return True
+
+            # Spilled by the writer thread, so that the request doesn't wait for the disk
+            if self.policy == 'spill' and self._overflow_rows + len(X) <= self.max_spill_rows:
+                self._overflowing.append(record)
+                self._overflow_rows += len(X)
+                self._condition.notify()
+                return False
+        self._drop(len(X), 'buffer full')
+        return False
+
+    def _drop(self, n_rows, reason):
+        LOGGED_ROWS.inc(n_rows, outcome='dropped')
+        logger.warning('Dropped predictions', extra={'fields': {'rows': n_rows, 'reason': reason}})
+
+    def _overflow(self, records, reason):
+        n_rows = sum(len(record[1]) for record in records)
+        if self.policy == 'spill':
+            try:
+                self._spill(records)
+                LOGGED_ROWS.inc(n_rows, outcome='spilled')
+                return
+            except Exception:
+                logger.exception('Failed to spill predictions')
+        self._drop(n_rows, reason)
+
+    def _spill(self, records):
+        os.makedirs(self.spill_dir, exist_ok=True)
+        with self._condition:
+            self._n_spilled += 1
+            name = f'{time.time():.6f}-{os.getpid()}-{self._n_spilled}.pkl'
+        path = os.path.join(self.spill_dir, name)
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(records, f)
+        os.replace(path + '.tmp', path)
+
+    def spilled(self):
+        """ Paths of the spilled batches, oldest first """
+        if not self.spill_dir or not os.path.isdir(self.spill_dir):
+            return []
+        names = sorted(n for n in os.listdir(self.spill_dir) if n.endswith('.pkl'))
+        return [os.path.join(self.spill_dir, n) for n in names]
+
+    def _claim(self, path):
+        """ Reads and removes a spilled batch, or returns None if another process claimed it """
+        claimed = f'{path}.{os.getpid()}'
+        try:
+            os.replace(path, claimed)
+        except FileNotFoundError:
+            return None
+        with open(claimed, 'rb') as f:
+            records = pickle.load(f)
+        os.remove(claimed)
+        return records
+
+    def _take(self):
+        """ Removes up to batch_rows rows of records from the buffer """
+        with self._condition:
+            records, rows = [], 0
+            while self._records and (not records or rows < self.batch_rows):
+                record = self._records.popleft()
+                records.append(record)
+                rows += len(record[1])
+            self._rows -= rows
+            return records
+
+    def _write(self, records):
+        """ Writes records to the database. Returns False (and spills or drops) on failure """
+        try:
+            self.write(to_frame(records))
+        except Exception:
+            logger.exception('Failed to write predictions')
+            self._overflow(records, 'write failed')
+            return False
+        LOGGED_ROWS.inc(sum(len(record[1]) for record in records), outcome='written')
+        return True
+
+    def flush(self):
+        """
+        Spills the requests which overflowed the buffer, writes the buffered requests, then the
+        spilled batches if writes succeed
+        """
+
+        with self._condition:
+            overflowing, self._overflowing, self._overflow_rows = self._overflowing, [], 0
+        if overflowing:
+            self._overflow(overflowing, 'buffer full')
+
+        succeeded = True
+        while True:
+            records = self._take()
+            if not records:
+                break
+            succeeded = self._write(records) and succeeded
+        if not succeeded:
+            return
+        for path in self.spilled():
+            records = self._claim(path)
+            if records is not None and not self._write(records):
+                return
+
+    def _work(self):
+        while True:
+            with self._condition:
+                idle = self._rows < self.batch_rows and not self._overflowing
+                if not self._stopping and idle:
+                    self._condition.wait(self.flush_seconds)
+                stopping = self._stopping
+            self.flush()
+            if stopping:
+                return
+
+    def start(self):
+        """ Starts the background writer thread """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._work, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """ Flushes the buffer and stops the writer thread """
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        else:
+            self.flush()
+
+    def pending(self):
+        """ Number of buffered rows """
+        with self._condition:
+            return self._rows
@@ -0,0 +1,206 @@
+import os
+import time
+import shutil
+import threading
+import numpy as np
+import pandas as pd
+import logs
+
+logger = logs.get_logger()
+
+# Pickles making up a model version
+REQUIRED_FILES = ['PreProcessor.pkl', 'Model.pkl']
+
+
+class ModelRegistry():
+    """
+    Serves several model versions side by side from a directory with one folder per version,
+    each holding PreProcessor.pkl, Model.pkl and optionally Calibration.pkl.
+
+    A background thread polls the directory. New or changed versions are loaded with
+    load(folder) and validated on a smoke batch (smoke.csv in the version folder or in the
+    registry directory) before they are added, so requests never see a half-loaded version.
+    Versions are loaded without validation, with a warning, when there is no smoke batch.
+    Versions are swapped in by replacing the whole dictionary of versions: requests that already
+    hold a version keep using it until they finish.
+
+    The default version is the one named in a CURRENT file in the directory, or else the most
+    recently published one. Versions should be published atomically (written to another folder
+    of the same file system, then renamed into the directory). At most max_versions versions
+    are kept loaded: the default and the most recent other versions.
+    """
+
+    def __init__(self, directory, load, poll_seconds=5, max_versions=3, on_default=None,
+                 on_remove=None):
+        self.directory = directory
+        self.load = load
+        self.poll_seconds = poll_seconds
+        self.max_versions = max_versions
+        self.on_default = on_default
+        self.on_remove = on_remove
+        self.default = None
+        self._versions = {}
+        self._signatures = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _scan(self):
+        """ Returns {name: (file signature, modification time)} of the complete version folders """
+
+        found = {}
+        if not os.path.isdir(self.directory):
+            return found
+        for entry in os.scandir(self.directory):
+            if not entry.is_dir() or entry.name.startswith('.') or entry.name.endswith('.tmp'):
+                continue
+            files = sorted(os.scandir(entry.path), key=lambda f: f.name)
+            names = {f.name for f in files}
+            if not all(name in names for name in REQUIRED_FILES):
+                continue
+            signature = [(f.name, f.stat().st_size, f.stat().st_mtime_ns) for f in files]
+            found[entry.name] = (signature, entry.stat().st_mtime)
+        return found
+
+    def _smoke_batch(self, folder):
+        for path in [os.path.join(folder, 'smoke.csv'), os.path.join(self.directory, 'smoke.csv')]:
+            if os.path.exists(path):
+                return pd.read_csv(path)
+        return None
+
+    def validate(self, artifacts, X):
+        """ Checks that the version returns one finite prediction per smoke batch row """
+
+        if X is None:
+            return
+        y_pred = np.asarray(artifacts['model'].predict(artifacts['preprocessor'].transform(X)),
+                            dtype=float)
+        if y_pred.shape != (len(X),) or not np.isfinite(y_pred).all():
+            raise ValueError('Invalid predictions on the smoke batch')
+
+    def _current(self):
+        path = os.path.join(self.directory, 'CURRENT')
+        if os.path.exists(path):
+            with open(path) as f:
+                return f.read().strip()
+        return None
+
+    def refresh(self):
+        """ Loads new and changed versions, drops removed ones and updates the default """
+
+        found = self._scan()
+        versions = dict(self._versions)
+        removed = [versions.pop(name) for name in list(versions) if name not in found]
+        for name in list(self._signatures):
+            if name not in found:
+                del self._signatures[name]
+
+        for name, (signature, _) in found.items():
+            if self._signatures.get(name) == signature:
+                continue
+            self._signatures[name] = signature
+            folder = os.path.join(self.directory, name)
+            try:
+                artifacts = self.load(folder)
+                X = self._smoke_batch(folder)
+                if X is None:
+                    logger.warning('No smoke.csv, model version loaded without validation',
+                                   extra={'fields': {'model_name': name}})
+                self.validate(artifacts, X)
+            except Exception:
+                logger.exception('Failed to load model version',
+                                 extra={'fields': {'model_name': name}})
+                continue
+            artifacts['name'] = name
+            if name in versions:
+                removed.append(versions[name])
+            versions[name] = artifacts
+            logger.info('Loaded model version', extra={'fields': {
+                'model_name': name, 'model_version': artifacts['version']}})
+
+        # Default: CURRENT if it is loaded, otherwise the most recently published version
+        by_age = sorted(versions, key=lambda name: found[name][1], reverse=True)
+        current = self._current()
+        default = current if current in versions else (by_age[0] if by_age else None)
+
+        # Keep the default and the most recent other versions loaded
+        others = [name for name in by_age if name != default]
+        for name in others[max(self.max_versions - 1, 0):]:
+            removed.append(versions.pop(name))
+
+        previous = self._versions.get(self.default)
+        self._versions = versions
+        self.default = default
+
+        # Release removed versions first, except the pickles of a version still loaded (e.g. the
+        # same model republished), so that the new default is never released after activation
+        loaded = {(a.get('pickle_dir'), a['version']) for a in versions.values()}
+        for artifacts in removed:
+            if self.on_remove and (artifacts.get('pickle_dir'), artifacts['version']) not in loaded:
+                self.on_remove(artifacts)
+        if default is not None and versions[default] is not previous and self.on_default:
+            self.on_default(versions[default])
+
+    def get(self, name=None):
+        """ Returns the artifacts of a version (the default if name is None), or raises KeyError """
+        versions = self._versions
+        return versions[self.default if name is None else name]
+
+    def versions(self):
+        """ Name, version label and default flag of each loaded version """
+        return [
+            {'name': name, 'model_version': artifacts['version'], 'default': name == self.default}
+            for name, artifacts in sorted(self._versions.items())
+        ]
+
+    def _watch(self):
+        while not self._stop.wait(self.poll_seconds):
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception('Failed to refresh the model registry')
+
+    def start(self):
+        """ Starts polling the directory in a background thread """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._watch, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+def publish(folder, directory, name=None, default=False):
+    """
+    Copies a folder of pickles into the registry directory as a new version, named after the
+    current time by default, and optionally makes it the default. Returns the version name.
+    """
+
+    name = name or time.strftime('%Y%m%d-%H%M%S')
+    tmp_path = os.path.join(directory, f'{name}.tmp')
+    shutil.copytree(folder, tmp_path)
+    os.utime(tmp_path)
+    os.rename(tmp_path, os.path.join(directory, name))
+
+    if default:
+        with open(os.path.join(directory, 'CURRENT.tmp'), 'w') as f:
+            f.write(name)
+        os.replace(os.path.join(directory, 'CURRENT.tmp'), os.path.join(directory, 'CURRENT'))
+    return name
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Publish a folder of pickles as a model version')
+    parser.add_argument('folder', help='Folder with PreProcessor.pkl and Model.pkl')
+    parser.add_argument('directory', help='Registry directory (MODEL_REGISTRY_DIR)')
+    parser.add_argument('--name', help='Version name, defaults to the current time')
+    parser.add_argument('--default', action='store_true', help='Make it the default version')
+    args = parser.parse_args()
+
+    os.makedirs(args.directory, exist_ok=True)
+    print('Published', publish(args.folder, args.directory, args.name, args.default))
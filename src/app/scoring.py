@@ -0,0 +1,474 @@
+import os
+import json
+import atexit
+import time
+import hashlib
+import tempfile
+import threading
+import numpy as np
+import pandas as pd
+import joblib
+import metrics
+import resources
+import feature_store
+from feature_cache import transformer_hash
+import logs
+
+logger = logs.get_logger()
+
+# Modules only needed by some requests or settings (anytime, pool, profiling, registry, shadow,
+# drift, prediction_log, database) are imported when first used, to keep the start-up of the
+# serving process short. sklearn is imported when the pickles are loaded.
+
+DIR = os.path.abspath(os.path.dirname(__file__))
+PICKLE_DIR = os.environ.get('PICKLE_DIR', os.path.join(DIR, 'pickle'))
+
+# Precomputed features and predictions of known houses, for requests by Id (see feature_store.py)
+FEATURE_STORE_DIR = os.environ.get('FEATURE_STORE_DIR', os.path.join(PICKLE_DIR, 'FeatureStore'))
+
+# Payloads with at least POOL_MIN_ROWS rows are scored in parallel by a process pool of
+# POOL_WORKERS processes, by default the CPUs available to the service (see resources.py)
+# shared by its WEB_CONCURRENCY web worker processes (gunicorn's number of workers)
+POOL_MIN_ROWS = int(os.environ.get('POOL_MIN_ROWS', 20000))
+POOL_WORKERS = int(os.environ.get('POOL_WORKERS', 0)) or max(
+    1, resources.available_cpus() // int(os.environ.get('WEB_CONCURRENCY', 1)))
+
+# Opt-in step profiling of the serving process (exported on /profile)
+PROFILE_STEPS = os.environ.get('PROFILE_STEPS', '0') == '1'
+PROFILE_MEMORY = os.environ.get('PROFILE_MEMORY', '0') == '1'
+PROFILE_MAX_RECORDS = int(os.environ.get('PROFILE_MAX_RECORDS', 100000))
+
+# Optional directory of model versions served side by side and hot-swapped (see registry.py)
+MODEL_REGISTRY_DIR = os.environ.get('MODEL_REGISTRY_DIR')
+REGISTRY_POLL_SECONDS = float(os.environ.get('REGISTRY_POLL_SECONDS', 5))
+
+# Candidate models scored in the background on the same traffic (see shadow.py): comma separated
+# folders with Model.pkl, and PreProcessor.pkl if the candidate has its own preprocessing
+SHADOW_MODELS = os.environ.get('SHADOW_MODELS')
+SHADOW_QUEUE = int(os.environ.get('SHADOW_QUEUE', 8))
+SHADOW_WORKERS = int(os.environ.get('SHADOW_WORKERS', 1))
+
+# Monitor of the drift of incoming data against the training data (see drift.py), enabled when
+# the baseline exists. Counts of the worker processes are merged through DRIFT_DIR. Drift is
+# computed on the rows of the last DRIFT_WINDOW_SECONDS (0: every row since the start).
+DRIFT_BASELINE = os.environ.get('DRIFT_BASELINE', os.path.join(PICKLE_DIR, 'DriftBaseline.json'))
+DRIFT_DIR = os.environ.get('DRIFT_DIR', os.path.join(tempfile.gettempdir(), 'house_prices_drift'))
+DRIFT_FLUSH_SECONDS = float(os.environ.get('DRIFT_FLUSH_SECONDS', 30))
+DRIFT_WINDOW_SECONDS = float(os.environ.get('DRIFT_WINDOW_SECONDS', 3600))
+
+# Optional log of served predictions, appended to this table of the database (see database.py)
+# in batches by a background thread (see prediction_log.py). When more than
+# PREDICTION_LOG_MAX_ROWS rows are waiting, requests are dropped ('drop' policy) or written to
+# PREDICTION_LOG_SPILL_DIR and logged later ('spill' policy).
+PREDICTION_LOG_TABLE = os.environ.get('PREDICTION_LOG_TABLE')
+PREDICTION_LOG_MAX_ROWS = int(os.environ.get('PREDICTION_LOG_MAX_ROWS', 100000))
+PREDICTION_LOG_BATCH_ROWS = int(os.environ.get('PREDICTION_LOG_BATCH_ROWS', 5000))
+PREDICTION_LOG_FLUSH_SECONDS = float(os.environ.get('PREDICTION_LOG_FLUSH_SECONDS', 1))
+PREDICTION_LOG_POLICY = os.environ.get('PREDICTION_LOG_POLICY', 'drop')
+PREDICTION_LOG_SPILL_DIR = os.environ.get(
+    'PREDICTION_LOG_SPILL_DIR', os.path.join(tempfile.gettempdir(), 'house_prices_predictions'))
+
+# Default model artifacts (preprocessor, model, calibration, version), profiler, feature store,
+# model registry, shadow scorer, drift monitor and prediction log, shared by the Flask and ASGI apps
+state = {}
+_lock = threading.Lock()
+
+# Scoring process pools, one per model version, started on first use (guarded by _lock), and the
+# versions whose pool was closed
+_pools = {}
+_retired = set()
+
+
+def load_artifacts(pickle_dir):
+    """ Loads the preprocessor, model and optional calibration from a folder of pickles """
+
+    artifacts = {
+        'pickle_dir': pickle_dir,
+        'preprocessor': joblib.load(os.path.join(pickle_dir, 'PreProcessor.pkl')),
+        'model': joblib.load(os.path.join(pickle_dir, 'Model.pkl')),
+        'calibration': None,
+        # Model version label: hash of the pickled model
+        'version': feature_store.model_version(os.path.join(pickle_dir, 'Model.pkl'))
+    }
+
+    # Preprocessor version label, as recorded in the feature store (before the timing wrappers)
+    artifacts['preprocessor_version'] = transformer_hash(artifacts['preprocessor'])
+
+    # Time each preprocessing step
+    artifacts['preprocessor'].instrument()
+
+    # Optional offline calibration of the accuracy lost per number of trees (see anytime.py)
+    calibration_path = os.path.join(pickle_dir, 'Calibration.pkl')
+    if os.path.exists(calibration_path):
+        artifacts['calibration'] = joblib.load(calibration_path)
+    return artifacts
+
+
+def activate(artifacts):
+    """ Makes the artifacts the default for new requests. Requests in progress keep theirs """
+
+    with _lock:
+        previous = state.get('version')
+        state.update((key, artifacts.get(key)) for key in
+                     ['pickle_dir', 'preprocessor', 'preprocessor_version', 'model', 'calibration',
+                      'version'])
+        _retired.discard((artifacts.get('pickle_dir'), artifacts['version']))
+    if previous and previous != artifacts['version']:
+        metrics.MODEL_INFO.set(0, model_version=previous)
+    metrics.MODEL_INFO.set(1, model_version=artifacts['version'])
+
+
+def release(artifacts):
+    """ Stops the process pool of a version that is no longer served """
+
+    key = (artifacts['pickle_dir'], artifacts['version'])
+    with _lock:
+        _retired.add(key)
+        scoring_pool = _pools.pop(key, None)
+    if scoring_pool is not None:
+        threading.Thread(target=scoring_pool.close).start()
+
+
+def load_model():
+    """
+    Loads the default model: the registry's default version when MODEL_REGISTRY_DIR is set
+    and has a version, otherwise the pickles in PICKLE_DIR
+    """
+
+    import preprocessing
+    if metrics.observe_step not in preprocessing._step_hooks:
+        preprocessing.add_step_hook(metrics.observe_step)
+    if PROFILE_STEPS and not state.get('profiler'):
+        import profiling
+        state['profiler'] = profiling.StepProfiler(PROFILE_MEMORY, PROFILE_MAX_RECORDS).start()
+
+    # Optional feature store, opened (and reopened after a refresh) on Id requests
+    if not state.get('feature_store'):
+        state['feature_store'] = feature_store.FeatureStore(FEATURE_STORE_DIR)
+
+    if MODEL_REGISTRY_DIR and not state.get('registry'):
+        import registry
+        state['registry'] = registry.ModelRegistry(
+            MODEL_REGISTRY_DIR, load_artifacts, REGISTRY_POLL_SECONDS,
+            on_default=activate, on_remove=release
+        )
+        state['registry'].refresh()
+        state['registry'].start()
+    if not state.get('model'):
+        activate(load_artifacts(PICKLE_DIR))
+
+    if os.path.exists(DRIFT_BASELINE) and not state.get('drift'):
+        state['drift'] = load_drift_monitor(DRIFT_BASELINE)
+
+    if SHADOW_MODELS and not state.get('shadow'):
+        import shadow
+        candidates = [load_candidate(folder) for folder in SHADOW_MODELS.split(',')]
+        state['shadow'] = shadow.ShadowScorer(candidates, SHADOW_QUEUE, SHADOW_WORKERS).start()
+
+    if PREDICTION_LOG_TABLE and not state.get('prediction_log'):
+        state['prediction_log'] = load_prediction_log(PREDICTION_LOG_TABLE)
+    metrics.mark_startup('model_loaded')
+
+
+def load_prediction_log(table):
+    """
+    Write-behind log of served predictions to a table of the configured database, flushed
+    when the process exits
+    """
+
+    import database
+    import prediction_log
+    url, db, schema = database.get_config()
+
+    def write(data):
+        database.save(data, url, db, schema, table, if_exists='append',
+                      indexes=['logged_at', 'model_version'])
+
+    log = prediction_log.PredictionLogger(
+        write, PREDICTION_LOG_MAX_ROWS, PREDICTION_LOG_BATCH_ROWS, PREDICTION_LOG_FLUSH_SECONDS,
+        PREDICTION_LOG_POLICY, PREDICTION_LOG_SPILL_DIR
+    ).start()
+    atexit.register(log.stop)
+    return log
+
+
+def shutdown():
+    """ Writes the buffered prediction log before the server stops """
+    log = state.get('prediction_log')
+    if log is not None:
+        log.stop()
+
+
+def _log(X, y_pred, model, seconds):
+    """ Adds a scored batch to the prediction log. Logging never fails a request """
+    log = state.get('prediction_log')
+    if log is not None:
+        try:
+            log.log(X, y_pred, model['version'], seconds)
+        except Exception:
+            logger.exception('Failed to log predictions')
+
+
+def load_drift_monitor(path):
+    """ Drift monitor of a baseline, sharing counts with the workers using the same baseline """
+
+    import drift
+    with open(path, 'rb') as f:
+        content = f.read()
+    directory = os.path.join(DRIFT_DIR, hashlib.sha1(content).hexdigest()[:12])
+    return drift.DriftMonitor(json.loads(content), directory, DRIFT_FLUSH_SECONDS,
+                              DRIFT_WINDOW_SECONDS or None)
+
+
+def drift_report():
+    """ Drift of each feature and of the predictions, merged across workers, or None """
+
+    monitor = state.get('drift')
+    if monitor is None:
+        return None
+    report = monitor.report()
+    for name, values in report.items():
+        metrics.DRIFT_PSI.set(values['psi'], feature=name)
+    return report
+
+
+def _monitor(X, y_pred):
+    """ Counts a scored batch in the drift monitor. Monitoring never fails a request """
+    monitor = state.get('drift')
+    if monitor is not None:
+        try:
+            monitor.update(X, y_pred)
+        except Exception:
+            logger.exception('Failed to update the drift monitor')
+
+
+def load_candidate(folder):
+    """ Loads a shadow model: Model.pkl, and PreProcessor.pkl if there is one """
+
+    candidate = {
+        'name': os.path.basename(os.path.normpath(folder)),
+        'model': joblib.load(os.path.join(folder, 'Model.pkl')),
+        'preprocessor': None,
+        'version': feature_store.model_version(os.path.join(folder, 'Model.pkl'))
+    }
+    preprocessor_path = os.path.join(folder, 'PreProcessor.pkl')
+    if os.path.exists(preprocessor_path):
+        candidate['preprocessor'] = joblib.load(preprocessor_path)
+    return candidate
+
+
+def artifacts(name=None):
+    """
+    Returns the artifacts (preprocessor, model, calibration, version) to score a request with:
+    a consistent snapshot of the default, or the registry version with this name.
+    Raises KeyError if there is no such version.
+    """
+
+    if not state.get('model'):
+        load_model()
+    if name is None:
+        with _lock:
+            snapshot = dict(state)
+        snapshot.setdefault('version', 'unknown')
+        return snapshot
+    if state.get('registry') is None:
+        raise KeyError(name)
+    return state['registry'].get(name)
+
+
+def versions():
+    """ Loaded model versions """
+    if not state.get('model'):
+        load_model()
+    if state.get('registry') is not None:
+        return state['registry'].versions()
+    return [{'name': None, 'model_version': version(), 'default': True}]
+
+
+def shadow_summary():
+    """ Comparison of the shadow models with the primary model, or None without shadow models """
+    scorer = state.get('shadow')
+    return None if scorer is None else scorer.summary()
+
+
+def get_pool(model=None):
+    """
+    Returns the process pool of a model version (default: the default), started on first use,
+    or None if the version was removed (requests still using it are scored in this process)
+    """
+
+    model = model or artifacts()
+    key = (model['pickle_dir'], model['version'])
+    with _lock:
+        if key in _retired:
+            return None
+        if key not in _pools:
+            import pool
+            _pools[key] = pool.ScoringPool(model['pickle_dir'], n_workers=POOL_WORKERS)
+        return _pools[key]
+
+
+def has_raw_features(X, model=None):
+    """ Checks that the raw DataFrame X contains every feature used by the preprocessor """
+
+    model = model or artifacts()
+    return set(model['preprocessor'].raw_features).issubset(X.columns)
+
+
+def profile_report(fmt='csv'):
+    """
+    Returns (content type, body) of the step profile in the requested format: csv (summary),
+    collapsed (flame graph folded stacks) or chrome (trace events), or None if not profiling
+    """
+
+    profiler = state.get('profiler')
+    if profiler is None:
+        return None
+    if fmt == 'collapsed':
+        return 'text/plain', profiler.to_collapsed()
+    if fmt == 'chrome':
+        return 'application/json', json.dumps(profiler.to_chrome_trace(), default=str)
+    return 'text/csv', profiler.summary().to_csv(index=False)
+
+
+def version():
+    return state.get('version', 'unknown')
+
+
+def predict(X, model=None):
+    """
+    Returns predictions for the raw DataFrame X, with the given artifacts (default: the default
+    model). Large payloads are sharded across the process pool.
+    The batch is then queued for shadow scoring, if there are shadow models.
+    """
+
+    model = model or artifacts()
+    X_pp = None
+    began = start = time.perf_counter()
+    scoring_pool = get_pool(model) if len(X) >= POOL_MIN_ROWS and model.get('pickle_dir') else None
+    if scoring_pool is not None:
+        with metrics.timed('pool_predict', model['version']):
+            y_pred = scoring_pool.predict(X[model['preprocessor'].raw_features])
+    else:
+        with metrics.timed('preprocess', model['version']):
+            X_pp = model['preprocessor'].transform(X)
+        start = time.perf_counter()
+        with metrics.timed('predict', model['version']):
+            y_pred = model['model'].predict(X_pp)
+
+    _monitor(X, y_pred)
+    _log(X, y_pred, model, time.perf_counter() - began)
+    if state.get('shadow') is not None:
+        state['shadow'].submit(X, y_pred, time.perf_counter() - start, X_pp,
+                               model['preprocessor'])
+    return y_pred
+
+
+def score(X, budget=None, start=None, model=None):
+    """
+    Returns the response body with predictions (an array, see codec.dumps) for the raw
+    DataFrame X, with the given artifacts (default: the default model).
+    With a latency budget (seconds from start, a time.perf_counter() value), trees are evaluated
+    until the budget is spent and the number of trees and error bounds are also returned.
+    """
+
+    model = model or artifacts()
+    if budget is None:
+        return {
+            'status': 'success',
+            'data': predict(X, model)
+        }
+
+    with metrics.timed('preprocess', model['version']):
+        X_pp = model['preprocessor'].transform(X)
+    import anytime
+    with metrics.timed('predict', model['version']):
+        y_pred, n_trees, error_bound = anytime.predict_anytime(
+            model['model'], X_pp, deadline=start + budget, calibration=model.get('calibration')
+        )
+    _monitor(X, y_pred)
+    _log(X, y_pred, model, time.perf_counter() - start)
+    return {
+        'status': 'success',
+        'data': y_pred,
+        'n_trees': n_trees,
+        'error_bound': [None if np.isnan(e) else e for e in error_bound]
+    }
+
+
+def parse_ids(ids):
+    """ Returns the house Ids sent in a request (a list or a single Id) as an int64 array """
+
+    ids = np.asarray(ids if isinstance(ids, list) else [ids])
+    if ids.ndim != 1 or (len(ids) and ids.dtype.kind not in 'iu'):
+        raise ValueError('ids should be a list of integer Ids')
+    return ids.astype(np.int64)
+
+
+def parse_budget(budget_ms):
+    """
+    Returns the latency budget sent in a request ('budget_ms', None if not sent) in seconds.
+    Raises ValueError if it is not a positive number of milliseconds
+    """
+
+    if budget_ms is None:
+        return None
+    try:
+        budget_ms = float(budget_ms)
+    except (TypeError, ValueError):
+        raise ValueError('budget_ms should be a number of milliseconds')
+    if not np.isfinite(budget_ms) or budget_ms <= 0:
+        raise ValueError('budget_ms should be a positive number of milliseconds')
+    return budget_ms / 1000
+
+
+class StaleFeatures(Exception):
+    """ Raised when the stored features were made by another preprocessor than the model's """
+
+
+def preprocessor_version(model):
+    """ Returns the version label of the artifacts' preprocessor (see feature_cache) """
+    version = model.get('preprocessor_version')
+    if version is None:
+        version = transformer_hash(model['preprocessor'])
+    return version
+
+
+def score_ids(ids, model=None):
+    """
+    Returns the response body with predictions for houses in the feature store, by Id
+    (an int64 array, see parse_ids), with the given artifacts (default: the default model).
+    Stored predictions are returned when they were made by the same model version, otherwise
+    the stored features are scored. Unknown Ids get null predictions and are listed in
+    'missing'. Returns None if there is no feature store, and raises StaleFeatures if the
+    stored features have to be scored but were made by another preprocessor.
+    """
+
+    model = model or artifacts()
+    start = time.perf_counter()
+    store = state.get('feature_store')
+    if store is None or not store.reload_if_changed():
+        return None
+
+    # One generation for the whole request, even if the store is refreshed meanwhile
+    store = store.snapshot()
+    with metrics.timed('lookup', model['version']):
+        positions = store.positions(ids)
+        found = positions >= 0
+        y_pred = np.full(len(ids), np.nan)
+        current = store.model_version == model['version']
+        if current:
+            y_pred[found] = store.predictions(positions[found])
+    if not current and found.any():
+        if store.meta.get('preprocessor_version') != preprocessor_version(model):
+            raise StaleFeatures('The feature store was made by another preprocessor than model '
+                                f"{model['version']}'s")
+        with metrics.timed('predict', model['version']):
+            y_pred[found] = model['model'].predict(store.features(positions[found]))
+
+    _log(pd.DataFrame({'Id': ids}), y_pred, model, time.perf_counter() - start)
+    return {
+        'status': 'success',
+        'data': [y if ok else None for y, ok in zip(y_pred.tolist(), found)],
+        'missing': ids[~found].tolist()
+    }
@@ -0,0 +1,165 @@
+import time
+import queue
+import threading
+import numpy as np
+import metrics
+import logs
+
+logger = logs.get_logger()
+
+# Buckets of the relative difference between candidate and primary predictions
+DIFF_BUCKETS = (0.001, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1)
+
+SHADOW_SECONDS = metrics.registry.register(metrics.Histogram(
+    'shadow_predict_seconds', 'Time spent scoring each batch with a shadow model',
+    ['model_version']))
+SHADOW_DIFF = metrics.registry.register(metrics.Histogram(
+    'shadow_relative_diff', 'Relative difference of shadow and primary predictions, per row',
+    ['model_version'], buckets=DIFF_BUCKETS))
+SHADOW_DROPPED = metrics.registry.register(metrics.Counter(
+    'shadow_dropped_total', 'Batches not shadow scored because the queue was full'))
+SHADOW_ERRORS = metrics.registry.register(metrics.Counter(
+    'shadow_errors_total', 'Batches a shadow model failed to score', ['model_version']))
+
+
+class ShadowScorer():
+    """
+    Scores the batches served by the primary model with candidate models, off the request path.
+
+    Batches are put on a bounded queue and scored by background threads. When the queue is full
+    the batch is dropped (and counted) rather than slowing down requests. Candidates without a
+    preprocessor score the primary model's preprocessed features. Candidates with their own
+    preprocessor ('preprocessor' key) transform the raw rows first.
+    The difference with the primary predictions and the time spent by each candidate are
+    exported as metrics and summarised by summary().
+    """
+
+    def __init__(self, candidates, max_queue=8, n_workers=1):
+        self.candidates = list(candidates)
+        self.n_workers = n_workers
+        self._queue = queue.Queue(max_queue)
+        self._lock = threading.Lock()
+        self._threads = []
+        self._stats = {
+            candidate['version']: {'batches': 0, 'rows': 0, 'errors': 0, 'seconds': 0.,
+                                   'primary_seconds': 0., 'sum_abs_diff': 0.,
+                                   'sum_sq_diff': 0., 'sum_rel_diff': 0., 'max_abs_diff': 0.}
+            for candidate in self.candidates
+        }
+        self.dropped = 0
+
+    def submit(self, X, y_pred, seconds, X_pp=None, preprocessor=None):
+        """
+        Queues a batch served by the primary model: raw rows X, primary predictions y_pred and
+        the time the primary spent predicting, with its preprocessed features X_pp or else its
+        preprocessor.
+        Returns False if the batch was dropped.
+        """
+        try:
+            self._queue.put_nowait((X, np.asarray(y_pred, dtype=float), seconds, X_pp,
+                                    preprocessor))
+            return True
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            SHADOW_DROPPED.inc()
+            return False
+
+    def _score(self, X, y_pred, seconds, X_pp, preprocessor):
+        # Features of the primary model, shared by candidates without their own preprocessor
+        if X_pp is None and any(c.get('preprocessor') is None for c in self.candidates):
+            X_pp = preprocessor.transform(X)
+
+        for candidate in self.candidates:
+            version = candidate['version']
+            try:
+                start = time.perf_counter()
+                if candidate.get('preprocessor') is not None:
+                    features = candidate['preprocessor'].transform(X)
+                else:
+                    features = X_pp
+                y_shadow = np.asarray(candidate['model'].predict(features), dtype=float)
+                elapsed = time.perf_counter() - start
+            except Exception:
+                SHADOW_ERRORS.inc(model_version=version)
+                with self._lock:
+                    self._stats[version]['errors'] += 1
+                logger.exception('Shadow scoring failed', extra={'fields': {
+                    'model_version': version}})
+                continue
+
+            diff = y_shadow - y_pred
+            abs_diff = np.abs(diff)
+            relative = abs_diff / np.maximum(np.abs(y_pred), 1e-9)
+            SHADOW_SECONDS.observe(elapsed, model_version=version)
+            SHADOW_DIFF.observe_many(relative.tolist(), model_version=version)
+            with self._lock:
+                stats = self._stats[version]
+                stats['batches'] += 1
+                stats['rows'] += len(diff)
+                stats['seconds'] += elapsed
+                stats['primary_seconds'] += seconds
+                stats['sum_abs_diff'] += float(abs_diff.sum())
+                stats['sum_sq_diff'] += float((diff ** 2).sum())
+                stats['sum_rel_diff'] += float(relative.sum())
+                stats['max_abs_diff'] = max(stats['max_abs_diff'], float(abs_diff.max(initial=0)))
+
+    def _work(self):
+        while True:
+            batch = self._queue.get()
+            try:
+                if batch is None:
+                    return
+                self._score(*batch)
+            except Exception:
+                logger.exception('Shadow scoring failed')
+            finally:
+                self._queue.task_done()
+
+    def start(self):
+        """ Starts the background scoring threads """
+        for _ in range(self.n_workers - len(self._threads)):
+            thread = threading.Thread(target=self._work, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def join(self):
+        """ Waits until every queued batch is scored """
+        self._queue.join()
+
+    def stop(self):
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def summary(self):
+        """
+        Per candidate: batches and rows scored, errors, mean / root mean squared / max absolute
+        difference and mean relative difference with the primary predictions, and the time
+        spent per row by the candidate and by the primary model
+        """
+
+        with self._lock:
+            stats = {version: dict(values) for version, values in self._stats.items()}
+            dropped = self.dropped
+        candidates = []
+        for candidate in self.candidates:
+            values = stats[candidate['version']]
+            rows = max(values['rows'], 1)
+            candidates.append({
+                'name': candidate.get('name'),
+                'model_version': candidate['version'],
+                'batches': values['batches'],
+                'rows': values['rows'],
+                'errors': values['errors'],
+                'mean_abs_diff': values['sum_abs_diff'] / rows,
+                'rmse_diff': (values['sum_sq_diff'] / rows) ** 0.5,
+                'max_abs_diff': values['max_abs_diff'],
+                'mean_relative_diff': values['sum_rel_diff'] / rows,
+                'ms_per_row': 1000 * values['seconds'] / rows,
+                'primary_ms_per_row': 1000 * values['primary_seconds'] / rows
+            })
+        return {'dropped': dropped, 'queued': self._queue.qsize(), 'candidates': candidates}
@@ -0,0 +1,247 @@
+import os
+import pickle
+import numpy as np
+import pandas as pd
+import joblib
+
+DIR = os.path.abspath(os.path.dirname(__file__))
+PICKLE_DIR = os.path.join(DIR, '../pickle')
+
+# Maximum relative RMSE increase allowed for the compressed serving model
+TOLERANCE = float(os.environ.get('COMPRESSION_TOLERANCE', 0.01))
+
+# Number of rows traversed at once by CompactForest.predict (bounds the node index matrix)
+_CHUNK_ROWS = 4096
+
+
+class CompactForest():
+    """
+    Flattened copy of a fitted RandomForestRegressor.
+    Trees are optionally pruned (cost-complexity pruning and depth limit) and thresholds / leaf
+    values are stored with the requested float precision, which reduces the size of the pickle.
+    """
+
+    def __init__(self, forest, ccp_alpha=0.0, max_depth=None, dtype=np.float64):
+        self.ccp_alpha = ccp_alpha
+        self.max_depth = max_depth
+        self.dtype = np.dtype(dtype)
+        self.n_estimators = len(forest.estimators_)
+        self.n_features_ = getattr(forest, 'n_features_in_', None) or forest.n_features_
+
+        # Prune each tree then concatenate all trees into flat node arrays
+        trees = [_prune_tree(est.tree_, ccp_alpha, max_depth) for est in forest.estimators_]
+        self._build(trees)
+
+    def _build(self, trees):
+        """ Concatenates pruned trees, using self-loops for leaves so traversal has fixed depth """
+
+        sizes = [len(tree['value']) for tree in trees]
+        offsets = np.cumsum([0] + sizes[:-1])
+        feature_dtype = np.int16 if self.n_features_ < np.iinfo(np.int16).max else np.int32
+
+        left, right = [], []
+        for tree, offset in zip(trees, offsets):
+            nodes = np.arange(len(tree['value'])) + offset
+            is_leaf = tree['left'] == -1
+            left.append(np.where(is_leaf, nodes, tree['left'] + offset))
+            right.append(np.where(is_leaf, nodes, tree['right'] + offset))
+
+        self.roots_ = offsets.astype(np.int32)
+        self.left_ = np.concatenate(left).astype(np.int32)
+        self.right_ = np.concatenate(right).astype(np.int32)
+        self.feature_ = np.concatenate([t['feature'] for t in trees]).astype(feature_dtype)
+        threshold = np.concatenate([t['threshold'] for t in trees])
+        value = np.concatenate([t['value'] for t in trees])
+        limit = np.finfo(self.dtype).max
+        if np.abs(threshold).max(initial=0) > limit or np.abs(value).max(initial=0) > limit:
+            raise ValueError(f'Thresholds or leaf values are out of the range of {self.dtype}')
+        self.threshold_ = threshold.astype(self.dtype)
+        self.value_ = value.astype(self.dtype)
+        self.depth_ = max(tree['depth'] for tree in trees)
+
+    @property
+    def n_nodes(self):
+        return len(self.value_)
+
+    def predict(self, X, trees=None):
+        """
+        Returns the average prediction of all trees, or only of the trees with the given indices.
+        Trees are evaluated together, row chunk by row chunk.
+        """
+
+        # Trees compare float32 features against their thresholds (same as sklearn)
+        X = np.asarray(X, dtype=np.float32)
+        roots = self.roots_ if trees is None else self.roots_[trees]
+
+        y_pred = np.empty(len(X))
+        for start in range(0, len(X), _CHUNK_ROWS):
+            X_chunk = X[start:start + _CHUNK_ROWS]
+            rows = np.arange(len(X_chunk))[:, None]
+            nodes = np.broadcast_to(roots, (len(X_chunk), len(roots))).copy()
+            for _ in range(self.depth_):
+                go_left = X_chunk[rows, self.feature_[nodes]] <= self.threshold_[nodes]
+                nodes = np.where(go_left, self.left_[nodes], self.right_[nodes])
+            y_pred[start:start + _CHUNK_ROWS] = self.value_[nodes].mean(axis=1, dtype=np.float64)
+
+        return y_pred
+
+
+def _prune_tree(tree, ccp_alpha=0.0, max_depth=None):
+    """
+    Returns the node arrays of the minimal cost-complexity subtree of a fitted sklearn tree.
+    A subtree is collapsed into a leaf when R(node) + alpha <= cost of its best pruned subtree,
+    or when the node is at max_depth. Internal nodes already store the mean of their samples.
+    """
+
+    left, right = tree.children_left, tree.children_right
+    n_nodes = tree.node_count
+
+    # Children always have larger node ids than their parent in sklearn trees
+    depth = np.zeros(n_nodes, dtype=int)
+    for node in range(n_nodes):
+        if left[node] != -1:
+            depth[left[node]] = depth[right[node]] = depth[node] + 1
+
+    # Bottom-up dynamic programming over the cost R(T) + alpha * |leaves(T)|
+    weights = tree.weighted_n_node_samples
+    risk = tree.impurity * weights / weights[0]
+    cost = np.empty(n_nodes)
+    is_leaf = left == -1
+    for node in reversed(range(n_nodes)):
+        leaf_cost = risk[node] + ccp_alpha
+        if is_leaf[node]:
+            cost[node] = leaf_cost
+            continue
+        subtree_cost = cost[left[node]] + cost[right[node]]
+        if leaf_cost <= subtree_cost or (max_depth is not None and depth[node] >= max_depth):
+            is_leaf[node] = True
+            cost[node] = leaf_cost
+        else:
+            cost[node] = subtree_cost
+
+    # Renumber the nodes that are still reachable (pre-order traversal)
+    kept, stack = [], [0]
+    while stack:
+        node = stack.pop()
+        kept.append(node)
+        if not is_leaf[node]:
+            stack.extend([right[node], left[node]])
+    kept = np.array(kept)
+    new_id = np.full(n_nodes, -1)
+    new_id[kept] = np.arange(len(kept))
+
+    kept_leaf = is_leaf[kept]
+    return {
+        'left': np.where(kept_leaf, -1, new_id[left[kept]]),
+        'right': np.where(kept_leaf, -1, new_id[right[kept]]),
+        'feature': np.where(kept_leaf, 0, tree.feature[kept]),
+        'threshold': np.where(kept_leaf, 0., tree.threshold[kept]),
+        'value': tree.value[kept, 0, 0],
+        'depth': int(depth[kept].max())
+    }
+
+
+def _size_bytes(model):
+    return len(pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def _rmse(y_true, y_pred):
+    return float(np.sqrt(np.mean((np.asarray(y_true) - y_pred) ** 2)))
+
+
+def compression_curve(forest, X_val, y_val, ccp_alphas=None, max_depths=(None, 20, 15, 10),
+                      dtypes=(np.float64, np.float32)):
+    """
+    Returns the size vs. RMSE trade-off of every pruning / depth / precision combination.
+    The first row is the uncompressed forest. ccp_alphas default to fractions of var(y_val).
+    Precisions which can't hold the thresholds or leaf values (e.g. float16 for sale prices)
+    are skipped.
+    """
+
+    if ccp_alphas is None:
+        ccp_alphas = np.var(y_val) * np.array([0, 1e-5, 1e-4, 1e-3, 1e-2])
+
+    curve = [{
+        'ccp_alpha': None, 'max_depth': None, 'dtype': None, 'n_nodes': sum(
+            est.tree_.node_count for est in forest.estimators_),
+        'size_bytes': _size_bytes(forest), 'rmse': _rmse(y_val, forest.predict(X_val))
+    }]
+    for ccp_alpha in ccp_alphas:
+        for max_depth in max_depths:
+            for dtype in dtypes:
+                try:
+                    compact = CompactForest(forest, ccp_alpha, max_depth, dtype)
+                except ValueError:
+                    continue
+                curve.append({
+                    'ccp_alpha': float(ccp_alpha), 'max_depth': max_depth,
+                    'dtype': np.dtype(dtype).name, 'n_nodes': compact.n_nodes,
+                    'size_bytes': _size_bytes(compact), 'rmse': _rmse(y_val, compact.predict(X_val))
+                })
+
+    return pd.DataFrame(curve)
+
+
+def select_compression(curve, tolerance=TOLERANCE):
+    """
+    Returns the CompactForest parameters of the smallest model whose RMSE is within
+    (1 + tolerance) of the uncompressed forest, or None if no compressed model qualifies
+    """
+
+    baseline_rmse = curve['rmse'].iloc[0]
+    candidates = curve.iloc[1:]
+    candidates = candidates[candidates['rmse'] <= baseline_rmse * (1 + tolerance)]
+    if candidates.empty:
+        return None
+
+    best = candidates.sort_values(['size_bytes', 'rmse']).iloc[0]
+    max_depth = best['max_depth']
+    return {
+        'ccp_alpha': best['ccp_alpha'],
+        'max_depth': None if pd.isnull(max_depth) else int(max_depth),
+        'dtype': best['dtype']
+    }
+
+
+if __name__ == "__main__":
+    from compression import CompactForest # noqa
+    from sharding import ShardedModel
+    import database as db
+    from model import fit
+    from sklearn.model_selection import train_test_split
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Compress the serving model within tolerance')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help=(
+        'Maximum relative RMSE increase of the compressed model (default: '
+        'COMPRESSION_TOLERANCE or 0.01)'))
+    args = parser.parse_args()
+
+    # Load data and split off a validation set
+    db_config = db.get_config()
+    train_pp = db.load(*db_config, 'processed_train')
+    X_train_pp = train_pp.drop('SalePrice', axis=1)
+    y_train = train_pp['SalePrice']
+    X_fit, X_val, y_fit, y_val = train_test_split(X_train_pp, y_train, test_size=0.2,
+                                                  random_state=0)
+
+    # Measure the size vs. RMSE trade-off on a forest that has not seen the validation set
+    holdout_model, _ = fit(X_fit, y_fit)
+    curve = compression_curve(holdout_model, X_val, y_val)
+    print(curve.to_string())
+
+    # Compress the trained serving model with the best parameters within tolerance
+    model_path = os.path.join(PICKLE_DIR, 'Model.pkl')
+    full_model = joblib.load(model_path)
+    params = select_compression(curve, args.tolerance)
+    if isinstance(full_model, CompactForest):
+        print('Model.pkl is already compressed. Re-run model.py first.')
+    elif isinstance(full_model, ShardedModel):
+        print('Model.pkl has a forest per group of neighborhoods. Model.pkl unchanged.')
+    elif params is None:
+        print(f'No compressed model within {args.tolerance:.1%} RMSE tolerance. '
+              'Model.pkl unchanged.')
+    else:
+        print('Saving compressed model with parameters:', params)
+        joblib.dump(full_model, os.path.join(PICKLE_DIR, 'ModelFull.pkl'))
+        joblib.dump(CompactForest(full_model, **params), model_path)
@@ -1,14 +1,259 @@
-import database
+import database as db
+import io
 import os
+import glob
+import hashlib
+import datetime
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
 
-# Kaggle download file
-# Not implemented - just manually download and read_csv instead
 DIR = os.path.abspath(os.path.dirname(__file__))
-train = pd.read_csv(os.path.join(DIR, '../data/raw/train.csv'))
-test = pd.read_csv(os.path.join(DIR, '../data/raw/test.csv'))
+DATA_DIR = os.path.join(DIR, '../data/raw')
+
+# Kaggle download file
+# Not implemented - just manually download the CSV files into DATA_DIR instead
+# Table name -> CSV file pattern in DATA_DIR (every matching file is ingested into the table)
+SOURCES = {
+    'raw_train': 'train*.csv',
+    'raw_test': 'test*.csv'
+}
+
+MANIFEST_TABLE = 'ingest_manifest'
+MANIFEST_COLUMNS = ['table', 'file', 'sha256', 'size', 'mtime', 'rows', 'ingested_at']
+
+# CSV files are split into chunks of about CHUNK_MB megabytes, parsed in parallel
+CHUNK_MB = int(os.environ.get('INGEST_CHUNK_MB', 64))
+INGEST_WORKERS = int(os.environ.get('INGEST_WORKERS', os.cpu_count() or 1))
+
+# Rows read from the start of each file to infer the column dtypes used for every chunk
+DTYPE_SAMPLE_ROWS = 10000
+
+# Columns of the raw tables which are indexed (when present), for filtered loads and lookups
+INDEXES = ['Id', 'Neighborhood', 'YearBuilt']
+
+
+def file_hash(path, block_bytes=2**20):
+    """ SHA-256 of the file contents, read in blocks """
+
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_bytes), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def infer_dtypes(paths, sample_rows=DTYPE_SAMPLE_ROWS):
+    """
+    Column dtypes inferred from the first rows of one or more CSV files, so that every chunk
+    of every file is parsed the same way. Integer columns are nullable (Int64) in case later
+    rows are missing values, dtypes differing across files are widened (Int64 to float64, and
+    anything else to strings), and columns with no values in any sample are read as strings.
+    """
+
+    if isinstance(paths, str):
+        paths = [paths]
+    dtypes = {}
+    for path in paths:
+        sample = pd.read_csv(path, nrows=sample_rows)
+        for name, dtype in sample.dtypes.items():
+            dtypes.setdefault(name, None)
+            if sample[name].isnull().all():
+                continue
+            elif dtype.kind in 'iu':
+                dtype = 'Int64'
+            elif dtype.kind == 'b':
+                dtype = 'boolean'
+            else:
+                dtype = dtype.name
+            dtypes[name] = _widen(dtypes[name], dtype)
+    return {name: dtype or 'object' for name, dtype in dtypes.items()}
+
+
+def _widen(dtype, other):
+    """ Narrowest of the dtypes inferred by infer_dtypes that holds values of both dtypes """
+
+    if dtype is None or dtype == other:
+        return other
+    if {dtype, other} == {'Int64', 'float64'}:
+        return 'float64'
+    return 'object'
+
+
+def chunk_offsets(path, chunk_bytes):
+    """
+    Returns the header line and (start, stop) byte offsets of chunks of about chunk_bytes,
+    split at line ends. Assumes no quoted field contains a line break.
+    """
+
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        header = f.readline()
+        offsets = []
+        start = f.tell()
+        while start < size:
+            f.seek(min(start + chunk_bytes, size))
+            f.readline()
+            stop = min(f.tell(), size)
+            offsets.append((start, stop))
+            start = stop
+    return header, offsets
+
+
+def _read_chunk(path, header, start, stop, dtypes):
+    """ Parses the rows between two byte offsets of a CSV file """
+
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(stop - start)
+    return pd.read_csv(io.BytesIO(header + data), dtype=dtypes)
+
+
+def read_chunks(path, chunk_bytes, dtypes, executor=None, max_pending=2 * INGEST_WORKERS):
+    """
+    Yields the DataFrame chunks of a CSV file in file order.
+    Chunks are parsed by the executor's processes when given, with at most max_pending chunks
+    parsed ahead of the consumer to bound memory.
+    """
+
+    header, offsets = chunk_offsets(path, chunk_bytes)
+    if executor is None or len(offsets) < 2:
+        for start, stop in offsets:
+            yield _read_chunk(path, header, start, stop, dtypes)
+        return
+
+    pending = []
+    for start, stop in offsets:
+        pending.append(executor.submit(_read_chunk, path, header, start, stop, dtypes))
+        if len(pending) >= max_pending:
+            yield pending.pop(0).result()
+    for future in pending:
+        yield future.result()
+
+
+def load_manifest(url, db_name, schema=None):
+    """ Ingested files of every table, empty if nothing was ingested yet """
+
+    if db.count(url, db_name, schema, MANIFEST_TABLE) is None:
+        return pd.DataFrame(columns=MANIFEST_COLUMNS)
+    return db.load(url, db_name, schema, MANIFEST_TABLE)
+
+
+def plan(table, paths, manifest):
+    """
+    Compares files to the table's manifest entries.
+    Returns (mode, files, entries): mode is 'skip' if no file changed, 'append' if files were
+    only added, or 'rebuild' if an ingested file changed or disappeared. files are the files to
+    ingest, and entries the table's manifest entries that remain valid (keyed by file name),
+    updated with the current modification time of unchanged files.
+    """
+
+    recorded = manifest[manifest['table'] == table].set_index('file')
+    entries, new, changed = {}, [], False
+    for path in paths:
+        name = os.path.basename(path)
+        stat = os.stat(path)
+        if name not in recorded.index:
+            new.append(path)
+            continue
+
+        # Only hash files whose size or modification time changed
+        entry = recorded.loc[name].to_dict()
+        if entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime_ns:
+            if file_hash(path) != entry['sha256']:
+                changed = True
+                continue
+            entry.update(size=stat.st_size, mtime=stat.st_mtime_ns)
+        entries[name] = entry
+
+    names = {os.path.basename(path) for path in paths}
+    if changed or not set(recorded.index) <= names:
+        return 'rebuild', list(paths), {}
+    return ('append' if new else 'skip'), new, entries
+
+
+def ingest_table(table, paths, url, db_name, schema=None, manifest=None, chunk_bytes=None,
+                 executor=None, force=False):
+    """
+    Ingests CSV files into a table, skipping files already ingested with the same contents.
+    New files are appended, and the table is rebuilt from all files when an ingested file has
+    changed, or when the table's row count doesn't match the manifest (e.g. after an
+    interrupted ingest, or a table created before manifests were recorded).
+    Returns the table's manifest entries.
+    """
+
+    chunk_bytes = chunk_bytes or CHUNK_MB * 2**20
+    if manifest is None:
+        manifest = load_manifest(url, db_name, schema)
+
+    mode, files, entries = plan(table, paths, manifest)
+    expected_rows = sum(entry['rows'] for entry in entries.values())
+    if force or (db.count(url, db_name, schema, table) or 0) != expected_rows:
+        mode, files, entries = 'rebuild', list(paths), {}
+
+    # Dtypes of every file of the table, so that appended files match the rows already ingested
+    if_exists = 'replace' if mode == 'rebuild' else 'append'
+    dtypes = infer_dtypes(paths) if files else None
+    for path in files:
+        sha256, stat = file_hash(path), os.stat(path)
+        rows = 0
+        for chunk in read_chunks(path, chunk_bytes, dtypes, executor):
+            indexes = [column for column in INDEXES if column in chunk.columns]
+            db.save(chunk, url, db_name, schema, table, if_exists=if_exists, indexes=indexes)
+            if_exists = 'append'
+            rows += len(chunk)
+
+        entries[os.path.basename(path)] = {
+            'table': table, 'sha256': sha256, 'size': stat.st_size, 'mtime': stat.st_mtime_ns,
+            'rows': rows, 'ingested_at': datetime.datetime.utcnow().isoformat()
+        }
+        print(f'{table}: {"rebuilt from" if mode == "rebuild" else "appended"} '
+              f'{os.path.basename(path)} ({rows} rows)')
+
+    if mode == 'skip':
+        print(f'{table}: unchanged')
+    return pd.DataFrame([dict(entry, file=name) for name, entry in entries.items()],
+                        columns=MANIFEST_COLUMNS)
+
+
+def ingest(url, db_name, schema=None, data_dir=DATA_DIR, sources=SOURCES, chunk_bytes=None,
+           n_workers=INGEST_WORKERS, force=False):
+    """ Ingests the CSV files of every source table and saves the updated manifest """
+
+    manifest = load_manifest(url, db_name, schema)
+    tables = []
+    executor = ProcessPoolExecutor(n_workers) if n_workers > 1 else None
+    try:
+        for table, pattern in sources.items():
+            paths = sorted(glob.glob(os.path.join(data_dir, pattern)))
+            if not paths:
+                print(f'{table}: no files matching {pattern}')
+                tables.append(manifest[manifest['table'] == table])
+                continue
+            tables.append(ingest_table(table, paths, url, db_name, schema, manifest,
+                                       chunk_bytes, executor, force))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    updated = pd.concat(tables + [manifest[~manifest['table'].isin(sources)]],
+                        ignore_index=True)
+    db.save(updated[MANIFEST_COLUMNS], url, db_name, schema, MANIFEST_TABLE)
+    return updated
+
+
+if __name__ == "__main__":
+    import time
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Ingest the raw CSV files into the database')
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    parser.add_argument('--chunk-mb', type=int, default=CHUNK_MB)
+    parser.add_argument('--workers', type=int, default=INGEST_WORKERS)
+    parser.add_argument('--force', action='store_true', help='Rebuild every table')
+    args = parser.parse_args()
 
-# Save data to database
-uri, db, _ = database.get_config()
-database.save(train, uri, db, 'dev', 'raw_train')
-database.save(test, uri, db, 'dev', 'raw_test')
+    # Save data to database
+    start = time.time()
+    ingest(*db.get_config(), data_dir=args.data_dir, chunk_bytes=args.chunk_mb * 2**20,
+           n_workers=args.workers, force=args.force)
+    print(f'Ingest finished in {time.time() - start:.1f}s')
@@ -1,9 +1,20 @@
 import os
+import json
+import threading
+from datetime import datetime
 import pandas as pd
 import sqlalchemy as sqla
 from sqlalchemy.engine.url import URL, make_url
 from sqlalchemy_utils import database_exists, create_database
 
+# State table of the high-water marks of incremental loads (see load_incremental)
+WATERMARK_TABLE = 'watermarks'
+
+# Engines by database url, reused across calls so that connections are pooled
+_engines = {}
+_created = set()
+_engines_lock = threading.Lock()
+
 
 def get_config():
 
@@ -45,9 +56,28 @@ def _extend_url(url, db):
     return db_url
 
 
-def load(url, db, schema=None, table=None):
+def get_engine(db_url, create=False):
+    """
+    Returns the engine of a database url, created on first use and then reused so that its
+    connection pool is shared by every call. create=True also creates the database if it
+    doesn't exist (checked once per url).
+    """
+
+    key = str(db_url)
+    with _engines_lock:
+        if create and key not in _created:
+            if not database_exists(db_url):
+                create_database(db_url, encoding='UTF8MB4')
+            _created.add(key)
+        if key not in _engines:
+            _engines[key] = sqla.create_engine(db_url, pool_pre_ping=True)
+        return _engines[key]
+
+
+def load(url, db, schema=None, table=None, filters=None):
     """
-    Load data from database using specified url, db, schema and table name
+    Load data from database using specified url, db, schema and table name.
+    filters optionally selects rows: {column: value, list of values, or (low, high) range}
     """
 
     # Input validation
@@ -56,10 +86,14 @@ def load(url, db, schema=None, table=None):
 
     # Connect to database with sqlalchemy
     db_url = _extend_url(url, db)
-    engine = sqla.create_engine(db_url)
+    engine = get_engine(db_url)
 
-    # Load data from database - include schema in table name if not using postgres
+    # Load filtered rows with a WHERE clause (which can use the table's indexes)
     rdbms = db_url.drivername.split('+')[0]
+    if filters:
+        return pd.read_sql(_select(engine, rdbms, schema, table, filters), engine)
+
+    # Load data from database - include schema in table name if not using postgres
     if rdbms == 'postgresql':
         data = pd.read_sql_table(table, engine, schema=schema, index_col=None)
     else:
@@ -70,9 +104,76 @@ def load(url, db, schema=None, table=None):
     return data
 
 
-def save(data, url, db, schema=None, table=None):
+def _column_type(dtype, indexed):
+    """ SQLAlchemy type of a DataFrame column. Indexed text columns need a length on MySQL """
+    if dtype.kind in 'iu':
+        return sqla.BigInteger()
+    if dtype.kind == 'f':
+        return sqla.Float()
+    if dtype.kind == 'b':
+        return sqla.Boolean()
+    if dtype.kind == 'M':
+        return sqla.DateTime()
+    return sqla.String(255) if indexed else sqla.Text()
+
+
+def _create_table(data, engine, rdbms, schema, table, primary_key=None, indexes=None,
+                  partition_by=None):
     """
-    Load data from database using specified url, db, schema and table name
+    Creates an empty table for data with a primary key, secondary indexes and hash
+    partitioning (see save)
+    """
+
+    primary_key = list(primary_key or [])
+    indexes = [[index] if isinstance(index, str) else list(index) for index in indexes or []]
+    indexed = set(primary_key).union(*indexes)
+    missing = indexed - set(data.columns)
+    if missing:
+        raise ValueError(f'Unknown key or index columns: {sorted(missing)}')
+
+    # Partitioned tables need the partition column in the primary key (Postgres and MySQL)
+    kwargs = {}
+    if partition_by:
+        column, partitions = partition_by['column'], int(partition_by.get('partitions', 4))
+        if primary_key and column not in primary_key:
+            raise ValueError('The partition column should be part of the primary key')
+        if rdbms == 'postgresql':
+            kwargs['postgresql_partition_by'] = f'HASH ({column})'
+        elif rdbms == 'mysql':
+            kwargs.update(mysql_partition_by=f'HASH ({column})', mysql_partitions=str(partitions))
+
+    metadata = sqla.MetaData()
+    columns = [
+        sqla.Column(name, _column_type(dtype, name in indexed), primary_key=name in primary_key,
+                    autoincrement=False)
+        for name, dtype in data.dtypes.items()
+    ]
+    sqla_table = sqla.Table(table, metadata, *columns, schema=schema, **kwargs)
+    for index in indexes:
+        sqla.Index('_'.join(['ix', table] + index), *[sqla_table.c[c] for c in index])
+    metadata.create_all(engine)
+
+    # Postgres partitions are tables of their own
+    if partition_by and rdbms == 'postgresql':
+        quote = engine.dialect.identifier_preparer.quote
+        parent = '.'.join(quote(name) for name in [schema, table] if name)
+        with engine.begin() as connection:
+            for remainder in range(partitions):
+                child = '.'.join(quote(name) for name in [schema, f'{table}_p{remainder}'] if name)
+                connection.execute(sqla.text(
+                    f'CREATE TABLE {child} PARTITION OF {parent} '
+                    f'FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder})'
+                ))
+
+
+def save(data, url, db, schema=None, table=None, if_exists='replace', primary_key=None,
+         indexes=None, partition_by=None):
+    """
+    Save data to database using specified url, db, schema and table name.
+    if_exists='append' adds the rows to an existing table instead of replacing it.
+    When the table is created, it gets the optional primary key (list of columns), indexes
+    (list of columns or of lists of columns, e.g. ['Neighborhood', ['YearBuilt', 'Id']]) and
+    hash partitioning ({'column': ..., 'partitions': n}, on Postgres and MySQL only).
     """
 
     # Input validation
@@ -82,18 +183,235 @@ def save(data, url, db, schema=None, table=None):
 
     # Connect to database with sqlalchemy (create database if it doesn't exist)
     db_url = _extend_url(url, db)
+    engine = get_engine(db_url, create=True)
+
+    # Include schema in table name if not using postgres
+    rdbms = db_url.drivername.split('+')[0]
+    if rdbms != 'postgresql':
+        if schema:
+            table = '_'.join([schema, table])
+        schema = None
+
+    # Create the table with its keys, indexes and partitions, then insert the data
+    if primary_key or indexes or partition_by:
+        exists = engine.has_table(table, schema=schema)
+        if exists and if_exists == 'fail':
+            raise ValueError(f'Table {table} already exists')
+        if exists and if_exists == 'replace':
+            sqla.Table(table, sqla.MetaData(), schema=schema).drop(engine)
+        if not exists or if_exists == 'replace':
+            _create_table(data, engine, rdbms, schema, table, primary_key, indexes, partition_by)
+        if_exists = 'append'
+    data.to_sql(table, engine, schema=schema, if_exists=if_exists, index=False)
+
+
+def _filter_clause(sqla_table, filters):
+    """ WHERE clause of filters: {column: value, list of values, or (low, high) range} """
+    clauses = []
+    for name, value in (filters or {}).items():
+        column = sqla_table.c[name]
+        if isinstance(value, tuple):
+            clauses.append(column.between(*value))
+        elif isinstance(value, (list, set)):
+            clauses.append(column.in_(list(value)))
+        else:
+            clauses.append(column == value)
+    return sqla.and_(*clauses)
+
+
+def _reflect(engine, rdbms, schema, table):
+    if rdbms != 'postgresql':
+        if schema:
+            table = '_'.join([schema, table])
+        schema = None
+    metadata = sqla.MetaData()
+    metadata.reflect(engine, schema=schema, only=[table])
+    return metadata.tables['.'.join(name for name in [schema, table] if name)]
+
+
+def _select(engine, rdbms, schema, table, filters=None):
+    sqla_table = _reflect(engine, rdbms, schema, table)
+    query = sqla_table.select()
+    if filters:
+        query = query.where(_filter_clause(sqla_table, filters))
+    return query
+
+
+def explain(url, db, schema=None, table=None, filters=None):
+    """
+    Returns the query plan (list of text lines) of a filtered load (see load), e.g. to check
+    that it uses an index
+    """
+
+    db_url = _extend_url(url, db)
+    engine = get_engine(db_url)
+    rdbms = db_url.drivername.split('+')[0]
+    query = _select(engine, rdbms, schema, table, filters)
+    sql = str(query.compile(engine, compile_kwargs={'literal_binds': True}))
+    prefix = 'EXPLAIN QUERY PLAN' if rdbms == 'sqlite' else 'EXPLAIN'
+    with engine.connect() as connection:
+        rows = connection.execute(sqla.text(f'{prefix} {sql}')).fetchall()
+    return [' '.join(str(value) for value in row) for row in rows]
+
+
+def count(url, db, schema=None, table=None):
+    """
+    Count the rows of a table using specified url, db, schema and table name.
+    Returns None if the database or table doesn't exist
+    """
+
+    # Input validation
+    if table is None:
+        raise 'Table should be specified'
+
+    # Connect to database with sqlalchemy
+    db_url = _extend_url(url, db)
     if not database_exists(db_url):
-        create_database(db_url, encoding='UTF8MB4')
-    engine = sqla.create_engine(db_url)
+        return None
+    engine = get_engine(db_url)
 
-    # Save data to database - include schema in table name if not using postgres
+    # Count rows - include schema in table name if not using postgres
     rdbms = db_url.drivername.split('+')[0]
-    if rdbms == 'postgresql':
-        data.to_sql(table, engine, schema=schema, if_exists='replace', index=False)
-    else:
+    if rdbms != 'postgresql' and schema:
+        table, schema = '_'.join([schema, table]), None
+    if not engine.has_table(table, schema=schema):
+        return None
+    query = sqla.select([sqla.func.count()]).select_from(sqla.table(table, schema=schema))
+    with engine.connect() as connection:
+        return connection.execute(query).scalar()
+
+
+def _watermark_table(engine, rdbms, schema):
+    """ Watermark state table, created if it doesn't exist """
+    table = WATERMARK_TABLE
+    if rdbms != 'postgresql':
         if schema:
             table = '_'.join([schema, table])
-        data.to_sql(table, engine, if_exists='replace', index=False)
+        schema = None
+    watermarks = sqla.Table(
+        table, sqla.MetaData(),
+        sqla.Column('consumer', sqla.String(255), primary_key=True),
+        sqla.Column('source', sqla.String(255), primary_key=True),
+        sqla.Column('column_name', sqla.String(255), nullable=False),
+        sqla.Column('watermark', sqla.Text),
+        sqla.Column('updated_at', sqla.DateTime),
+        schema=schema
+    )
+    watermarks.create(engine, checkfirst=True)
+    return watermarks
+
+
+def get_watermark(url, db, schema=None, consumer=None, table=None):
+    """
+    Returns the high-water mark saved by a consumer of a table (see save_watermark), or None
+    if it never saved one
+    """
+
+    db_url = _extend_url(url, db)
+    engine = get_engine(db_url, create=True)
+    watermarks = _watermark_table(engine, db_url.drivername.split('+')[0], schema)
+    query = sqla.select([watermarks.c.watermark]).where(sqla.and_(
+        watermarks.c.consumer == consumer, watermarks.c.source == table))
+    with engine.connect() as connection:
+        value = connection.execute(query).scalar()
+    return None if value is None else json.loads(value)
+
+
+def save_watermark(url, db, schema=None, consumer=None, table=None, column='Id', watermark=None):
+    """ Saves the high-water mark of a consumer of a table, e.g. once its rows are processed """
+
+    db_url = _extend_url(url, db)
+    engine = get_engine(db_url, create=True)
+    watermarks = _watermark_table(engine, db_url.drivername.split('+')[0], schema)
+    with engine.begin() as connection:
+        _write_watermark(connection, watermarks, consumer, table, column, watermark)
+
+
+def _write_watermark(connection, watermarks, consumer, table, column, watermark):
+    key = sqla.and_(watermarks.c.consumer == consumer, watermarks.c.source == table)
+    if hasattr(watermark, 'item'):
+        watermark = watermark.item()
+    connection.execute(watermarks.delete().where(key))
+    connection.execute(watermarks.insert().values(
+        consumer=consumer, source=table, column_name=column,
+        watermark=json.dumps(watermark, default=str), updated_at=datetime.utcnow()
+    ))
+
+
+def load_incremental(url, db, schema=None, table=None, consumer=None, column='Id', reset=False):
+    """
+    Load the rows of a table added or changed since a consumer's last load: rows whose column
+    (an increasing Id, or an updated-at timestamp) is above the consumer's high-water mark.
+    Every row is loaded the first time, or with reset=True.
+    Returns the rows, sorted by column, and the new high-water mark: the consumer saves it
+    once the rows are processed, with their output (see save_incremental) or with
+    save_watermark, so that rows are never skipped if processing fails (they are loaded again
+    instead).
+    """
+
+    # Input validation
+    if table is None or consumer is None:
+        raise ValueError('Table and consumer should be specified')
+
+    db_url = _extend_url(url, db)
+    engine = get_engine(db_url)
+    rdbms = db_url.drivername.split('+')[0]
+    watermark = None if reset else get_watermark(url, db, schema, consumer, table)
+
+    # Rows above the watermark (a range scan if column is indexed)
+    sqla_table = _reflect(engine, rdbms, schema, table)
+    query = sqla_table.select().order_by(sqla_table.c[column])
+    if watermark is not None:
+        # Watermarks are saved as JSON: compare timestamps as datetimes, not as text
+        if isinstance(sqla_table.c[column].type, sqla.DateTime):
+            watermark = pd.Timestamp(watermark).to_pydatetime()
+        elif isinstance(sqla_table.c[column].type, sqla.Date):
+            watermark = pd.Timestamp(watermark).date()
+        query = query.where(sqla_table.c[column] > watermark)
+    data = pd.read_sql(query, engine)
+
+    if len(data):
+        watermark = data[column].max()
+    return data, watermark
+
+
+def save_incremental(data, url, db, schema=None, table=None, consumer=None, source=None,
+                     column='Id', watermark=None, key=None):
+    """
+    Append the rows processed from an incremental load (see load_incremental) to a table and
+    save the consumer's watermark of the source table in the same transaction, so that a failed
+    run writes neither and its rows are processed again.
+    With key (a column, the table's primary key when the table is created), rows with the same
+    keys are deleted first: re-running a batch replaces its rows instead of failing or
+    duplicating them.
+    """
+
+    # Input validation
+    if table is None or consumer is None or source is None:
+        raise ValueError('Table, consumer and source should be specified')
+
+    db_url = _extend_url(url, db)
+    engine = get_engine(db_url, create=True)
+    rdbms = db_url.drivername.split('+')[0]
+    watermarks = _watermark_table(engine, rdbms, schema)
+    if rdbms != 'postgresql':
+        if schema:
+            table = '_'.join([schema, table])
+        schema = None
+    if len(data) and not engine.has_table(table, schema=schema):
+        _create_table(data, engine, rdbms, schema, table, [key] if key else None)
+
+    with engine.begin() as connection:
+        if len(data):
+            if key:
+                sqla_table = sqla.Table(table, sqla.MetaData(), autoload_with=connection,
+                                        schema=schema)
+                keys = data[key].tolist()
+                for start in range(0, len(keys), 500):
+                    connection.execute(sqla_table.delete().where(
+                        sqla_table.c[key].in_(keys[start:start + 500])))
+            data.to_sql(table, connection, schema=schema, if_exists='append', index=False)
+        _write_watermark(connection, watermarks, consumer, source, column, watermark)
 
 
 if __name__ == "__main__":
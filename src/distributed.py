@@ -0,0 +1,158 @@
+import os
+import sys
+import json
+import shlex
+import tempfile
+import subprocess
+import joblib
+from sklearn.base import clone
+
+DIR = os.path.abspath(os.path.dirname(__file__))
+
+# Number of worker processes fitting a share of the trees (1: train in this process)
+N_SHARDS = int(os.environ.get('TRAIN_SHARDS', 1))
+
+# Comma separated hosts the workers run on, in turn, with TRAIN_LAUNCHER: a command prefix such
+# as 'ssh {host}'. Hosts need the same source and database access, and a shared output directory.
+TRAIN_HOSTS = os.environ.get('TRAIN_HOSTS')
+TRAIN_LAUNCHER = os.environ.get('TRAIN_LAUNCHER', 'ssh {host}')
+
+
+def shard_trees(n_estimators, n_shards):
+    """ Number of trees fitted by each shard, adding up to n_estimators """
+    return [n_estimators // n_shards + (shard < n_estimators % n_shards)
+            for shard in range(n_shards)]
+
+
+def partition(data, shard, n_shards):
+    """ Rows of a shard's partition: every n_shards-th row, starting at row shard """
+    return data.iloc[shard::n_shards]
+
+
+def merge_forests(forests):
+    """
+    Returns one forest with the trees of several forests fitted with the same parameters on the
+    same features (e.g. by different workers with different seeds). Its predictions are the
+    average of all the trees, as if it had been fitted in one go.
+    """
+
+    def n_features(forest):
+        return getattr(forest, 'n_features_in_', None) or forest.n_features_
+
+    first = forests[0]
+    params = {name: value for name, value in first.get_params().items()
+              if name not in ('n_estimators', 'random_state', 'n_jobs')}
+    for forest in forests[1:]:
+        other = {name: value for name, value in forest.get_params().items() if name in params}
+        if other != params or n_features(forest) != n_features(first):
+            raise ValueError('Forests should have the same parameters and features')
+
+    # Fitted attributes of the first forest (number of features, outputs, feature names, ...)
+    merged = clone(first)
+    for name, value in vars(first).items():
+        if name.endswith('_') and not name.startswith('_'):
+            setattr(merged, name, value)
+    merged.estimators_ = [tree for forest in forests for tree in forest.estimators_]
+    merged.n_estimators = len(merged.estimators_)
+    return merged
+
+
+def fit_shard(X, y, shard, n_trees, seed=0, workers_per_host=1):
+    """
+    Fits a forest of n_trees trees with the model's parameters and the shard's seed, using its
+    share of the host's CPUs and memory (workers_per_host workers run on the same host)
+    """
+
+    import resources
+    from model import fit
+    config = resources.training_config(
+        len(X), X.shape[1], n_trees,
+        cpus=max(1, resources.available_cpus() // workers_per_host),
+        memory=resources.available_memory() // workers_per_host)
+    params = {'n_estimators': n_trees, 'random_state': seed + shard}
+    return fit(X, y, config, params)
+
+
+def _worker_command(table, shard, n_shards, n_trees, seed, partitioned, output,
+                    workers_per_host=1):
+    command = [sys.executable, os.path.join(DIR, 'distributed.py'), 'worker', table,
+               '--shard', str(shard), '--n-shards', str(n_shards), '--trees', str(n_trees),
+               '--seed', str(seed), '--output', output,
+               '--workers-per-host', str(workers_per_host)]
+    return command + ['--partitioned'] if partitioned else command
+
+
+def train(table, n_shards, output_dir=None, seed=0, partitioned=False, hosts=None,
+          launcher=TRAIN_LAUNCHER, n_estimators=None, env=None):
+    """
+    Fits the model's trees in n_shards worker processes and returns the merged forest and the
+    workers' training reports.
+    Each worker loads the table from the database (all of it, or with partitioned=True only its
+    partition of the rows) and fits its share of the trees with its own seed. Workers run on
+    this machine, or in turn on each of hosts through the launcher command prefix, and write
+    their forests to output_dir (which the hosts must share). Workers on the same host share
+    its CPUs and memory.
+    """
+
+    from model import model
+    n_estimators = n_estimators or model.n_estimators
+    n_shards = min(n_shards, n_estimators)
+    cleanup = output_dir is None
+    output_dir = output_dir or tempfile.mkdtemp(prefix='house_prices_shards_')
+    os.makedirs(output_dir, exist_ok=True)
+
+    processes = []
+    for shard, n_trees in enumerate(shard_trees(n_estimators, n_shards)):
+        output = os.path.join(output_dir, f'shard-{shard}.pkl')
+        on_host = len(range(shard % len(hosts), n_shards, len(hosts))) if hosts else n_shards
+        command = _worker_command(table, shard, n_shards, n_trees, seed, partitioned, output,
+                                  on_host)
+        if hosts:
+            host = hosts[shard % len(hosts)]
+            remote = ' '.join(shlex.quote(part) for part in command)
+            command = shlex.split(launcher.format(host=host)) + [remote]
+        processes.append((output, subprocess.Popen(command, env=env)))
+
+    failed = [shard for shard, (_, process) in enumerate(processes) if process.wait() != 0]
+    if failed:
+        raise RuntimeError(f'Training failed on shards {failed}')
+
+    forests, reports = [], []
+    for output, _ in processes:
+        forest, report = joblib.load(output)
+        forests.append(forest)
+        reports.append(report)
+        if cleanup:
+            os.remove(output)
+    if cleanup:
+        os.rmdir(output_dir)
+    return merge_forests(forests), reports
+
+
+if __name__ == "__main__":
+    import argparse
+    import database as db
+
+    parser = argparse.ArgumentParser(description='Worker fitting a shard of the trees')
+    parser.add_argument('command', choices=['worker'])
+    parser.add_argument('table')
+    parser.add_argument('--shard', type=int, required=True)
+    parser.add_argument('--n-shards', type=int, required=True)
+    parser.add_argument('--trees', type=int, required=True)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--partitioned', action='store_true')
+    parser.add_argument('--output', required=True)
+    parser.add_argument('--workers-per-host', type=int, default=1)
+    args = parser.parse_args()
+
+    data = db.load(*db.get_config(), args.table)
+    if args.partitioned:
+        data = partition(data, args.shard, args.n_shards)
+    X, y = data.drop('SalePrice', axis=1), data['SalePrice']
+    fitted, report = fit_shard(X, y, args.shard, args.trees, args.seed, args.workers_per_host)
+    report.update(shard=args.shard, trees=args.trees, rows=len(X))
+
+    tmp_path = args.output + '.tmp'
+    joblib.dump((fitted, report), tmp_path)
+    os.replace(tmp_path, args.output)
+    print(json.dumps(report))
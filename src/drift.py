@@ -0,0 +1,279 @@
+import os
+import json
+import time
+import uuid
+import threading
+from collections import deque
+import numpy as np
+
+DIR = os.path.abspath(os.path.dirname(__file__))
+PICKLE_DIR = os.path.join(DIR, '../pickle')
+
+# Numeric features are binned on N_BINS quantiles of the training data
+N_BINS = 10
+
+# Numeric columns which are category codes (text columns are always categorical)
+CATEGORICAL_FEATURES = ['MSSubClass']
+
+# Population stability index above which a distribution is reported as drifted
+PSI_ALERT = 0.2
+
+# Windowed monitors count rows in N_INTERVALS intervals of the window, the oldest being dropped
+# as the window moves
+N_INTERVALS = 12
+
+
+def _quantile_edges(values, n_bins):
+    values = np.asarray(values, dtype=float)
+    values = values[~np.isnan(values)]
+    if not len(values):
+        return []
+    return np.unique(np.quantile(values, np.arange(1, n_bins) / n_bins)).tolist()
+
+
+def build_baseline(raw, y_pred, features, n_bins=N_BINS):
+    """
+    Returns the training distributions the serving monitor compares traffic to (JSON
+    serializable): quantile bin edges of numeric features and of predictions, categories of
+    categorical features, and the training counts in each bin.
+    """
+
+    baseline = {'rows': len(raw), 'numeric': {}, 'categorical': {}}
+    for feature in features:
+        if feature in CATEGORICAL_FEATURES or raw[feature].dtype == object:
+            categories = raw[feature].dropna().value_counts().index.tolist()
+            baseline['categorical'][feature] = {'categories': categories}
+        else:
+            baseline['numeric'][feature] = {'edges': _quantile_edges(raw[feature], n_bins)}
+    baseline['prediction'] = {'edges': _quantile_edges(y_pred, n_bins)}
+
+    monitor = DriftMonitor(baseline)
+    monitor.update(raw, y_pred)
+    bins = _bins(baseline)
+    for name, counts in monitor.counts().items():
+        bins[name]['counts'] = counts
+    return baseline
+
+
+def _bins(baseline):
+    """ Baseline bins of each feature and of the predictions, by name """
+    return dict(baseline['numeric'], **baseline['categorical'], prediction=baseline['prediction'])
+
+
+def psi(expected, actual, eps=1e-4):
+    """ Population stability index of the actual bin counts against the expected bin counts """
+
+    expected = np.asarray(expected, dtype=float)
+    actual = np.asarray(actual, dtype=float)
+    if not actual.sum() or not expected.sum():
+        return 0.
+    expected = np.maximum(expected / expected.sum(), eps)
+    actual = np.maximum(actual / actual.sum(), eps)
+    return float(np.sum((actual - expected) * np.log(actual / expected)))
+
+
+def merge(counts_list):
+    """ Adds up the bin counts of several monitors (e.g. one per worker process) """
+
+    merged = {}
+    for counts in counts_list:
+        for name, values in counts.items():
+            if name in merged:
+                merged[name] = [a + b for a, b in zip(merged[name], values)]
+            else:
+                merged[name] = list(values)
+    return merged
+
+
+class DriftMonitor():
+    """
+    Constant-memory monitor of the distributions of incoming raw features and predictions.
+
+    Each numeric feature and the predictions are counted in the training quantile bins (plus
+    a bin for missing values), and each categorical feature in its training categories (plus
+    bins for unseen and missing values). Counts are mergeable by addition, so monitors of
+    several worker processes are combined by writing their counts to a shared directory
+    (every flush_seconds) and adding them up in report(). Files of workers which stopped, or
+    which were not written during the window, are removed.
+    Drift is the population stability index (PSI) of the merged counts against the baseline.
+    With window_seconds, only the rows of the last window_seconds are counted (in rotating
+    intervals, see N_INTERVALS), so that the report follows recent traffic.
+    """
+
+    def __init__(self, baseline, directory=None, flush_seconds=30, window_seconds=None):
+        self.baseline = baseline
+        self.directory = directory
+        self.flush_seconds = flush_seconds
+        self.window_seconds = window_seconds
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._last_flush = time.time()
+        self._name = f'{os.getpid()}-{uuid.uuid4().hex[:8]}.json'
+
+        self._edges = {f: np.asarray(b['edges'], dtype=float)
+                       for f, b in baseline['numeric'].items()}
+        self._edges['prediction'] = np.asarray(baseline['prediction']['edges'], dtype=float)
+        self._categories = {f: {c: i for i, c in enumerate(b['categories'])}
+                            for f, b in baseline['categorical'].items()}
+
+        # Bin counts: numeric bins + missing, or categories + unseen + missing, for each
+        # interval (start time, counts) of the window
+        self._sizes = {f: len(e) + 2 for f, e in self._edges.items()}
+        self._sizes.update({f: len(c) + 2 for f, c in self._categories.items()})
+        self._intervals = deque()
+
+    def _interval(self, now):
+        """ Counts of the interval including now, dropping the intervals out of the window """
+
+        start = 0
+        if self.window_seconds:
+            length = self.window_seconds / N_INTERVALS
+            start = now - now % length
+            while self._intervals and self._intervals[0][0] <= now - self.window_seconds:
+                self._intervals.popleft()
+        if not self._intervals or self._intervals[-1][0] != start:
+            self._intervals.append((start, {f: np.zeros(n, dtype=np.int64)
+                                            for f, n in self._sizes.items()}))
+        return self._intervals[-1][1]
+
+    def _numeric_bins(self, name, values):
+        values = np.asarray(values, dtype=float)
+        bins = np.searchsorted(self._edges[name], values, side='right')
+        bins[np.isnan(values)] = len(self._edges[name]) + 1
+        return np.bincount(bins, minlength=self._sizes[name])
+
+    def _categorical_bins(self, name, values):
+        index = self._categories[name]
+        unseen, missing = len(index), len(index) + 1
+        counts = np.zeros(len(index) + 2, dtype=np.int64)
+        for value in values:
+            if value is None or value != value:
+                counts[missing] += 1
+            else:
+                counts[index.get(value, unseen)] += 1
+        return counts
+
+    def update(self, X, y_pred):
+        """ Counts the raw rows X (DataFrame) and their predictions """
+
+        updates = {'prediction': self._numeric_bins('prediction', y_pred)}
+        for name in self._edges:
+            if name != 'prediction' and name in X:
+                updates[name] = self._numeric_bins(name, X[name].to_numpy())
+        for name in self._categories:
+            if name in X:
+                column = X[name]
+                if len(column) > 100:
+                    # Count each distinct value once for large batches
+                    value_counts = column.value_counts(dropna=False)
+                    counts = np.zeros(self._sizes[name], dtype=np.int64)
+                    for value, count in value_counts.items():
+                        counts += self._categorical_bins(name, [value]) * count
+                    updates[name] = counts
+                else:
+                    updates[name] = self._categorical_bins(name, column.tolist())
+
+        # The thread which finds the counts due claims the flush, so only one thread writes them
+        with self._lock:
+            now = time.time()
+            interval = self._interval(now)
+            for name, counts in updates.items():
+                interval[name] += counts
+            due = self.directory and now - self._last_flush > self.flush_seconds
+            if due:
+                self._last_flush = now
+        if due:
+            self.flush()
+
+    def counts(self):
+        """ Bin counts of this process (during the window if windowed) """
+        with self._lock:
+            self._interval(time.time())
+            return {name: sum(counts[name] for _, counts in self._intervals).tolist()
+                    for name in self._sizes}
+
+    def _path(self):
+        return os.path.join(self.directory, self._name)
+
+    def _expired(self, name, path, now):
+        """ Whether a worker's counts are outdated: its process stopped or it stopped writing """
+
+        pid = name.split('-')[0]
+        if pid.isdigit() and int(pid) != os.getpid():
+            try:
+                os.kill(int(pid), 0)
+            except ProcessLookupError:
+                return True
+            except PermissionError:
+                pass
+        return bool(self.window_seconds) and now - os.path.getmtime(path) > self.window_seconds
+
+    def flush(self):
+        """ Writes this process' counts of each interval to the shared directory """
+
+        with self._flush_lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with self._lock:
+                self._last_flush = time.time()
+                self._interval(time.time())
+                intervals = [[start, {name: values.tolist() for name, values in counts.items()}]
+                             for start, counts in self._intervals]
+            tmp_path = self._path() + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({'intervals': intervals}, f)
+            os.replace(tmp_path, self._path())
+
+    def merged_counts(self):
+        """
+        Counts of every process writing to the shared directory (during the window if
+        windowed), this one up to date
+        """
+
+        if not self.directory:
+            return self.counts()
+        self.flush()
+        counts_list = []
+        now = time.time()
+        oldest = now - self.window_seconds if self.window_seconds else -np.inf
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                path = os.path.join(self.directory, name)
+                try:
+                    if self._expired(name, path, now):
+                        os.remove(path)
+                        continue
+                    with open(path) as f:
+                        intervals = json.load(f)['intervals']
+                    counts_list.extend(counts for start, counts in intervals if start > oldest)
+                except (OSError, ValueError, KeyError):
+                    continue
+        return merge(counts_list)
+
+    def report(self):
+        """ PSI, number of rows and drift alert of each feature and of the predictions """
+
+        bins = _bins(self.baseline)
+        report = {}
+        for name, actual in self.merged_counts().items():
+            score = psi(bins[name]['counts'], actual)
+            report[name] = {'psi': score, 'rows': int(sum(actual)), 'drift': score > PSI_ALERT}
+        return report
+
+
+if __name__ == "__main__":
+    from preprocessing import PreProcessor # noqa
+    from compression import CompactForest # noqa
+    import database as db
+    import joblib
+
+    # Distributions of the training data and of the model's predictions on it
+    db_config = db.get_config()
+    raw = db.load(*db_config, 'raw_train')
+    preprocessor = joblib.load(os.path.join(PICKLE_DIR, 'PreProcessor.pkl'))
+    model = joblib.load(os.path.join(PICKLE_DIR, 'Model.pkl'))
+    y_pred = model.predict(preprocessor.transform(raw))
+
+    baseline = build_baseline(raw, y_pred, preprocessor.raw_features)
+    with open(os.path.join(PICKLE_DIR, 'DriftBaseline.json'), 'w') as f:
+        json.dump(baseline, f, default=lambda value: value.item())
+    print(f'Saved drift baseline of {len(raw)} rows')
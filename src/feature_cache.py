@@ -0,0 +1,164 @@
+import os
+import sys
+import json
+import pickle
+import shutil
+import hashlib
+import numpy as np
+import pandas as pd
+
+DIR = os.path.abspath(os.path.dirname(__file__))
+CACHE_DIR = os.environ.get('FEATURE_CACHE_DIR', os.path.join(DIR, '../data/interim/features'))
+CACHE_MB = int(os.environ.get('FEATURE_CACHE_MB', 2048))
+
+
+def frame_hash(X):
+    """ Hash of the values, column names and dtypes of a DataFrame (not its index) """
+
+    sha = hashlib.sha256()
+    sha.update(json.dumps([[str(name), str(dtype)] for name, dtype in X.dtypes.items()]).encode())
+    sha.update(pd.util.hash_pandas_object(X, index=False).to_numpy().tobytes())
+    return sha.hexdigest()
+
+
+def transformer_hash(transformer):
+    """
+    Hash of a transformer's parameters and fitted state (its pickle), and of the source code of
+    the module defining its class
+    """
+
+    sha = hashlib.sha256(pickle.dumps(transformer, protocol=4))
+    module = sys.modules.get(type(transformer).__module__)
+    path = getattr(module, '__file__', None)
+    if path and os.path.exists(path):
+        with open(path, 'rb') as f:
+            sha.update(f.read())
+    return sha.hexdigest()
+
+
+class FeatureCache():
+    """
+    Content-addressed on-disk cache of preprocessed feature matrices.
+    Entries are keyed on a hash of the input rows, the preprocessor (parameters, fitted state
+    and code version) and the operation. Features are stored as .npy files and memory-mapped
+    when read. The least recently used entries are evicted when the cache exceeds max_bytes.
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_MB * 2**20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, X, transformer, operation='transform'):
+        parts = [operation, frame_hash(X), transformer_hash(transformer)]
+        return hashlib.sha256(':'.join(parts).encode()).hexdigest()
+
+    def _path(self, key, name=''):
+        return os.path.join(self.directory, key, name)
+
+    def get(self, key):
+        """ Returns (features DataFrame, fitted transformer or None), or None on a miss """
+
+        if not os.path.exists(self._path(key, 'columns.json')):
+            self.misses += 1
+            return None
+        self.hits += 1
+        os.utime(self._path(key))
+
+        features = np.load(self._path(key, 'features.npy'), mmap_mode='r')
+        with open(self._path(key, 'columns.json')) as f:
+            X_pp = pd.DataFrame(features, columns=json.load(f), copy=False)
+        transformer = None
+        if os.path.exists(self._path(key, 'transformer.pkl')):
+            with open(self._path(key, 'transformer.pkl'), 'rb') as f:
+                transformer = pickle.load(f)
+        return X_pp, transformer
+
+    def put(self, key, X_pp, transformer=None):
+        """ Stores an entry (written to a temporary folder, then renamed into place) """
+
+        tmp_dir = self._path(f'{key}.tmp-{os.getpid()}')
+        os.makedirs(tmp_dir, exist_ok=True)
+        np.save(os.path.join(tmp_dir, 'features.npy'), np.ascontiguousarray(X_pp.to_numpy()))
+        if transformer is not None:
+            with open(os.path.join(tmp_dir, 'transformer.pkl'), 'wb') as f:
+                pickle.dump(transformer, f, protocol=4)
+        with open(os.path.join(tmp_dir, 'columns.json'), 'w') as f:
+            json.dump([str(name) for name in X_pp.columns], f)
+
+        try:
+            os.rename(tmp_dir, self._path(key))
+        except OSError:
+            # Entry written concurrently by another process
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        self.evict()
+
+    def entries(self):
+        """ DataFrame of the cached entries: key, size in bytes and last access time """
+
+        rows = []
+        if os.path.isdir(self.directory):
+            for key in os.listdir(self.directory):
+                path = self._path(key)
+                if '.tmp-' in key or not os.path.isdir(path):
+                    continue
+                size = sum(entry.stat().st_size for entry in os.scandir(path))
+                rows.append({'key': key, 'bytes': size, 'accessed': os.stat(path).st_mtime})
+        return pd.DataFrame(rows, columns=['key', 'bytes', 'accessed'])
+
+    def evict(self):
+        """ Removes the least recently used entries until the cache fits in max_bytes """
+
+        entries = self.entries().sort_values('accessed', ascending=False)
+        over = entries['bytes'].cumsum() > self.max_bytes
+        for key in entries.loc[over, 'key']:
+            shutil.rmtree(self._path(key), ignore_errors=True)
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def transform(self, transformer, X):
+        """ transformer.transform(X), cached. The transformer must be fitted """
+
+        key = self.key(X, transformer)
+        cached = self.get(key)
+        if cached is not None:
+            return cached[0]
+        X_pp = transformer.transform(X)
+        self.put(key, X_pp)
+        return X_pp
+
+    def fit_transform(self, transformer, X):
+        """
+        Returns (fitted transformer, transformed X), cached.
+        On a hit the fitted transformer is loaded from the cache instead of refitting.
+        """
+
+        key = self.key(X, transformer, 'fit_transform')
+        cached = self.get(key)
+        if cached is not None:
+            return cached[1], cached[0]
+        X_pp = transformer.fit_transform(X)
+
+        # Return an unpickled copy, as on a hit, so that it gives the same transform() keys
+        transformer = pickle.loads(pickle.dumps(transformer, protocol=4))
+        self.put(key, X_pp, transformer)
+        return transformer, X_pp
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Inspect or clear the feature cache')
+    parser.add_argument('--clear', action='store_true')
+    args = parser.parse_args()
+
+    cache = FeatureCache()
+    if args.clear:
+        cache.clear()
+    entries = cache.entries()
+    entries['accessed'] = pd.to_datetime(entries['accessed'], unit='s')
+    print(entries.to_string(index=False))
+    print(f'{len(entries)} entries, {entries["bytes"].sum() / 2**20:.1f} MB '
+          f'(limit {cache.max_bytes / 2**20:.0f} MB)')
@@ -0,0 +1,312 @@
+import os
+import json
+import shutil
+import threading
+import hashlib
+import numpy as np
+import pandas as pd
+from feature_cache import transformer_hash
+
+DIR = os.path.abspath(os.path.dirname(__file__))
+PICKLE_DIR = os.path.join(DIR, '../pickle')
+
+# Id ranges up to DENSE_FACTOR times the number of rows are indexed with a dense position array
+DENSE_FACTOR = 4
+
+
+def model_version(path):
+    """ Version label of a pickled model: hash of the pickle file """
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()[:12]
+
+
+class Generation():
+    """
+    Read-only view of one generation of the store: its metadata and memory-mapped arrays.
+    Positions, features and predictions read from the same Generation are consistent, even if
+    the store is refreshed in the meantime.
+    """
+
+    def __init__(self, path):
+        self.name = os.path.basename(path)
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.ids = self._load(path, 'ids.npy')
+        self.row_hashes = self._load(path, 'row_hashes.npy')
+        self.features_ = self._load(path, 'features.npy')
+        self.predictions_ = self._load(path, 'predictions.npy')
+        self.index = self._load(path, 'index.npy')
+        self.order = self._load(path, 'order.npy')
+
+    @staticmethod
+    def _load(path, name):
+        path = os.path.join(path, name)
+        return np.load(path, mmap_mode='r') if os.path.exists(path) else None
+
+    @property
+    def model_version(self):
+        return self.meta.get('model_version')
+
+    def __len__(self):
+        return len(self.ids)
+
+    def positions(self, ids):
+        """ Row of each Id in the generation, -1 for unknown Ids """
+
+        ids = np.asarray(ids, dtype=np.int64)
+        positions = np.full(len(ids), -1, dtype=np.int64)
+        if not len(self):
+            return positions
+
+        if self.index is not None:
+            offsets = ids - self.meta['min_id']
+            valid = (offsets >= 0) & (offsets < len(self.index))
+            positions[valid] = self.index[offsets[valid]]
+        else:
+            sorted_ids = self.ids[self.order]
+            i = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+            found = sorted_ids[i] == ids
+            positions[found] = self.order[i[found]]
+        return positions
+
+    def features(self, positions):
+        return pd.DataFrame(self.features_[positions], columns=self.meta['columns'])
+
+    def predictions(self, positions):
+        return None if self.predictions_ is None else self.predictions_[positions]
+
+
+class FeatureStore():
+    """
+    Preprocessed features, and optionally predictions, of every known house, indexed by Id.
+
+    Arrays are stored as .npy files in a generation folder and memory-mapped when opened.
+    Ids are looked up with a dense Id -> row array (O(1)) when Ids are dense enough, otherwise
+    with a binary search. refresh() writes a new generation, reusing the features of unchanged
+    rows and the predictions of an unchanged model, then switches the CURRENT file atomically,
+    so readers always see a complete generation.
+    The opened generation is swapped in one assignment: concurrent readers take it once with
+    snapshot() and use it for the whole request.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._snapshot = None
+        self._current_mtime = None
+        self._lock = threading.RLock()
+
+    # Reading
+
+    def _current(self):
+        path = os.path.join(self.directory, 'CURRENT')
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return f.read().strip()
+
+    def open(self):
+        """ Memory-maps the current generation. Returns False if the store is empty """
+
+        with self._lock:
+            generation = self._current()
+            if generation is None:
+                return False
+            if self._snapshot is None or generation != self._snapshot.name:
+                self._snapshot = Generation(os.path.join(self.directory, generation))
+            return True
+
+    def reload_if_changed(self):
+        """ Opens the new generation if the store was refreshed since it was opened """
+
+        with self._lock:
+            try:
+                mtime = os.stat(os.path.join(self.directory, 'CURRENT')).st_mtime_ns
+            except OSError:
+                return False
+            if mtime != self._current_mtime:
+                self._current_mtime = mtime
+                return self.open()
+            return True
+
+    def snapshot(self):
+        """ The opened Generation (None if the store was never opened) """
+        return self._snapshot
+
+    # Attributes of the opened generation
+
+    @property
+    def generation(self):
+        return None if self._snapshot is None else self._snapshot.name
+
+    def __getattr__(self, name):
+        if name in ('meta', 'ids', 'row_hashes', 'features_', 'predictions_', 'index', 'order'):
+            return getattr(self.__dict__['_snapshot'], name, None)
+        raise AttributeError(name)
+
+    @property
+    def model_version(self):
+        return self._snapshot.model_version
+
+    def __len__(self):
+        return 0 if self._snapshot is None else len(self._snapshot)
+
+    def positions(self, ids):
+        """ Row of each Id in the opened generation, -1 for unknown Ids """
+        if self._snapshot is None:
+            return np.full(len(ids), -1, dtype=np.int64)
+        return self._snapshot.positions(ids)
+
+    def features(self, positions):
+        return self._snapshot.features(positions)
+
+    def predictions(self, positions):
+        return self._snapshot.predictions(positions)
+
+    # Writing
+
+    def refresh(self, raw, preprocessor, model=None, version=None, id_column='Id',
+                chunk_rows=100000, incremental=False):
+        """
+        Writes a new generation for the raw rows (one per Id).
+        Features are only computed for new rows, rows whose raw features changed, or every row
+        if the fitted preprocessor changed. Predictions are only computed for those rows, or
+        every row if the model version changed.
+        With incremental=True, raw only holds new and changed rows (e.g. from
+        database.load_incremental) and the other rows of the current generation are kept.
+        Returns counts of rows, computed features and computed predictions.
+        """
+
+        ids = raw[id_column].to_numpy(dtype=np.int64)
+        if len(np.unique(ids)) != len(ids):
+            raise ValueError(f'{id_column} values are not unique')
+        row_hashes = pd.util.hash_pandas_object(
+            raw[preprocessor.raw_features], index=False).to_numpy()
+        preprocessor_version = transformer_hash(preprocessor)
+        columns = list(preprocessor.transform(raw.head(1)).columns if len(raw)
+                       else preprocessor.get_feature_names())
+
+        # Rows of the current generation that can be reused
+        reuse_features = np.zeros(len(ids), dtype=bool)
+        reuse_predictions = np.zeros(len(ids), dtype=bool)
+        old_positions = np.full(len(ids), -1)
+        same_model = False
+        current = self.snapshot() if self.open() else None
+        if current is not None and current.meta['preprocessor_version'] == preprocessor_version:
+            old_positions = current.positions(ids)
+            found = old_positions >= 0
+            reuse_features[found] = current.row_hashes[old_positions[found]] == row_hashes[found]
+            same_model = model is not None and current.model_version == version
+            same_model = same_model and current.predictions_ is not None
+            reuse_predictions = reuse_features & same_model
+        elif incremental and current is not None and len(current):
+            raise ValueError('The preprocessor changed: every row should be refreshed')
+
+        # Incremental refresh: the current rows which are not in raw come first, as they are
+        kept = []
+        if incremental and current is not None:
+            kept = np.flatnonzero(~np.isin(current.ids, ids))
+        if len(kept):
+            ids = np.concatenate([current.ids[kept], ids])
+            row_hashes = np.concatenate([current.row_hashes[kept], row_hashes])
+            old_positions = np.concatenate([kept, old_positions])
+            reuse_features = np.concatenate([np.ones(len(kept), dtype=bool), reuse_features])
+            reuse_predictions = np.concatenate([np.full(len(kept), same_model),
+                                                reuse_predictions])
+
+        # Write the new generation
+        generation = hashlib.sha1(os.urandom(16)).hexdigest()[:12]
+        path = os.path.join(self.directory, generation)
+        os.makedirs(path)
+        np.save(os.path.join(path, 'ids.npy'), ids)
+        np.save(os.path.join(path, 'row_hashes.npy'), row_hashes)
+        features = np.lib.format.open_memmap(os.path.join(path, 'features.npy'), mode='w+',
+                                             dtype=np.float64, shape=(len(ids), len(columns)))
+        predictions = None if model is None else np.lib.format.open_memmap(
+            os.path.join(path, 'predictions.npy'), mode='w+', dtype=np.float64,
+            shape=(len(ids),))
+
+        if reuse_features.any():
+            features[reuse_features] = current.features_[old_positions[reuse_features]]
+        if reuse_predictions.any():
+            predictions[reuse_predictions] = current.predictions_[
+                old_positions[reuse_predictions]]
+        todo_features = np.flatnonzero(~reuse_features)
+        for start in range(0, len(todo_features), chunk_rows):
+            rows = todo_features[start:start + chunk_rows]
+            features[rows] = preprocessor.transform(raw.iloc[rows - len(kept)]).to_numpy()
+        todo_predictions = np.flatnonzero(~reuse_predictions) if model is not None else []
+        for start in range(0, len(todo_predictions), chunk_rows):
+            rows = todo_predictions[start:start + chunk_rows]
+            predictions[rows] = model.predict(pd.DataFrame(features[rows], columns=columns))
+        features.flush()
+        if predictions is not None:
+            predictions.flush()
+
+        # Id -> row lookup
+        min_id = int(ids.min()) if len(ids) else 0
+        span = int(ids.max()) - min_id + 1 if len(ids) else 0
+        if span <= DENSE_FACTOR * max(len(ids), 1):
+            index = np.full(span, -1, dtype=np.int64)
+            index[ids - min_id] = np.arange(len(ids))
+            np.save(os.path.join(path, 'index.npy'), index)
+        else:
+            np.save(os.path.join(path, 'order.npy'), np.argsort(ids, kind='stable'))
+
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump({
+                'columns': columns,
+                'min_id': min_id,
+                'preprocessor_version': preprocessor_version,
+                'model_version': version if model is not None else None
+            }, f)
+
+        # Switch to the new generation and keep the previous one for readers still using it
+        previous = self._current()
+        tmp_path = os.path.join(self.directory, 'CURRENT.tmp')
+        with open(tmp_path, 'w') as f:
+            f.write(generation)
+        os.replace(tmp_path, os.path.join(self.directory, 'CURRENT'))
+        for name in os.listdir(self.directory):
+            if name not in (generation, previous, 'CURRENT'):
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+        self.open()
+
+        return {
+            'rows': len(ids),
+            'features_computed': len(todo_features),
+            'predictions_computed': len(todo_predictions)
+        }
+
+
+if __name__ == "__main__":
+    import database as db
+    import argparse
+    import joblib
+    import time
+
+    parser = argparse.ArgumentParser(description='Refresh the feature store of every house')
+    parser.add_argument('--incremental', action='store_true', help=(
+        'Only load the houses added since the last refresh (Id above its watermark)'))
+    args = parser.parse_args()
+
+    # Refresh the store next to the pickled preprocessor and model
+    model_path = os.path.join(PICKLE_DIR, 'Model.pkl')
+    preprocessor = joblib.load(os.path.join(PICKLE_DIR, 'PreProcessor.pkl'))
+    model = joblib.load(model_path)
+    store = FeatureStore(os.path.join(PICKLE_DIR, 'FeatureStore'))
+    incremental = args.incremental and store.open() and (
+        store.meta['preprocessor_version'] == transformer_hash(preprocessor))
+
+    # Load the houses (every known house unless incremental)
+    db_config = db.get_config()
+    loads = {table: db.load_incremental(*db_config, table, 'feature_store', reset=not incremental)
+             for table in ['raw_train', 'raw_test']}
+    raw = pd.concat([loads['raw_train'][0].drop('SalePrice', axis=1), loads['raw_test'][0]],
+                    ignore_index=True, sort=False)
+
+    start = time.time()
+    stats = store.refresh(raw, preprocessor, model, model_version(model_path),
+                          incremental=incremental)
+    for table, (_, watermark) in loads.items():
+        db.save_watermark(*db_config, 'feature_store', table, 'Id', watermark)
+    print(f'Refreshed feature store in {time.time() - start:.1f}s:', stats)
@@ -1,23 +1,148 @@
-import database as db
 import os
 import joblib
+import itertools
+import numpy as np
+import resources
+from preprocessing import PreProcessor
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.model_selection import KFold
 from sklearn.ensemble import RandomForestRegressor
 
 # To do: pull the best model from grid search
 model = RandomForestRegressor(bootstrap=False, max_features=6, n_estimators=60)
 
 
+def get_config(n_rows, n_features, n_folds=1):
+    """ Parallel training settings of the model for the machine (see resources.training_config) """
+    return resources.training_config(n_rows, n_features, model.n_estimators, n_folds)
+
+
+def fit(X, y, config=None, params=None):
+    """
+    Fits a copy of the model with the training config (default: sized for X on this machine)
+    and optional model parameters overriding the model's (e.g. n_estimators, random_state).
+    Returns the fitted model and a report: the config, fit time and peak memory.
+    The fitted model predicts single-threaded (n_jobs is reset), as serving parallelises
+    requests itself.
+    """
+
+    config = config or get_config(*X.shape)
+    params = dict(params or {}, n_jobs=config['n_jobs'])
+    if config['max_samples']:
+        params.update(bootstrap=True, max_samples=config['max_samples'])
+    fitted = clone(model).set_params(**params)
+
+    # The trees are fitted by threads sharing sklearn's float32 copy of X
+    with resources.PeakMemory() as usage:
+        fitted.fit(X, y)
+    fitted.set_params(n_jobs=None)
+    report = dict(config, fit_seconds=round(usage.seconds, 3),
+                  peak_mb=round(usage.peak_bytes / 2**20, 1))
+    return fitted, report
+
+
+def predict(fitted, X, chunk_rows):
+    """ Predicts X in chunks of chunk_rows rows, bounding the memory of sklearn's float copy """
+    return np.concatenate([fitted.predict(X[start:start + chunk_rows])
+                           for start in range(0, len(X), chunk_rows)])
+
+
+def _fold_rmse(X_fit, y_fit, X_val, y_val, config):
+    fitted, _ = fit(X_fit, y_fit, config)
+    errors = predict(fitted, X_val, config['chunk_rows']) - y_val
+    return np.sqrt(np.mean(errors ** 2))
+
+
+def cross_validate(raw, n_splits=5, cache=None, random_state=0, config=None):
+    """
+    K-fold cross-validated RMSE of the model on raw data, with the preprocessor fitted within
+    each fold. With a FeatureCache, fold features are reused across runs (e.g. when tuning
+    model parameters) instead of refitting and retransforming the preprocessor.
+    Folds are fitted config['cv_jobs'] at a time (default: sized for the data on this machine)
+    in worker processes, which memory map the fold matrices instead of copying them. Fold
+    matrices are only built when their fold is dispatched.
+    """
+
+    X, y = raw.drop('SalePrice', axis=1), raw['SalePrice']
+    folds = KFold(n_splits, shuffle=True, random_state=random_state).split(X)
+
+    # Fold matrices are built one at a time, when a fold is about to be fitted
+    def fold_data():
+        for fit_rows, val_rows in folds:
+            X_fit, X_val = X.iloc[fit_rows], X.iloc[val_rows]
+            if cache is None:
+                pp = PreProcessor().fit(X_fit)
+                X_fit_pp, X_val_pp = pp.transform(X_fit), pp.transform(X_val)
+            else:
+                pp, X_fit_pp = cache.fit_transform(PreProcessor(), X_fit)
+                X_val_pp = cache.transform(pp, X_val)
+            yield (X_fit_pp.to_numpy(np.float32), y.iloc[fit_rows].to_numpy(),
+                   X_val_pp.to_numpy(np.float32), y.iloc[val_rows].to_numpy())
+
+    data = fold_data()
+    first = next(data)
+    config = config or get_config(len(X), first[0].shape[1], n_splits)
+    data = itertools.chain([first], data)
+    del first
+    if config['cv_jobs'] == 1:
+        return np.array([_fold_rmse(*fold, config) for fold in data])
+
+    # Only the folds being fitted are held in memory (see resources.training_config)
+    parallel = Parallel(n_jobs=config['cv_jobs'], max_nbytes=config['max_nbytes'],
+                        mmap_mode='r', pre_dispatch='n_jobs')
+    return np.array(parallel(delayed(_fold_rmse)(*fold, config) for fold in data))
+
+
 if __name__ == "__main__":
+    import database as db
+    import json
+    import argparse
+    import sharding
+    import distributed
+    from feature_cache import FeatureCache
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cv', type=int, metavar='FOLDS', help=(
+        'Report the cross-validated RMSE on raw_train instead of training'))
+    parser.add_argument('--shards', type=int, default=distributed.N_SHARDS, help=(
+        'Fit the trees in this many worker processes (on TRAIN_HOSTS if set), see distributed.py'))
+    args = parser.parse_args()
 
-    # Load data
+    # Cross-validate on raw data, with fold features from the feature cache
     db_config = db.get_config()
-    train_pp = db.load(*db_config, 'processed_train')
-    X_train_pp = train_pp.drop('SalePrice', axis=1)
-    y_train = train_pp['SalePrice']
+    if args.cv:
+        raw = db.load(*db_config, 'raw_train')
+        scores = cross_validate(raw, args.cv, FeatureCache())
+        print(f'RMSE: {scores.mean():.0f} (+/- {scores.std():.0f}) over {args.cv} folds')
+
+    elif sharding.N_GROUPS > 1:
+        # Fit one forest per group of neighborhoods, and a global forest for sparse groups
+        train_pp = db.load(*db_config, 'processed_train')
+        fitted = sharding.fit(train_pp.drop('SalePrice', axis=1), train_pp['SalePrice'])
+        print('Nodes per forest (-1: global):', json.dumps(fitted.summary()))
+        DIR = os.path.abspath(os.path.dirname(__file__))
+        joblib.dump(fitted, os.path.join(DIR, '../pickle/Model.pkl'))
+
+    elif args.shards > 1:
+        # Fit shards of the trees in worker processes, and merge them into one forest
+        hosts = distributed.TRAIN_HOSTS.split(',') if distributed.TRAIN_HOSTS else None
+        fitted, reports = distributed.train('processed_train', args.shards, hosts=hosts)
+        for report in reports:
+            print('Training config:', json.dumps(report))
+        DIR = os.path.abspath(os.path.dirname(__file__))
+        joblib.dump(fitted, os.path.join(DIR, '../pickle/Model.pkl'))
+
+    else:
+        # Load data
+        train_pp = db.load(*db_config, 'processed_train')
+        X_train_pp = train_pp.drop('SalePrice', axis=1)
+        y_train = train_pp['SalePrice']
 
-    # Fit model
-    model.fit(X_train_pp, y_train)
+        # Fit model with threads and sample sizes sized for this machine, and report them
+        fitted, report = fit(X_train_pp, y_train)
+        print('Training config:', json.dumps(report))
 
-    # Save model
-    DIR = os.path.abspath(os.path.dirname(__file__))
-    joblib.dump(model, os.path.join(DIR, '../pickle/Model.pkl'))
+        # Save model
+        DIR = os.path.abspath(os.path.dirname(__file__))
+        joblib.dump(fitted, os.path.join(DIR, '../pickle/Model.pkl'))
@@ -0,0 +1,305 @@
+import database as db
+import os
+import sys
+import glob
+import json
+import time
+import hashlib
+import datetime
+import subprocess
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+DIR = os.path.abspath(os.path.dirname(__file__))
+PICKLE_DIR = os.path.join(DIR, '../pickle')
+STATE_FILE = os.environ.get('PIPELINE_STATE',
+                            os.path.join(DIR, '../data/interim/pipeline_state.json'))
+
+# Prefix of stage inputs / outputs that are database tables (anything else is a file pattern)
+TABLE = 'table:'
+
+
+class Stage():
+    """
+    A pipeline step, run as a script in its own process.
+    inputs and outputs are database tables ('table:<name>') or file paths / glob patterns.
+    The stage is skipped when its fingerprint (code, parameters and input fingerprints) and the
+    signatures of its outputs are unchanged since it last ran.
+    output_fingerprint(resource, db_config) optionally replaces the stage fingerprint as the
+    fingerprint of an output (e.g. a content hash), so that downstream stages don't rerun
+    when a stage reruns but produces the same data.
+    """
+
+    def __init__(self, name, command, code=(), inputs=(), outputs=(), params=None,
+                 output_fingerprint=None):
+        self.name = name
+        self.command = list(command)
+        self.code = list(code)
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.params = params or {}
+        self.output_fingerprint = output_fingerprint
+
+
+def _digest(*parts):
+    text = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def _code_version(paths):
+    """ Hash of the contents of source files """
+    sha = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as f:
+            sha.update(f.read())
+    return sha.hexdigest()
+
+
+def _file_signature(pattern):
+    """ Name, size and modification time of every file matching a path or glob pattern """
+    return [
+        [os.path.basename(path), os.path.getsize(path), os.stat(path).st_mtime_ns]
+        for path in sorted(glob.glob(pattern))
+    ]
+
+
+def _signature(resource, db_config):
+    """ Cheap check that an output is unchanged: row count of a table, or file stats """
+    if resource.startswith(TABLE):
+        return db.count(*db_config, resource[len(TABLE):])
+    return _file_signature(resource)
+
+
+def _ingested_fingerprint(resource, db_config):
+    """ Content hash of a raw table: the hashes of its files in the ingest manifest """
+    import data_ingest
+    manifest = data_ingest.load_manifest(*db_config)
+    files = manifest[manifest['table'] == resource[len(TABLE):]]
+    return _digest(sorted(zip(files['file'], files['sha256'])))
+
+
+def default_stages():
+    """
+    ingest -> preprocess -> train -> compress -> drift_baseline and feature_store, and calibrate
+    alongside train
+    """
+
+    from model import model
+    import data_ingest
+    import distributed
+    import sharding
+
+    def script(name):
+        return [sys.executable, os.path.join(DIR, name)]
+
+    def pickle(name):
+        return os.path.join(PICKLE_DIR, name)
+
+    model_params = model.get_params()
+    return [
+        Stage('ingest', script('data_ingest.py'),
+              code=['data_ingest.py', 'database.py'],
+              inputs=[os.path.join(data_ingest.DATA_DIR, pattern)
+                      for pattern in data_ingest.SOURCES.values()],
+              outputs=[TABLE + table for table in data_ingest.SOURCES],
+              output_fingerprint=_ingested_fingerprint),
+        Stage('preprocess', script('preprocessing.py'),
+              code=['preprocessing.py', 'feature_cache.py', 'database.py'],
+              inputs=[TABLE + 'raw_train'],
+              outputs=[TABLE + 'processed_train', pickle('PreProcessor.pkl')]),
+        Stage('train', script('model.py'),
+              code=['model.py', 'resources.py', 'distributed.py', 'sharding.py', 'database.py'],
+              inputs=[TABLE + 'processed_train'],
+              outputs=[pickle('Model.pkl')],
+              params=dict(model_params, shards=distributed.N_SHARDS,
+                          neighborhood_groups=sharding.N_GROUPS)),
+        Stage('calibrate', script('anytime.py'),
+              code=['anytime.py', 'model.py', 'resources.py', 'database.py'],
+              inputs=[TABLE + 'processed_train'],
+              outputs=[pickle('Calibration.pkl')],
+              params=model_params),
+        Stage('compress', script('compression.py'),
+              code=['compression.py', 'model.py', 'resources.py', 'sharding.py', 'database.py'],
+              inputs=[TABLE + 'processed_train', pickle('Model.pkl')],
+              outputs=[pickle('Model.pkl'), pickle('ModelFull.pkl')],
+              params=model_params),
+        Stage('drift_baseline', script('drift.py'),
+              code=['drift.py', 'database.py'],
+              inputs=[TABLE + 'raw_train', pickle('PreProcessor.pkl'), pickle('Model.pkl')],
+              outputs=[pickle('DriftBaseline.json')]),
+        Stage('feature_store', script('feature_store.py'),
+              code=['feature_store.py', 'feature_cache.py', 'database.py'],
+              inputs=[TABLE + 'raw_train', TABLE + 'raw_test', pickle('PreProcessor.pkl'),
+                      pickle('Model.pkl')],
+              outputs=[pickle('FeatureStore/CURRENT')])
+    ]
+
+
+class Pipeline():
+    """
+    Runs stages in dependency order, with independent stages in parallel, skipping stages
+    whose outputs are current. A stage depends on the earlier stages producing its inputs.
+    Fingerprints and output signatures are kept in a JSON state file.
+    """
+
+    def __init__(self, stages, db_config, state_file=STATE_FILE, max_workers=None):
+        self.stages = {stage.name: stage for stage in stages}
+        self.db_config = db_config
+        self.state_file = state_file
+        self.max_workers = max_workers or len(stages)
+
+        # Producer of each input: the last earlier stage listing it as an output
+        self.dependencies = {}
+        producers = {}
+        for stage in stages:
+            self.dependencies[stage.name] = {
+                producers[resource] for resource in stage.inputs if resource in producers
+            }
+            producers.update({resource: stage.name for resource in stage.outputs})
+
+    def _load_state(self):
+        if not os.path.exists(self.state_file):
+            return {}
+        with open(self.state_file) as f:
+            return json.load(f)
+
+    def _save_state(self, state):
+        os.makedirs(os.path.dirname(os.path.abspath(self.state_file)), exist_ok=True)
+        tmp_file = self.state_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp_file, self.state_file)
+
+    def fingerprint(self, stage, fingerprints):
+        """ Hash of the stage's code, parameters, database and input fingerprints """
+        inputs = {
+            resource: fingerprints.get(resource) or self._external_fingerprint(resource)
+            for resource in stage.inputs
+        }
+        code = _code_version([os.path.join(DIR, path) for path in stage.code])
+        return _digest(stage.name, code, stage.params, str(self.db_config), inputs)
+
+    def _external_fingerprint(self, resource):
+        """ Fingerprint of an input that no stage produces """
+        return _digest(_signature(resource, self.db_config))
+
+    def _outputs(self, stage):
+        return {resource: _signature(resource, self.db_config) for resource in stage.outputs}
+
+    def is_current(self, stage, fingerprint, state):
+        recorded = state.get(stage.name)
+        if recorded is None or recorded['fingerprint'] != fingerprint:
+            return False
+        return recorded['outputs'] == self._outputs(stage)
+
+    def _run_stage(self, stage):
+        start = time.time()
+        result = subprocess.run(stage.command, stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT, universal_newlines=True)
+        for line in result.stdout.splitlines():
+            print(f'[{stage.name}] {line}')
+        return result.returncode, time.time() - start
+
+    def run(self, force=(), dry_run=False):
+        """
+        Runs every stage that isn't current (and the stages in force).
+        Returns a DataFrame with the status and time spent of every stage.
+        """
+
+        state = self._load_state()
+        fingerprints, status, seconds = {}, {}, {}
+        running, running_fingerprints = {}, {}
+
+        def finish(name, stage_fingerprint):
+            stage = self.stages[name]
+            entry = state.get(name) if status[name] == 'skipped' else None
+            output_fingerprints = (entry or {}).get('output_fingerprints') or {
+                resource: (stage.output_fingerprint(resource, self.db_config)
+                           if stage.output_fingerprint else stage_fingerprint)
+                for resource in stage.outputs
+            }
+            fingerprints.update(output_fingerprints)
+            state[name] = {
+                'fingerprint': stage_fingerprint,
+                'outputs': self._outputs(stage),
+                'output_fingerprints': output_fingerprints,
+                'seconds': seconds[name],
+                'finished_at': datetime.datetime.now().isoformat()
+            }
+
+        with ThreadPoolExecutor(self.max_workers) as executor:
+            while len(status) < len(self.stages):
+
+                # Start (or skip) the stages whose dependencies are done
+                for name, stage in self.stages.items():
+                    if name in status or name in running.values():
+                        continue
+                    dependencies = [status.get(dep) for dep in self.dependencies[name]]
+                    if any(dep in ('failed', 'blocked') for dep in dependencies):
+                        status[name], seconds[name] = 'blocked', 0.0
+                        continue
+                    if 'pending' in dependencies:
+                        status[name], seconds[name] = 'pending', 0.0
+                        continue
+                    if None in dependencies:
+                        continue
+
+                    start = time.time()
+                    stage_fingerprint = self.fingerprint(stage, fingerprints)
+                    if name not in force and self.is_current(stage, stage_fingerprint, state):
+                        status[name], seconds[name] = 'skipped', time.time() - start
+                        finish(name, stage_fingerprint)
+                    elif dry_run:
+                        status[name], seconds[name] = 'pending', 0.0
+                    else:
+                        future = executor.submit(self._run_stage, stage)
+                        running[future] = name
+                        running_fingerprints[name] = stage_fingerprint
+
+                if not running:
+                    continue
+
+                # Record the stages that finished
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    returncode, seconds[name] = future.result()
+                    if returncode != 0:
+                        status[name] = 'failed'
+                        state.pop(name, None)
+                    else:
+                        status[name] = 'ran'
+                        finish(name, running_fingerprints[name])
+                    self._save_state(state)
+
+        # Stages writing the same output (e.g. compress rewrites Model.pkl) are re-signed
+        for name, stage in self.stages.items():
+            if status[name] in ('ran', 'skipped'):
+                state[name]['outputs'] = self._outputs(stage)
+        if not dry_run:
+            self._save_state(state)
+
+        return pd.DataFrame({
+            'stage': list(self.stages),
+            'status': [status[name] for name in self.stages],
+            'seconds': [seconds[name] for name in self.stages]
+        })
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Run the ingest / preprocess / train pipeline')
+    parser.add_argument('--force', nargs='+', default=[], metavar='STAGE',
+                        help='Run these stages even if they are current')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Only report which stages are current')
+    parser.add_argument('--workers', type=int, help='Maximum number of stages run in parallel')
+    args = parser.parse_args()
+
+    start = time.time()
+    pipeline = Pipeline(default_stages(), db.get_config(), max_workers=args.workers)
+    report = pipeline.run(force=args.force, dry_run=args.dry_run)
+    print(report.to_string(index=False))
+    print(f'Pipeline finished in {time.time() - start:.1f}s')
+    sys.exit(1 if (report['status'] == 'failed').any() else 0)
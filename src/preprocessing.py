@@ -1,8 +1,9 @@
-import database as db
 import os
+import time
+import threading
+import tracemalloc
 import numpy as np
 import pandas as pd
-import joblib
 
 from sklearn.base import BaseEstimator, TransformerMixin
 from sklearn.pipeline import Pipeline
@@ -13,6 +14,23 @@ from sklearn.preprocessing import OneHotEncoder
 
 DIR = os.path.abspath(os.path.dirname(__file__))
 
+# Functions called with a record of every fit / transform call of an instrumented pipeline step
+_step_hooks = []
+
+# Instrumented calls in progress and calls started so far. The tracemalloc peak is process-wide,
+# so the peak of a call is only reported when no other instrumented call ran during it.
+_calls_lock = threading.Lock()
+_calls = {'active': 0, 'started': 0}
+
+
+def add_step_hook(hook):
+    """ Registers a function called with a dict describing each instrumented step call """
+    _step_hooks.append(hook)
+
+
+def remove_step_hook(hook):
+    _step_hooks.remove(hook)
+
 
 class PreProcessor(TransformerMixin):
 
@@ -63,6 +81,32 @@ class PreProcessor(TransformerMixin):
             ('mssubclass', mssubclass_pipeline, ['MSSubClass'])
         ])
 
+    def _pipelines(self):
+        """ Branch pipelines of the ColumnTransformer, both unfitted and fitted """
+        transformers = list(self.preprocessing_pipeline.transformers)
+        transformers += getattr(self.preprocessing_pipeline, 'transformers_', [])
+        return [(name, pipeline) for name, pipeline, _ in transformers
+                if isinstance(pipeline, Pipeline)]
+
+    def instrument(self):
+        """ Wraps every pipeline step so that its fit / transform calls are reported to hooks """
+        for branch, pipeline in self._pipelines():
+            pipeline.steps = [
+                (name, step if isinstance(step, _HookedStep)
+                 else _HookedStep('/'.join([branch, name]), step))
+                for name, step in pipeline.steps
+            ]
+        return self
+
+    def uninstrument(self):
+        """ Removes the wrappers added by instrument() """
+        for _, pipeline in self._pipelines():
+            pipeline.steps = [
+                (name, step.step if isinstance(step, _HookedStep) else step)
+                for name, step in pipeline.steps
+            ]
+        return self
+
     def fit(self, X, y=None):
         """ Fit the preprocessing pipeline to all of the training data """
 
@@ -104,6 +148,103 @@ class PreProcessor(TransformerMixin):
         return num_features + cat_features + mssubclass_features
 
 
+class _HookedStep(BaseEstimator, TransformerMixin):
+    """
+    Wraps a pipeline step and reports each of its fit / transform calls to the step hooks:
+    wall time, input / output shape and dtype, and allocated memory when tracemalloc is tracing.
+    Allocations of other threads are counted too. Peak memory is left out (None) when calls
+    overlap, e.g. concurrent requests in the server. Before Python 3.9 the peak can't be reset,
+    so it is only reported for calls which raised the process-wide peak.
+    """
+
+    def __init__(self, name, step):
+        self.name = name
+        self.step = step
+
+    def fit(self, X, y=None):
+        call = self._start()
+        try:
+            self.step.fit(X, y)
+        except BaseException:
+            self._finish(call)
+            raise
+        self._report('fit', call, X)
+        return self
+
+    def transform(self, X, y=None):
+        call = self._start()
+        try:
+            X_t = self.step.transform(X)
+        except BaseException:
+            self._finish(call)
+            raise
+        self._report('transform', call, X, X_t)
+        return X_t
+
+    def get_feature_names(self, *args, **kwargs):
+        return self.step.get_feature_names(*args, **kwargs)
+
+    def _start(self):
+        tracing = tracemalloc.is_tracing()
+        with _calls_lock:
+            _calls['active'] += 1
+            _calls['started'] += 1
+            call_id, alone = _calls['started'], _calls['active'] == 1
+            if alone and tracing and hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+        memory, peak = tracemalloc.get_traced_memory() if tracing else (None, None)
+        return time.perf_counter(), memory, call_id, alone, peak
+
+    @staticmethod
+    def _finish(call):
+        """ Ends a call: whether no other call overlapped it, and the traced memory """
+        call_id, alone = call[2:4]
+        with _calls_lock:
+            _calls['active'] -= 1
+            alone = alone and _calls['started'] == call_id
+            return alone, tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else None
+
+    def _report(self, method, call, X, X_t=None):
+        start, memory = call[:2]
+        end = time.perf_counter()
+        alone, traced = self._finish(call)
+        record = {
+            'step': self.name,
+            'method': method,
+            'start': start,
+            'seconds': end - start,
+            'rows': _shape(X)[0],
+            'input_shape': _shape(X),
+            'input_dtype': _dtype(X),
+            'output_shape': None if X_t is None else _shape(X_t),
+            'output_dtype': None if X_t is None else _dtype(X_t),
+            'alloc_bytes': None,
+            'peak_bytes': None
+        }
+
+        # Net allocation, and peak allocation during the call if no other call overlapped it.
+        # Python 3.9+ resets the peak at the start of the call. Before, the peak is only known
+        # when the call raised the process-wide peak
+        if memory is not None and traced is not None:
+            current, peak = traced
+            record['alloc_bytes'] = current - memory
+            if alone and (hasattr(tracemalloc, 'reset_peak') or peak > call[4]):
+                record['peak_bytes'] = peak - memory
+
+        for hook in list(_step_hooks):
+            hook(record)
+
+
+def _shape(X):
+    return tuple(getattr(X, 'shape', None) or np.shape(X))
+
+
+def _dtype(X):
+    if isinstance(X, pd.DataFrame):
+        return ','.join(sorted(set(str(dtype) for dtype in X.dtypes)))
+    return str(getattr(X, 'dtype', np.asarray(X).dtype))
+
+
 class _DiscreteCleaner(BaseEstimator, TransformerMixin):
     """ Merges infrequent values with frequent ones for discrete numeric features """
 
@@ -195,17 +336,56 @@ class _MSSubClassOHE(BaseEstimator, TransformerMixin):
 
 if __name__ == "__main__":
     from preprocessing import PreProcessor # noqa
-
-    # Load data
+    import database as db
+    import argparse
+    import joblib
+    import profiling
+    from feature_cache import FeatureCache
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--profile', metavar='PREFIX', help=(
+        'Profile each pipeline step and export to PREFIX.csv, .folded and .trace.json. '
+        'Before Python 3.9, peak memory is only reported for steps which raised the peak of '
+        'the run'))
+    parser.add_argument('--no-cache', action='store_true', help=(
+        'Refit and transform even if the features are in the feature cache'))
+    parser.add_argument('--incremental', action='store_true', help=(
+        'Transform the rows added since the last run (Id above its watermark) with the saved '
+        'preprocessor, without refitting, and append them to processed_train'))
+    args = parser.parse_args()
+
+    # Load data (the watermark is saved once the rows are processed)
     db_config = db.get_config()
-    train = db.load(*db_config, 'raw_train')
+    train, watermark = db.load_incremental(*db_config, 'raw_train', 'preprocessing',
+                                           reset=not args.incremental)
     X_train = train.drop('SalePrice', axis=1)
 
-    # Fit and transform training data
-    pp = PreProcessor()
-    X_train_pp = pp.fit_transform(X_train)
-    train_pp = X_train_pp.assign(SalePrice=train['SalePrice'])
+    # Append the new rows transformed by the fitted preprocessor
+    if args.incremental:
+        train_pp = pd.DataFrame()
+        if len(train):
+            pp = joblib.load(os.path.join(DIR, '../pickle/PreProcessor.pkl'))
+            train_pp = pp.transform(X_train).assign(SalePrice=train['SalePrice'].to_numpy())
+        db.save_incremental(train_pp, *db_config, 'processed_train', 'preprocessing',
+                            'raw_train', 'Id', watermark)
+        print(f'Appended {len(train_pp)} rows to processed_train')
 
-    # Save preprocessed data and fitted preprocessor
-    db.save(train_pp, *db_config, 'processed_train')
-    joblib.dump(pp, os.path.join(DIR, '../pickle/PreProcessor.pkl'))
+    # Fit and transform training data
+    else:
+        pp = PreProcessor()
+        if args.profile:
+            with profiling.StepProfiler() as profiler:
+                X_train_pp = pp.instrument().fit_transform(X_train)
+            pp.uninstrument()
+            profiler.export(args.profile)
+            print(profiler.summary().to_string())
+        elif args.no_cache:
+            X_train_pp = pp.fit_transform(X_train)
+        else:
+            pp, X_train_pp = FeatureCache().fit_transform(pp, X_train)
+        train_pp = X_train_pp.assign(SalePrice=train['SalePrice'])
+
+        # Save preprocessed data and fitted preprocessor
+        db.save(train_pp, *db_config, 'processed_train')
+        joblib.dump(pp, os.path.join(DIR, '../pickle/PreProcessor.pkl'))
+        db.save_watermark(*db_config, 'preprocessing', 'raw_train', 'Id', watermark)
@@ -0,0 +1,114 @@
+import os
+import json
+import threading
+import tracemalloc
+import pandas as pd
+import preprocessing
+from collections import deque
+
+
+class StepProfiler():
+    """
+    Collects the fit / transform records of instrumented PreProcessor steps
+    (see PreProcessor.instrument) and exports them as a table or as flame graph / trace files.
+
+    Example use:
+    with StepProfiler() as profiler:
+        pp.instrument().fit_transform(X)
+    profiler.export('data/interim/profile')
+
+    max_records bounds memory in long-running processes (oldest records are dropped).
+    """
+
+    def __init__(self, trace_memory=True, max_records=None):
+        self.trace_memory = trace_memory
+        self.records = deque(maxlen=max_records)
+        self._lock = threading.Lock()
+        self._started_tracing = False
+
+    def start(self):
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        preprocessing.add_step_hook(self.record)
+        return self
+
+    def stop(self):
+        preprocessing.remove_step_hook(self.record)
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def record(self, record):
+        record = dict(record, thread=threading.get_ident())
+        with self._lock:
+            self.records.append(record)
+
+    def to_frame(self):
+        """ One row per step call """
+        with self._lock:
+            return pd.DataFrame(list(self.records))
+
+    def summary(self):
+        """ Calls, total / mean time and max memory per step and method, slowest first """
+
+        calls = self.to_frame()
+        if calls.empty:
+            return calls
+        summary = calls.groupby(['step', 'method']).agg(
+            calls=('seconds', 'size'),
+            total_seconds=('seconds', 'sum'),
+            mean_seconds=('seconds', 'mean'),
+            rows=('rows', 'sum'),
+            max_alloc_bytes=('alloc_bytes', 'max'),
+            max_peak_bytes=('peak_bytes', 'max')
+        )
+        return summary.sort_values('total_seconds', ascending=False).reset_index()
+
+    def to_collapsed(self):
+        """
+        Folded stacks (method;branch;step microseconds), the input format of flamegraph.pl
+        and speedscope
+        """
+
+        calls = self.to_frame()
+        if calls.empty:
+            return ''
+        calls['stack'] = calls['method'] + ';' + calls['step'].str.replace('/', ';')
+        calls['us'] = (calls['seconds'] * 1e6).round().astype(int)
+        totals = calls.groupby('stack')['us'].sum()
+        return ''.join(f'{stack} {us}\n' for stack, us in totals.items())
+
+    def to_chrome_trace(self):
+        """ Trace events viewable in chrome://tracing or Perfetto """
+
+        with self._lock:
+            records = list(self.records)
+        return {'traceEvents': [{
+            'name': record['step'],
+            'cat': record['method'],
+            'ph': 'X',
+            'ts': record['start'] * 1e6,
+            'dur': record['seconds'] * 1e6,
+            'pid': os.getpid(),
+            'tid': record['thread'],
+            'args': {key: record[key] for key in [
+                'rows', 'input_shape', 'input_dtype', 'output_shape', 'output_dtype',
+                'alloc_bytes', 'peak_bytes'
+            ]}
+        } for record in records]}
+
+    def export(self, prefix):
+        """ Writes <prefix>.csv (summary), <prefix>.folded and <prefix>.trace.json """
+
+        self.summary().to_csv(prefix + '.csv', index=False)
+        with open(prefix + '.folded', 'w') as f:
+            f.write(self.to_collapsed())
+        with open(prefix + '.trace.json', 'w') as f:
+            json.dump(self.to_chrome_trace(), f, default=str)
@@ -0,0 +1,170 @@
+import os
+import time
+import threading
+
+# Fraction of the available memory training may use (the rest is left to other processes)
+MEMORY_FRACTION = float(os.environ.get('TRAIN_MEMORY_FRACTION', 0.5))
+
+# Data sets smaller than this are cross-validated in a single process: starting worker
+# processes takes longer than fitting the folds
+PARALLEL_MIN_ROWS = int(os.environ.get('TRAIN_PARALLEL_MIN_ROWS', 5000))
+
+# Bytes per node of a fitted tree (node struct and value) and per row of a tree builder's
+# working arrays (sample indices, feature values, ...), measured with sklearn
+NODE_BYTES = 72
+BUILDER_BYTES_PER_ROW = 32
+
+# Arrays larger than this are memory mapped when sent to worker processes (see joblib.Parallel)
+MAX_NBYTES = '1M'
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def available_cpus():
+    """ CPUs this process may use: its CPU affinity, capped by the cgroup CPU quota """
+
+    if hasattr(os, 'sched_getaffinity'):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = os.cpu_count() or 1
+
+    # cgroup v2 ('<quota> <period>' or 'max <period>'), then cgroup v1
+    quota = period = None
+    cpu_max = _read('/sys/fs/cgroup/cpu.max')
+    if cpu_max and not cpu_max.startswith('max'):
+        quota, period = cpu_max.split()
+    elif cpu_max is None:
+        quota = _read('/sys/fs/cgroup/cpu/cpu.cfs_quota_us')
+        period = _read('/sys/fs/cgroup/cpu/cpu.cfs_period_us')
+    if quota and period and int(quota) > 0:
+        cpus = min(cpus, max(1, int(int(quota) / int(period))))
+    return cpus
+
+
+def available_memory():
+    """
+    Bytes of memory this process may still allocate: the memory available on the machine,
+    capped by the memory left under the cgroup limit
+    """
+
+    memory = None
+    meminfo = _read('/proc/meminfo')
+    if meminfo:
+        for line in meminfo.splitlines():
+            if line.startswith('MemAvailable:'):
+                memory = int(line.split()[1]) * 1024
+    if memory is None:
+        memory = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+
+    # cgroup v2, then cgroup v1 (which reports an unlimited limit as a huge number)
+    for limit_path, usage_path in [
+        ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory.current'),
+        ('/sys/fs/cgroup/memory/memory.limit_in_bytes',
+         '/sys/fs/cgroup/memory/memory.usage_in_bytes')
+    ]:
+        limit, usage = _read(limit_path), _read(usage_path)
+        if limit and usage and limit.isdigit():
+            memory = min(memory, max(int(limit) - int(usage), 0))
+            break
+    return memory
+
+
+def forest_bytes(n_rows, n_estimators):
+    """ Estimated memory of a fitted forest of fully grown trees on n_rows rows """
+    return n_estimators * 2 * n_rows * NODE_BYTES
+
+
+def training_config(n_rows, n_features, n_estimators, n_folds=1, cpus=None, memory=None):
+    """
+    Returns the parallel training settings for a forest on an n_rows x n_features matrix, fitted
+    once per fold, sized from the CPUs and memory available (see available_cpus and
+    available_memory):
+    - cv_jobs: folds fitted at the same time, in worker processes sharing the fold matrices
+      through memory mapping (arrays larger than max_nbytes)
+    - n_jobs: threads fitting the trees of each forest
+    - max_samples: fraction of the rows each tree is fitted on (None: every row), lowered when
+      the forests would not fit in memory. Trees are then fitted on bootstrap samples.
+    - chunk_rows: rows predicted at a time, so that prediction doesn't hold a float copy of
+      the whole matrix
+    """
+
+    cpus = cpus or available_cpus()
+    memory = memory if memory is not None else available_memory()
+    budget = int(memory * MEMORY_FRACTION)
+    matrix_bytes = n_rows * n_features * 4
+
+    # Memory of one fit: a float32 copy of the matrix, the forest and the tree builders' arrays
+    def fit_bytes(rows, n_jobs):
+        builders = n_jobs * rows * BUILDER_BYTES_PER_ROW
+        return matrix_bytes + forest_bytes(rows, n_estimators) + builders
+
+    cv_jobs = 1
+    if n_folds > 1 and n_rows >= PARALLEL_MIN_ROWS:
+        cv_jobs = min(n_folds, cpus)
+        while cv_jobs > 1 and matrix_bytes + cv_jobs * fit_bytes(n_rows, 1) > budget:
+            cv_jobs -= 1
+    n_jobs = max(1, min(cpus // cv_jobs, n_estimators))
+
+    # Subsample the rows of each tree if the forests don't fit in the memory budget
+    max_samples = None
+    fit_budget = (budget - matrix_bytes) / cv_jobs
+    if fit_bytes(n_rows, n_jobs) > fit_budget:
+        per_row = (fit_bytes(n_rows, n_jobs) - matrix_bytes) / n_rows
+        max_samples = min(max(round((fit_budget - matrix_bytes) / per_row / n_rows, 2), 0.05), 1.)
+
+    chunk_rows = max(1000, min(n_rows, budget // (16 * max(n_features, 1) * n_jobs)))
+    return {
+        'cpus': cpus,
+        'memory_mb': round(memory / 2**20),
+        'n_rows': n_rows,
+        'n_features': n_features,
+        'cv_jobs': cv_jobs,
+        'n_jobs': n_jobs,
+        'max_samples': max_samples,
+        'chunk_rows': int(chunk_rows),
+        'max_nbytes': MAX_NBYTES
+    }
+
+
+def _rss():
+    statm = _read('/proc/self/statm')
+    if statm:
+        return int(statm.split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class PeakMemory():
+    """
+    Context manager measuring the wall time and the peak resident memory of a block, above the
+    memory in use when it starts (sampled by a background thread every interval seconds)
+    """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak_bytes = 0
+        self.seconds = None
+
+    def _sample(self):
+        while not self._done.wait(self.interval):
+            self.peak_bytes = max(self.peak_bytes, _rss() - self._start_rss)
+
+    def __enter__(self):
+        self._done = threading.Event()
+        self._start_rss = _rss()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._start = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds = time.perf_counter() - self._start
+        self._done.set()
+        self._thread.join()
+        self.peak_bytes = max(self.peak_bytes, _rss() - self._start_rss)
@@ -0,0 +1,73 @@
+import database as db
+import os
+import joblib
+import pandas as pd
+
+DIR = os.path.abspath(os.path.dirname(__file__))
+PICKLE_DIR = os.path.join(DIR, '../pickle')
+
+
+def score(raw, preprocessor, model, cache=None, id_column='Id'):
+    """
+    Predicted SalePrice of every raw row, with the row ids.
+    With a FeatureCache, the features of rows scored before are read from the cache.
+    """
+
+    X_pp = cache.transform(preprocessor, raw) if cache else preprocessor.transform(raw)
+    predictions = pd.DataFrame({'SalePrice': model.predict(X_pp)})
+    if id_column in raw.columns:
+        predictions.insert(0, id_column, raw[id_column].to_numpy())
+    return predictions
+
+
+if __name__ == "__main__":
+    from feature_cache import FeatureCache
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Batch score raw data with the saved model')
+    parser.add_argument('--input', default='raw_test',
+                        help="Table name, or path to a CSV file")
+    parser.add_argument('--output', default='predictions_test',
+                        help="Table name, or path to a CSV file")
+    parser.add_argument('--no-cache', action='store_true')
+    parser.add_argument('--incremental', action='store_true', help=(
+        'Only score the rows of the input table added since the last run (Id above its '
+        'watermark) and append their predictions to the output table'))
+    args = parser.parse_args()
+    if args.incremental and args.input.endswith('.csv'):
+        parser.error('--incremental needs an input table')
+
+    # Load data and model
+    db_config = db.get_config()
+    consumer = f'score_{args.output}'
+    watermark = None
+    if args.input.endswith('.csv'):
+        raw = pd.read_csv(args.input)
+    elif args.incremental:
+        raw, watermark = db.load_incremental(*db_config, args.input, consumer)
+    else:
+        raw = db.load(*db_config, args.input)
+        watermark = raw['Id'].max() if 'Id' in raw.columns and len(raw) else None
+    preprocessor = joblib.load(os.path.join(PICKLE_DIR, 'PreProcessor.pkl'))
+    model = joblib.load(os.path.join(PICKLE_DIR, 'Model.pkl'))
+
+    # Score and save predictions (if incremental, replacing the predictions of the same Ids
+    # and saving the watermark in one transaction)
+    predictions = pd.DataFrame({'Id': [], 'SalePrice': []})
+    if len(raw):
+        predictions = score(raw, preprocessor, model, None if args.no_cache else FeatureCache())
+    if args.incremental and not args.output.endswith('.csv'):
+        db.save_incremental(predictions, *db_config, args.output, consumer, args.input, 'Id',
+                            watermark, key='Id')
+    else:
+        if args.output.endswith('.csv'):
+            predictions.to_csv(args.output, index=False)
+        else:
+            unique_ids = 'Id' in predictions.columns and predictions['Id'].is_unique
+            db.save(predictions, *db_config, args.output,
+                    primary_key=['Id'] if unique_ids else None)
+
+        # Rows up to the watermark are scored: the next incremental run starts after them
+        if watermark is not None:
+            db.save_watermark(*db_config, consumer, args.input, 'Id', watermark)
+    print(f'Scored {len(predictions)} rows')
@@ -0,0 +1,141 @@
+import os
+import numpy as np
+from joblib import Parallel, delayed
+
+# Number of groups of neighborhoods with their own model (0: a single global model)
+N_GROUPS = int(os.environ.get('TRAIN_NEIGHBORHOOD_GROUPS', 0))
+
+# Groups with fewer training rows are scored by the global model
+MIN_GROUP_ROWS = int(os.environ.get('TRAIN_MIN_GROUP_ROWS', 200))
+
+# Prefix of the one-hot encoded neighborhood columns (see PreProcessor.get_feature_names)
+PREFIX = 'Neighborhood_'
+
+
+def group_neighborhoods(neighborhoods, y, n_groups):
+    """
+    Returns {neighborhood: group}: neighborhoods sorted by median price (similar markets
+    together) and split into n_groups groups with about the same number of rows
+    """
+
+    medians = {}
+    for neighborhood, price in zip(neighborhoods, y):
+        medians.setdefault(neighborhood, []).append(price)
+    counts = {name: len(prices) for name, prices in medians.items()}
+    ordered = sorted(medians, key=lambda name: np.median(medians[name]))
+
+    groups, seen, total = {}, 0, len(neighborhoods)
+    for name in ordered:
+        groups[name] = min(int(seen * n_groups / total), n_groups - 1)
+        seen += counts[name]
+    return groups
+
+
+def _fit_group(X, y, rows, params, n_threads):
+    from model import fit, get_config
+    config = dict(get_config(len(rows), X.shape[1]), n_jobs=n_threads)
+    fitted, _ = fit(X[rows], y[rows], config, params)
+    return fitted
+
+
+class ShardedModel():
+    """
+    Forests fitted on groups of neighborhoods, with a global forest for the other rows.
+
+    Rows are routed by their one-hot encoded neighborhood column (preprocessed features) and
+    each group's rows are scored together by its forest. Neighborhoods without a group (too few
+    training rows) are scored by the global forest, which is fitted on every row only when such
+    neighborhoods exist. Each group's forest is fitted on fewer rows than a global forest, so
+    its trees are smaller and shallower.
+    """
+
+    def __init__(self, feature_names, groups, min_group_rows=MIN_GROUP_ROWS):
+        self.feature_names = list(feature_names)
+        self.groups = dict(groups)
+        self.min_group_rows = min_group_rows
+
+    def _routes(self, X):
+        """ Group of each row of a float matrix X (-1: global forest) """
+        if not len(self.route_columns_):
+            return np.full(len(X), -1)
+        hot = X[:, self.route_columns_]
+        group = self.route_groups_[hot.argmax(axis=1)]
+        return np.where(hot.max(axis=1) > 0.5, group, -1)
+
+    def fit(self, X, y, params=None, n_jobs=1):
+        """
+        Fits the global forest and the forest of each group with enough rows, n_jobs at a time
+        in worker processes (which memory map X), with model parameters overriding the model's
+        """
+
+        import resources
+        n_threads = max(1, resources.available_cpus() // n_jobs)
+
+        X = np.asarray(X, dtype=np.float32)
+        y = np.asarray(y, dtype=float)
+        columns = [i for i, name in enumerate(self.feature_names) if name.startswith(PREFIX)]
+        self.route_columns_ = np.array(columns)
+        self.route_groups_ = np.array([self.groups.get(self.feature_names[i][len(PREFIX):], -1)
+                                       for i in columns])
+
+        # The global forest is only fitted if some rows don't belong to a large enough group
+        routes = self._routes(X)
+        fitted_groups = [group for group in sorted(set(self.groups.values()))
+                         if (routes == group).sum() >= self.min_group_rows]
+        rows = [np.flatnonzero(routes == group) for group in fitted_groups]
+        fallback = not fitted_groups or sum(map(len, rows)) < len(X)
+        if fallback:
+            rows.append(np.arange(len(X)))
+        parallel = Parallel(n_jobs=n_jobs, max_nbytes='1M', mmap_mode='r')
+        forests = parallel(delayed(_fit_group)(X, y, r, params, n_threads) for r in rows)
+
+        self.forests_ = dict(zip(fitted_groups, forests))
+        self.global_ = forests[-1] if fallback else None
+        self.route_groups_ = np.where(np.isin(self.route_groups_, fitted_groups),
+                                      self.route_groups_, -1)
+        self.n_estimators = forests[0].n_estimators
+        return self
+
+    def predict(self, X, trees=None):
+        """
+        Returns the prediction of each row by its group's forest, averaging all trees or only
+        the trees with the given indices (see anytime.py)
+        """
+
+        X = np.asarray(X, dtype=np.float32)
+        routes = self._routes(X)
+        y_pred = np.empty(len(X))
+        for group in np.unique(routes):
+            rows = routes == group
+            forest = self.forests_.get(group, self.global_)
+            if forest is None:
+                raise ValueError('Rows without a neighborhood need a global forest')
+            if trees is None:
+                y_pred[rows] = forest.predict(X[rows])
+            else:
+                estimators = [forest.estimators_[i] for i in trees]
+                y_pred[rows] = np.mean([tree.predict(X[rows]) for tree in estimators], axis=0)
+        return y_pred
+
+    def summary(self):
+        """ Number of nodes of each forest, by group (-1: the global forest) """
+        forests = sorted(self.forests_.items())
+        if self.global_ is not None:
+            forests = [(-1, self.global_)] + forests
+        return {int(group): sum(tree.tree_.node_count for tree in forest.estimators_)
+                for group, forest in forests}
+
+
+def fit(X_pp, y, n_groups=N_GROUPS, min_group_rows=MIN_GROUP_ROWS, params=None):
+    """
+    Returns a ShardedModel with n_groups groups of neighborhoods, fitted in parallel on
+    preprocessed features (DataFrame)
+    """
+
+    import resources
+    columns = [name for name in X_pp.columns if name.startswith(PREFIX)]
+    neighborhoods = X_pp[columns].to_numpy().argmax(axis=1)
+    names = np.array([name[len(PREFIX):] for name in columns])[neighborhoods]
+    groups = group_neighborhoods(names, np.asarray(y), n_groups)
+    model = ShardedModel(X_pp.columns, groups, min_group_rows)
+    return model.fit(X_pp, y, params, n_jobs=min(n_groups + 1, resources.available_cpus()))
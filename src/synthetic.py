@@ -0,0 +1,193 @@
+import database as db
+import os
+import numpy as np
+import pandas as pd
+
+DIR = os.path.abspath(os.path.dirname(__file__))
+
+# Child column -> parent column: the child is sampled from its distribution within the parent value
+DEPENDENCIES = {
+    'YearBuilt': 'Neighborhood',
+    'SalePrice': 'OverallQual'
+}
+
+# Numeric columns with at most this many distinct values are sampled as discrete values
+MAX_DISCRETE_VALUES = 30
+
+
+class _Discrete():
+    """ Empirical frequencies of the values of a column (missing values included) """
+
+    def __init__(self, column):
+        counts = column.value_counts(dropna=False)
+        self.values = counts.index.to_numpy()
+        self.cdf = np.cumsum(counts.to_numpy()) / counts.sum()
+
+    def sample(self, rng, n_rows):
+        i = np.searchsorted(self.cdf, rng.random(n_rows), side='right')
+        return self.values[np.minimum(i, len(self.values) - 1)]
+
+
+class _Continuous():
+    """ Missing value rate and quantile function (inverse CDF) of a numeric column """
+
+    def __init__(self, column, n_quantiles=101):
+        values = column.dropna().to_numpy(dtype=float)
+        self.null_rate = 1 - len(values) / len(column)
+        self.probs = np.linspace(0, 1, n_quantiles)
+        self.quantiles = np.quantile(values, self.probs) if len(values) else np.zeros(1)
+        self.integer = column.dtype.kind in 'iu' or (
+            len(values) > 0 and np.all(values == np.round(values)))
+
+    def sample(self, rng, n_rows):
+        values = np.interp(rng.random(n_rows), self.probs[:len(self.quantiles)], self.quantiles)
+        if self.integer:
+            values = np.round(values)
+        if self.null_rate > 0:
+            values[rng.random(n_rows) < self.null_rate] = np.nan
+        return values
+
+
+def _fit_marginal(column):
+    if column.dtype.kind in 'biuf' and column.nunique() > MAX_DISCRETE_VALUES:
+        return _Continuous(column)
+    return _Discrete(column)
+
+
+class HouseSynthesizer():
+    """
+    Generates synthetic rows with the schema of a raw table (e.g. raw_train).
+    Learns the marginal distribution of every column, and the distribution of each dependent
+    column within each value of its parent (DEPENDENCIES). Parent values with fewer than
+    min_group_rows rows use the child's marginal distribution.
+    Sampling is vectorized, and deterministic given the seed and chunk size.
+    """
+
+    def __init__(self, dependencies=DEPENDENCIES, min_group_rows=20, id_column='Id'):
+        self.dependencies = dependencies
+        self.min_group_rows = min_group_rows
+        self.id_column = id_column
+
+    def fit(self, raw):
+        self.columns_ = list(raw.columns)
+        self.dtypes_ = raw.dtypes.to_dict()
+        self.marginals_ = {
+            name: _fit_marginal(raw[name]) for name in self.columns_ if name != self.id_column
+        }
+
+        # Conditional distributions of the dependent columns, per parent value
+        self.conditionals_ = {}
+        for child, parent in self.dependencies.items():
+            if child not in raw.columns or parent not in raw.columns:
+                continue
+            self.conditionals_[child] = (parent, {
+                value: _fit_marginal(group[child])
+                for value, group in raw.groupby(parent)
+                if len(group) >= self.min_group_rows
+            })
+        return self
+
+    def _order(self):
+        """ Columns in sampling order: parents before their children """
+        order = [name for name in self.marginals_ if name not in self.conditionals_]
+        pending = [name for name in self.marginals_ if name in self.conditionals_]
+        while pending:
+            ready = [name for name in pending if self.conditionals_[name][0] in order]
+            if not ready:
+                raise ValueError(f'Circular dependencies between columns: {pending}')
+            order.extend(ready)
+            pending = [name for name in pending if name not in ready]
+        return order
+
+    def sample(self, n_rows, rng, start_id=1):
+        """ Returns a DataFrame of n_rows synthetic rows with Ids starting at start_id """
+
+        data = {}
+        for name in self._order():
+            if name not in self.conditionals_:
+                data[name] = self.marginals_[name].sample(rng, n_rows)
+                continue
+
+            # Sample the child within each parent value
+            parent, groups = self.conditionals_[name]
+            values = self.marginals_[name].sample(rng, n_rows)
+            for parent_value, marginal in groups.items():
+                rows = np.flatnonzero(data[parent] == parent_value)
+                if len(rows):
+                    values[rows] = marginal.sample(rng, len(rows))
+            data[name] = values
+
+        if self.id_column in self.columns_:
+            data[self.id_column] = np.arange(start_id, start_id + n_rows)
+        return self._cast(pd.DataFrame(data)[self.columns_])
+
+    def _cast(self, sample):
+        """ Restores the original dtypes where the sample has no missing values """
+        for name, dtype in self.dtypes_.items():
+            if dtype.kind in 'iu' and not sample[name].isnull().any():
+                sample[name] = sample[name].astype(dtype)
+            elif dtype.kind == 'f':
+                sample[name] = sample[name].astype(dtype)
+        return sample
+
+    def generate(self, n_rows, chunk_rows=100000, seed=0):
+        """ Yields DataFrames of at most chunk_rows rows until n_rows rows have been generated """
+
+        for i, start in enumerate(range(0, n_rows, chunk_rows)):
+            rng = np.random.default_rng([seed, i])
+            yield self.sample(min(chunk_rows, n_rows - start), rng, start_id=start + 1)
+
+
+def write(chunks, fmt, output, db_config=None):
+    """
+    Streams DataFrame chunks to a CSV file, a Parquet file (requires pyarrow) or a database
+    table (output is then the table name, appended to after the first chunk replaces it)
+    """
+
+    writer = None
+    try:
+        for i, chunk in enumerate(chunks):
+            if fmt == 'csv':
+                chunk.to_csv(output, mode='w' if i == 0 else 'a', header=i == 0, index=False)
+            elif fmt == 'parquet':
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(output, table.schema)
+                writer.write_table(table)
+            elif fmt == 'db':
+                db.save(chunk, *db_config, output, if_exists='replace' if i == 0 else 'append')
+            else:
+                raise ValueError(f'Unknown format: {fmt}')
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+if __name__ == "__main__":
+    import time
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Generate synthetic house data')
+    parser.add_argument('--rows', type=int, default=10000000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--chunk-rows', type=int, default=100000)
+    parser.add_argument('--source', default=os.path.join(DIR, '../data/raw/train.csv'),
+                        help="CSV file to learn from, or 'db' for the raw_train table")
+    parser.add_argument('--format', choices=['csv', 'parquet', 'db'], default='csv')
+    parser.add_argument('--output', default=os.path.join(DIR, '../data/interim/synthetic.csv'),
+                        help="Output file, or table name for --format db")
+    args = parser.parse_args()
+
+    # Learn distributions from the raw data
+    db_config = db.get_config()
+    raw = db.load(*db_config, 'raw_train') if args.source == 'db' else pd.read_csv(args.source)
+    synthesizer = HouseSynthesizer().fit(raw)
+
+    # Stream synthetic rows to the output
+    start = time.time()
+    chunks = synthesizer.generate(args.rows, args.chunk_rows, args.seed)
+    write(chunks, args.format, args.output, db_config)
+    elapsed = time.time() - start
+    print(f'Generated {args.rows} rows in {elapsed:.1f}s ({args.rows / elapsed * 60:.0f} rows/min)')
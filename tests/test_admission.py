@@ -0,0 +1,115 @@
+from src.app import admission
+
+import asyncio
+import threading
+import pytest
+
+
+def _controller(**kwargs):
+    config = dict(max_rows=1000, interactive_max_rows=10, interactive_concurrency=1,
+                  interactive_queue=1, batch_concurrency=1, batch_queue=0,
+                  queue_timeout=0.05, retry_after=2)
+    config.update(kwargs)
+    return admission.AdmissionController(**config)
+
+
+def test_too_many_rows():
+
+    # Set up: controller
+    controller = _controller()
+
+    # Test that: requests above max_rows are rejected with 413 and no Retry-After
+    with pytest.raises(admission.Overloaded) as e:
+        controller.acquire(1001)
+    assert e.value.status == 413
+    assert e.value.headers == {}
+
+
+def test_full_queue_is_rejected():
+
+    # Set up: batch lane with its only slot taken and no queue
+    controller = _controller()
+    controller.acquire(100)
+
+    # Test that: the next batch request is rejected immediately with 429 and Retry-After
+    with pytest.raises(admission.Overloaded) as e:
+        controller.acquire(100)
+    assert e.value.status == 429
+    assert e.value.headers == {'Retry-After': '2'}
+
+
+def test_queue_timeout():
+
+    # Set up: interactive lane with its only slot taken
+    controller = _controller()
+    controller.acquire(1)
+
+    # Test that: a queued request gives up after queue_timeout with 503
+    with pytest.raises(admission.Overloaded) as e:
+        controller.acquire(1)
+    assert e.value.status == 503
+    assert controller.lanes['interactive'].queued == 0
+
+
+def test_queued_request_gets_released_slot():
+
+    # Set up: interactive lane with its only slot taken
+    controller = _controller(queue_timeout=5)
+    lane = controller.acquire(1)
+    threading.Timer(0.05, lane.release).start()
+
+    # Function call
+    with controller.admit(1) as admitted:
+
+        # Test that: the queued request is admitted once the slot is released
+        assert admitted is controller.lanes['interactive']
+
+
+def test_batch_load_does_not_block_interactive():
+
+    # Set up: batch lane saturated
+    controller = _controller()
+    controller.acquire(100)
+
+    # Test that: interactive requests are still admitted immediately
+    with controller.admit(1) as lane:
+        assert lane.name == 'interactive'
+
+
+def test_async_lane_queue():
+
+    # Set up: interactive lane with its only slot taken, and a request queued behind it
+    controller = _controller(queue_timeout=5)
+
+    async def requests():
+        first = await controller.acquire_async(1)
+        queued = asyncio.ensure_future(controller.acquire_async(1))
+        await asyncio.sleep(0)
+        with pytest.raises(admission.Overloaded) as full:
+            await controller.acquire_async(1)
+        first.release()
+        await queued
+        return full.value.status, controller.async_lanes['interactive']
+
+    # Function call
+    status, lane = asyncio.run(requests())
+
+    # Test that: the queue is bounded, and the queued request is handed the released slot
+    assert status == 429
+    assert (lane.active, lane.queued) == (1, 0)
+
+
+def test_async_lane_timeout():
+
+    # Set up: interactive lane with its only slot taken
+    controller = _controller()
+
+    async def requests():
+        await controller.acquire_async(1)
+        with pytest.raises(admission.Overloaded) as e:
+            await controller.acquire_async(1)
+        return e.value.status
+
+    # Test that: a queued request gives up after queue_timeout with 503 and leaves the queue
+    assert asyncio.run(requests()) == 503
+    assert controller.async_lanes['interactive'].queued == 0
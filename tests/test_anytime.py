@@ -0,0 +1,60 @@
+from src import anytime
+from src import compression
+
+import time
+import numpy as np
+from sklearn.ensemble import RandomForestRegressor
+
+
+def _fit_forest():
+    rng = np.random.RandomState(0)
+    X = rng.normal(size=(200, 4))
+    y = 2 * X[:, 0] + X[:, 2] + rng.normal(scale=0.5, size=200)
+    forest = RandomForestRegressor(bootstrap=False, max_features=2, n_estimators=8,
+                                   random_state=0).fit(X, y)
+    return forest, X, y
+
+
+class TestPredictAnytime():
+
+    def test_no_deadline_uses_all_trees(self):
+
+        # Set up: fitted forest
+        forest, X, _ = _fit_forest()
+
+        # Function call
+        y_pred, n_trees, error_bound = anytime.predict_anytime(forest, X)
+
+        # Test that: the full forest is evaluated and the error bound is zero
+        assert n_trees == 8
+        assert np.allclose(y_pred, forest.predict(X))
+        assert np.allclose(error_bound, 0)
+
+    def test_expired_deadline_uses_one_tree(self):
+
+        # Set up: fitted forest and compact copy
+        forest, X, _ = _fit_forest()
+        compact = compression.CompactForest(forest)
+
+        # Function call
+        y_pred, n_trees, _ = anytime.predict_anytime(compact, X, deadline=time.perf_counter())
+
+        # Test that: only the first tree is used
+        assert n_trees == 1
+        assert np.allclose(y_pred, forest.estimators_[0].predict(X))
+
+
+def test_calibrate():
+
+    # Set up: fitted forest
+    forest, X, y = _fit_forest()
+
+    # Function call
+    calibration = anytime.calibrate(forest, X, y)
+    _, _, error_bound = anytime.predict_anytime(forest, X, deadline=time.perf_counter(),
+                                                calibration=calibration)
+
+    # Test that: there is one row per tree count, and the full forest has no error vs. itself
+    assert list(calibration.index) == list(range(1, 9))
+    assert calibration.loc[8, 'rmse_vs_full'] == 0
+    assert np.allclose(error_bound, calibration.loc[1, 'rmse_vs_full'])
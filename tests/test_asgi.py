@@ -0,0 +1,269 @@
+from src.app import asgi
+
+import os
+import gzip
+import json
+import asyncio
+import numpy as np
+import pandas as pd
+
+import shadow
+
+
+class _MeanModel():
+    """ Stand-in preprocessor and model: predicts the sum of the two (non-negative) columns """
+
+    raw_features = ['a', 'b']
+
+    def transform(self, X):
+        return X[self.raw_features]
+
+    def predict(self, X):
+        X = np.asarray(X)
+        if (X < 0).any():
+            raise ValueError('Negative values')
+        return X.sum(axis=1).astype(float)
+
+
+class _DoubledModel(_MeanModel):
+
+    def predict(self, X):
+        return 2 * super().predict(X)
+
+
+class _ScaledPreprocessor(_MeanModel):
+    """ Stand-in preprocessor which makes other features than _MeanModel """
+
+    def transform(self, X):
+        return 10 * super().transform(X)
+
+
+def _request(body, content_type=b'application/json', path='/predict', headers=()):
+    """ Calls the ASGI app and returns (status, json response) """
+
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {'type': 'http', 'method': 'POST', 'path': path,
+             'headers': [(b'content-type', content_type)] + list(headers)}
+    asyncio.run(asgi.app(scope, receive, send))
+    body = sent[1]['body']
+    if (b'content-encoding', b'gzip') in sent[0]['headers']:
+        body = gzip.decompress(body)
+    return sent[0]['status'], json.loads(body)
+
+
+def _use_stand_in_model():
+    # asgi uses the top-level scoring module (app folder is flattened in docker)
+    asgi.scoring.state.update(preprocessor=_MeanModel(), preprocessor_version=None,
+                              model=_MeanModel())
+
+
+def test_predict_json():
+
+    # Set up: stand-in model
+    _use_stand_in_model()
+    body = json.dumps({'data': [{'a': 1, 'b': 2}, {'a': 3, 'b': 4}]}).encode()
+
+    # Function call
+    status, response = _request(body)
+
+    # Test that: the predictions are returned with the Flask app's response format
+    assert status == 200
+    assert response == {'status': 'success', 'data': [3., 7.]}
+
+
+def test_predict_without_data():
+
+    # Function call
+    status, response = _request(b'{}')
+
+    # Test that: a 400 error is returned
+    assert status == 400
+    assert response['status'] == 'error'
+
+
+def test_predict_non_object_json():
+
+    # Function call
+    statuses = [_request(body)[0] for body in [b'[1, 2]', b'"data"', b'null', b'3']]
+
+    # Test that: JSON bodies which are not objects are rejected with a 400 error
+    assert statuses == [400] * 4
+
+
+def test_predict_invalid_budget():
+
+    # Set up: stand-in model
+    _use_stand_in_model()
+    data = [{'a': 1, 'b': 2}]
+
+    # Function call
+    statuses = [_request(json.dumps({'data': data, 'budget_ms': budget_ms}).encode())[0]
+                for budget_ms in ['abc', -5, 0, 'nan', [1]]]
+
+    # Test that: budgets which are not positive numbers are rejected with a 400 error
+    assert statuses == [400] * 5
+
+
+def test_predict_body_too_large(monkeypatch):
+
+    # Set up: body cap below the size of the request
+    monkeypatch.setattr(asgi, 'MAX_CONTENT_LENGTH', 10)
+    body = json.dumps({'data': [{'a': 1, 'b': 2}]}).encode()
+
+    # Function call: with and without Content-Length
+    status, _ = _request(body, headers=[(b'content-length', str(len(body)).encode())])
+    streamed_status, response = _request(body)
+
+    # Test that: the request is rejected with a 413 error either way
+    assert (status, streamed_status) == (413, 413)
+    assert response['status'] == 'error'
+
+
+def test_predict_ids(tmp_path):
+
+    # Set up: stand-in model and a feature store with three houses
+    _use_stand_in_model()
+    raw = pd.DataFrame({'Id': [1, 2, 3], 'a': [1., 2., 3.], 'b': [10., 20., 30.]})
+    store = asgi.scoring.feature_store.FeatureStore(os.path.join(tmp_path, 'store'))
+    store.refresh(raw, _MeanModel(), _MeanModel(), version='stored')
+    asgi.scoring.state.update(feature_store=store, version='stored')
+
+    # Function call: stored predictions, then predictions of a newer model from stored features
+    status, response = _request(json.dumps({'ids': [2, 9, 3]}).encode())
+    asgi.scoring.state['version'] = 'newer'
+    _, newer_response = _request(json.dumps({'ids': 1}).encode())
+    bad_status, _ = _request(json.dumps({'ids': ['a']}).encode())
+
+    # Test that: known Ids are looked up, unknown Ids are listed and invalid Ids rejected
+    assert status == 200
+    assert response == {'status': 'success', 'data': [22., None, 33.], 'missing': [9]}
+    assert newer_response == {'status': 'success', 'data': [11.], 'missing': []}
+    assert bad_status == 400
+    asgi.scoring.state.pop('feature_store')
+
+
+def test_predict_ids_other_preprocessor(tmp_path):
+
+    # Set up: feature store made by the stand-in preprocessor, then a model with another one
+    _use_stand_in_model()
+    raw = pd.DataFrame({'Id': [1, 2], 'a': [1., 2.], 'b': [10., 20.]})
+    store = asgi.scoring.feature_store.FeatureStore(os.path.join(tmp_path, 'store'))
+    store.refresh(raw, _MeanModel(), _MeanModel(), version='stored')
+    asgi.scoring.state.update(feature_store=store, version='stored')
+    _, stored_response = _request(json.dumps({'ids': [1]}).encode())
+    asgi.scoring.state.update(preprocessor=_ScaledPreprocessor(), version='rescaled')
+
+    # Function call
+    status, response = _request(json.dumps({'ids': [1]}).encode())
+
+    # Test that: stored features are not scored with a model of another preprocessor
+    assert stored_response['data'] == [11.]
+    assert status == 409
+    assert response['status'] == 'error'
+    asgi.scoring.state.pop('feature_store')
+    _use_stand_in_model()
+
+
+def test_predict_columns():
+
+    # Set up: stand-in model and a large column-oriented request from a gzip client
+    _use_stand_in_model()
+    n_rows = 5000
+    body = json.dumps({'columns': {'a': list(range(n_rows)), 'b': [1] * n_rows}}).encode()
+
+    # Function call
+    status, response = _request(body, headers=[(b'accept-encoding', b'gzip')])
+    bad_status, _ = _request(json.dumps({'columns': {'a': [1], 'b': []}}).encode())
+
+    # Test that: columns are scored like rows, and columns of different lengths are rejected
+    assert status == 200
+    assert response['data'] == [float(i + 1) for i in range(n_rows)]
+    assert bad_status == 400
+
+
+def test_coalescer_splits_results():
+
+    # Set up: stand-in model, a newer version predicting twice as much, and concurrent small
+    # requests, the last ones for the newer version (which arrived after a hot swap)
+    _use_stand_in_model()
+    model = asgi.scoring.artifacts()
+    doubled = dict(model, model=_DoubledModel(), version='doubled')
+    coalescer = asgi._Coalescer(window=0.01, batch_rows=1000)
+    frames = [pd.DataFrame({'a': [i, i], 'b': [1, 2]}) for i in range(5)]
+    models = [model] * 3 + [doubled] * 2
+
+    async def predict_all():
+        return await asyncio.gather(*[coalescer.predict(X, m) for X, m in zip(frames, models)])
+
+    # Function call
+    results = asyncio.run(predict_all())
+
+    # Test that: each request gets its own predictions back, from the model it arrived with
+    for i, y_pred in enumerate(results):
+        scale = 2 if i >= 3 else 1
+        assert list(y_pred) == [scale * (i + 1), scale * (i + 2)]
+
+
+def test_coalescer_isolates_bad_requests():
+
+    # Set up: stand-in model, one request with invalid values
+    _use_stand_in_model()
+    model = asgi.scoring.artifacts()
+    coalescer = asgi._Coalescer(window=0.01, batch_rows=1000)
+    frames = [pd.DataFrame({'a': [1], 'b': [1]}), pd.DataFrame({'a': [-1], 'b': [1]})]
+
+    async def predict_all():
+        return await asyncio.gather(*[coalescer.predict(X, model) for X in frames],
+                                    return_exceptions=True)
+
+    # Function call
+    good, bad = asyncio.run(predict_all())
+
+    # Test that: only the bad request fails
+    assert list(good) == [2.]
+    assert isinstance(bad, ValueError)
+
+
+def test_predict_model_version():
+
+    # Set up: stand-in model as the only (default) version
+    _use_stand_in_model()
+    asgi.scoring.state['version'] = 'default'
+    body = {'data': [{'a': 1, 'b': 2}]}
+
+    # Function call
+    status, response = _request(json.dumps(dict(body, model_version='unknown')).encode())
+    _, models = _request(b'', path='/models')
+
+    # Test that: unknown versions are rejected and the loaded versions are listed
+    assert status == 404
+    assert models['data'] == [{'name': None, 'model_version': 'default', 'default': True}]
+
+
+def test_predict_shadow():
+
+    # Set up: stand-in model with a shadow copy of itself
+    _use_stand_in_model()
+    scorer = shadow.ShadowScorer([{'version': 'copy', 'model': _MeanModel()}])
+    asgi.scoring.state['shadow'] = scorer.start()
+    body = json.dumps({'data': [{'a': 1, 'b': 2}]}).encode()
+
+    # Function call
+    status, response = _request(body)
+    scorer.join()
+    _, summary = _request(b'', path='/shadow')
+    asgi.scoring.state.pop('shadow').stop()
+
+    # Test that: the primary answer is returned and the shadow model scored the same batch
+    assert status == 200
+    assert response['data'] == [3.]
+    assert summary['data']['candidates'][0]['rows'] == 1
+    assert summary['data']['candidates'][0]['max_abs_diff'] == 0
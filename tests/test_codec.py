@@ -0,0 +1,41 @@
+from src.app import codec
+
+import gzip
+import json
+import numpy as np
+import pytest
+
+
+def test_frame():
+
+    # Set up: column-oriented payload with a missing value
+    columns = {'a': [1, None, 3], 'b': ['x', 'y', 'z']}
+
+    # Function call
+    X = codec.frame(columns)
+
+    # Test that: columns get typed dtypes, and columns of different lengths are rejected
+    assert X['a'].dtype == np.float64
+    assert np.isnan(X.loc[1, 'a'])
+    assert X['b'].tolist() == ['x', 'y', 'z']
+    with pytest.raises(ValueError):
+        codec.frame({'a': [1, 2], 'b': [1]})
+
+
+def test_dumps_and_compress():
+
+    # Set up: response with a NumPy array of predictions
+    y_pred = np.linspace(0, 1, 10000)
+    response = {'status': 'success', 'data': y_pred, 'n_trees': np.int64(3)}
+
+    # Function call
+    body = codec.dumps(response)
+    compressed, headers = codec.compress(body, 'br, gzip;q=0.8')
+    small, small_headers = codec.compress(b'{}', 'gzip')
+
+    # Test that: arrays are serialized as lists and large bodies are compressed for gzip clients
+    assert json.loads(body) == {'status': 'success', 'data': y_pred.tolist(), 'n_trees': 3}
+    assert headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(compressed) == body
+    assert (small, small_headers) == (b'{}', {})
+    assert codec.compress(body, 'identity') == (body, {})
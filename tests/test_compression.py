@@ -0,0 +1,97 @@
+from src import compression
+
+import numpy as np
+import pytest
+from sklearn.ensemble import RandomForestRegressor
+
+
+def _fit_forest():
+    rng = np.random.RandomState(0)
+    X = rng.normal(size=(300, 5))
+    y = 3 * X[:, 0] + X[:, 1] ** 2 + rng.normal(scale=0.1, size=300)
+    forest = RandomForestRegressor(bootstrap=False, max_features=3, n_estimators=10,
+                                   random_state=0).fit(X, y)
+    return forest, X, y
+
+
+class TestCompactForest():
+
+    def test_unpruned_matches_forest(self):
+
+        # Set up: fitted forest
+        forest, X, _ = _fit_forest()
+
+        # Function call
+        compact = compression.CompactForest(forest)
+
+        # Test that: the flattened forest gives the same predictions as sklearn
+        assert compact.n_nodes == sum(est.tree_.node_count for est in forest.estimators_)
+        assert np.allclose(compact.predict(X), forest.predict(X))
+
+    def test_subset_of_trees(self):
+
+        # Set up: fitted forest
+        forest, X, _ = _fit_forest()
+        compact = compression.CompactForest(forest)
+
+        # Function call
+        y_pred = compact.predict(X, trees=[0, 3])
+
+        # Test that: only the selected trees are averaged
+        expected = (forest.estimators_[0].predict(X) + forest.estimators_[3].predict(X)) / 2
+        assert np.allclose(y_pred, expected)
+
+    def test_pruning_and_quantization_reduce_size(self):
+
+        # Set up: fitted forest
+        forest, X, _ = _fit_forest()
+        full = compression.CompactForest(forest)
+
+        # Function call
+        pruned = compression.CompactForest(forest, ccp_alpha=0.01, max_depth=4, dtype=np.float16)
+
+        # Test that: the pruned model has fewer nodes, respects max_depth and is smaller
+        assert pruned.n_nodes < full.n_nodes
+        assert pruned.depth_ <= 4
+        assert compression._size_bytes(pruned) < compression._size_bytes(full)
+        assert pruned.predict(X).shape == (len(X),)
+
+    def test_out_of_range_precision(self):
+
+        # Set up: forest predicting sale prices, above the largest float16 (65504)
+        forest, X, y = _fit_forest()
+        prices = RandomForestRegressor(n_estimators=2, random_state=0).fit(X, 150000 + 1000 * y)
+
+        # Function call
+        curve = compression.compression_curve(prices, X, 150000 + 1000 * y, ccp_alphas=[0],
+                                              max_depths=[None], dtypes=[np.float32, np.float16])
+
+        # Test that: float16 can't hold the leaf values, and is left out of the curve
+        with pytest.raises(ValueError):
+            compression.CompactForest(prices, dtype=np.float16)
+        assert curve['dtype'].tolist() == [None, 'float32']
+
+
+def test_compression_curve_and_selection():
+
+    # Set up: fitted forest and validation data
+    forest, _, _ = _fit_forest()
+    rng = np.random.RandomState(1)
+    X_val = rng.normal(size=(100, 5))
+    y_val = 3 * X_val[:, 0] + X_val[:, 1] ** 2
+
+    # Function call
+    curve = compression.compression_curve(forest, X_val, y_val, ccp_alphas=[0, 0.01],
+                                          max_depths=[None, 4], dtypes=[np.float32])
+    params = compression.select_compression(curve, tolerance=0.05)
+
+    # Test that: the curve has a baseline row plus one row per combination
+    assert len(curve) == 1 + 2 * 2 * 1
+    assert list(curve.columns) == ['ccp_alpha', 'max_depth', 'dtype', 'n_nodes',
+                                   'size_bytes', 'rmse']
+
+    # Test that: the selected parameters are within tolerance of the baseline
+    assert params is not None
+    compact = compression.CompactForest(forest, **params)
+    rmse = np.sqrt(np.mean((compact.predict(X_val) - y_val) ** 2))
+    assert rmse <= curve['rmse'].iloc[0] * 1.05
@@ -0,0 +1,107 @@
+from src import data_ingest
+
+import os
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+import database
+
+
+def _write_csv(path, start, n_rows):
+    data = pd.DataFrame({
+        'Id': range(start, start + n_rows),
+        'LotFrontage': [None if i % 7 == 0 else 60.5 + i for i in range(n_rows)],
+        'Alley': [None if i % 3 else 'Pave' for i in range(n_rows)],
+        'SalePrice': [100000 + i for i in range(n_rows)]
+    })
+    data.to_csv(path, index=False)
+    return data
+
+
+def test_read_chunks_matches_read_csv(tmp_path):
+
+    # Set up: CSV file with missing values in every column type
+    path = os.path.join(tmp_path, 'train.csv')
+    _write_csv(path, 1, 5000)
+    dtypes = data_ingest.infer_dtypes(path, sample_rows=10)
+
+    # Function call: small chunks parsed in parallel
+    with ProcessPoolExecutor(2) as executor:
+        chunks = list(data_ingest.read_chunks(path, 10000, dtypes, executor))
+
+    # Test that: every row is read once, in order, with the same dtypes in every chunk
+    assert len(chunks) > 2
+    assert len({tuple(chunk.dtypes) for chunk in chunks}) == 1
+    data = pd.concat(chunks, ignore_index=True)
+    expected = pd.read_csv(path)
+    assert data['Id'].tolist() == expected['Id'].tolist()
+    pd.testing.assert_series_equal(data['LotFrontage'], expected['LotFrontage'])
+    assert data['Alley'].isnull().sum() == expected['Alley'].isnull().sum()
+
+
+def test_dtypes_widened_across_files(tmp_path):
+
+    # Set up: a file with whole lot frontages and no alleys, then one with decimals and alleys
+    url, db_name, schema = 'sqlite:///', os.path.join(tmp_path, 'ingest.sqlite'), 'test'
+    data_dir = os.path.join(tmp_path, 'raw')
+    os.makedirs(data_dir)
+    first = pd.DataFrame({'Id': [1, 2], 'LotFrontage': [60, 70], 'Alley': [None, None],
+                          'SalePrice': [100000, 200000]})
+    first.to_csv(os.path.join(data_dir, 'train.csv'), index=False)
+    second = _write_csv(os.path.join(data_dir, 'train_2.csv'), 3, 20)
+    paths = [os.path.join(data_dir, name) for name in ['train.csv', 'train_2.csv']]
+
+    # Function call
+    dtypes = data_ingest.infer_dtypes(paths)
+    data_ingest.ingest(url, db_name, schema, data_dir, {'raw_train': 'train*.csv'}, n_workers=1)
+    loaded = database.load(url, db_name, schema, 'raw_train')
+
+    # Test that: the integer column is widened to floats, and both files are ingested whole
+    assert dtypes == {'Id': 'Int64', 'LotFrontage': 'float64', 'Alley': 'object',
+                      'SalePrice': 'Int64'}
+    assert len(loaded) == 22
+    assert loaded['LotFrontage'].tolist()[:2] == [60., 70.]
+    assert loaded['LotFrontage'][3] == second['LotFrontage'][1] == 61.5
+
+
+def test_ingest_skips_appends_and_rebuilds(tmp_path):
+
+    # Set up: database config and a first training file
+    url, db_name, schema = 'sqlite:///', os.path.join(tmp_path, 'ingest.sqlite'), 'test'
+    data_dir = os.path.join(tmp_path, 'raw')
+    os.makedirs(data_dir)
+    sources = {'raw_train': 'train*.csv'}
+    _write_csv(os.path.join(data_dir, 'train.csv'), 1, 100)
+
+    def run():
+        return data_ingest.ingest(url, db_name, schema, data_dir, sources, n_workers=1)
+
+    # Function call: first ingest
+    manifest = run()
+
+    # Test that: the table and manifest are created
+    assert database.count(url, db_name, schema, 'raw_train') == 100
+    assert manifest['file'].tolist() == ['train.csv']
+    assert manifest['rows'].tolist() == [100]
+
+    # Test that: an unchanged rerun leaves the table untouched
+    rerun = run()
+    assert database.count(url, db_name, schema, 'raw_train') == 100
+    assert rerun['ingested_at'].tolist() == manifest['ingested_at'].tolist()
+
+    # Test that: a new file is appended
+    _write_csv(os.path.join(data_dir, 'train_2.csv'), 101, 50)
+    manifest = run()
+    assert database.count(url, db_name, schema, 'raw_train') == 150
+    assert sorted(manifest['file']) == ['train.csv', 'train_2.csv']
+
+    # Test that: a changed file rebuilds the table from every file
+    _write_csv(os.path.join(data_dir, 'train.csv'), 1, 80)
+    run()
+    loaded = database.load(url, db_name, schema, 'raw_train')
+    assert sorted(loaded['Id']) == list(range(1, 81)) + list(range(101, 151))
+
+    # Test that: a table that doesn't match the manifest is rebuilt
+    database.save(loaded.head(10), url, db_name, schema, 'raw_train')
+    run()
+    assert database.count(url, db_name, schema, 'raw_train') == 130
@@ -126,3 +126,114 @@ def test_save():
 
     # Clean up
     _remove_file(db)
+
+
+def test_save_with_indexes_and_filtered_load(tmp_path):
+
+    # Set up: database config and houses to save
+    url = make_url('sqlite:///')
+    db = str(tmp_path / 'database.sqlite')
+    data = pd.DataFrame({
+        'Id': range(1, 1001),
+        'Neighborhood': ['NAmes', 'OldTown', 'Edwards', 'CollgCr'] * 250,
+        'YearBuilt': [1900 + i % 110 for i in range(1000)],
+        'SalePrice': [100000. + i for i in range(1000)]
+    })
+
+    # Function call: create the table with keys and indexes, append to it, then filter
+    database.save(data[:500], url, db, 'test', 'houses', primary_key=['Id'],
+                  indexes=['Neighborhood', 'YearBuilt'], partition_by={'column': 'Id'})
+    database.save(data[500:], url, db, 'test', 'houses', if_exists='append',
+                  primary_key=['Id'], indexes=['Neighborhood', 'YearBuilt'])
+    by_neighborhood = database.load(url, db, 'test', 'houses', {'Neighborhood': 'OldTown'})
+    by_ids = database.load(url, db, 'test', 'houses', {'Id': [3, 7, 2000]})
+    by_years = database.load(url, db, 'test', 'houses', {'YearBuilt': (2000, 2005)})
+    plans = [database.explain(url, db, 'test', 'houses', filters) for filters in
+             [{'Neighborhood': 'OldTown'}, {'Id': [3, 7]}, {'YearBuilt': (2000, 2005)}]]
+
+    # Test that: appending keeps the table, filtered loads return the matching rows and use the
+    # indexes and primary key instead of scanning the table
+    assert database.count(url, db, 'test', 'houses') == 1000
+    assert len(by_neighborhood) == 250 and set(by_neighborhood['Neighborhood']) == {'OldTown'}
+    assert by_ids['Id'].tolist() == [3, 7]
+    assert len(by_years) == 9 * 6
+    assert 'ix_test_houses_Neighborhood' in ' '.join(plans[0])
+    assert 'PRIMARY KEY' in ' '.join(plans[1]) or 'INDEX' in ' '.join(plans[1])
+    assert 'ix_test_houses_YearBuilt' in ' '.join(plans[2])
+    assert not any('SCAN' in line for plan in plans for line in plan)
+
+
+def test_load_incremental(tmp_path):
+
+    # Set up: database config and a table of houses updated over time
+    url = make_url('sqlite:///')
+    db = str(tmp_path / 'database.sqlite')
+    data = pd.DataFrame({
+        'Id': range(1, 8),
+        'UpdatedAt': pd.to_datetime(['2020-01-0%d' % day for day in [1, 2, 3, 4, 5, 6, 7]]),
+        'SalePrice': [100000. + i for i in range(7)]
+    })
+    database.save(data[:5], url, db, 'test', 'houses', primary_key=['Id'])
+
+    # Function call: first load, a load before the watermark is saved, then a load of the new
+    # rows once it is saved
+    first, watermark = database.load_incremental(url, db, 'test', 'houses', 'scoring')
+    again, _ = database.load_incremental(url, db, 'test', 'houses', 'scoring')
+    database.save_watermark(url, db, 'test', 'scoring', 'houses', 'Id', watermark)
+    database.save(data[5:], url, db, 'test', 'houses', if_exists='append')
+    new, new_watermark = database.load_incremental(url, db, 'test', 'houses', 'scoring')
+    other, _ = database.load_incremental(url, db, 'test', 'houses', 'other')
+    database.save_watermark(url, db, 'test', 'other', 'houses', 'UpdatedAt',
+                            pd.Timestamp('2020-01-06'))
+    updated, _ = database.load_incremental(url, db, 'test', 'houses', 'other', 'UpdatedAt')
+
+    # Test that: rows are loaded again until the watermark is saved, then only the new rows,
+    # with a watermark per consumer, on an Id or a timestamp column
+    assert first['Id'].tolist() == again['Id'].tolist() == [1, 2, 3, 4, 5]
+    assert watermark == 5
+    assert new['Id'].tolist() == [6, 7] and new_watermark == 7
+    assert len(other) == 7
+    assert updated['Id'].tolist() == [7]
+    assert database.get_watermark(url, db, 'test', 'scoring', 'houses') == 5
+    assert database.get_watermark(url, db, 'test', 'nobody', 'houses') is None
+
+
+def test_save_incremental_reruns_batch(tmp_path, monkeypatch):
+
+    # Set up: database config, new houses, and their features and predictions
+    url = make_url('sqlite:///')
+    db = str(tmp_path / 'database.sqlite')
+    database.save(pd.DataFrame({'Id': range(1, 6), 'LotArea': range(5)}), url, db, 'test', 'raw')
+    rows, watermark = database.load_incremental(url, db, 'test', 'raw', 'scoring')
+    predictions = rows[['Id']].assign(SalePrice=100000.)
+
+    def fail(*args):
+        raise ConnectionError('Connection lost')
+
+    # Function call: runs failing while they save the watermark, then the runs again, and the
+    # batch of predictions once more (as if its watermark had been lost)
+    with monkeypatch.context() as patch:
+        patch.setattr(database, '_write_watermark', fail)
+        for table, consumer, key in [('predictions', 'scoring', 'Id'), ('features', 'pp', None)]:
+            data = predictions if key else rows[['LotArea']]
+            try:
+                database.save_incremental(data, url, db, 'test', table, consumer, 'raw', 'Id',
+                                          watermark, key=key)
+            except ConnectionError:
+                pass
+    written = [database.count(url, db, 'test', table) for table in ['predictions', 'features']]
+    rerun, rerun_watermark = database.load_incremental(url, db, 'test', 'raw', 'scoring')
+    for _ in range(2):
+        database.save_incremental(predictions, url, db, 'test', 'predictions', 'scoring', 'raw',
+                                  'Id', rerun_watermark, key='Id')
+    database.save_incremental(rows[['LotArea']], url, db, 'test', 'features', 'pp', 'raw', 'Id',
+                              watermark)
+    new, _ = database.load_incremental(url, db, 'test', 'raw', 'scoring')
+
+    # Test that: the failed runs wrote no rows, the rows are loaded again, and re-running a
+    # batch replaces its rows by key
+    assert written == [0, 0]
+    assert rerun['Id'].tolist() == [1, 2, 3, 4, 5]
+    assert database.load(url, db, 'test', 'predictions')['Id'].tolist() == [1, 2, 3, 4, 5]
+    assert database.count(url, db, 'test', 'features') == 5
+    assert len(new) == 0
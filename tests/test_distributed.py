@@ -0,0 +1,57 @@
+from src import distributed
+from src import database
+from src import resources
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import RandomForestRegressor
+
+
+def _train_data(n_rows, seed=0):
+    rng = np.random.RandomState(seed)
+    X = pd.DataFrame(rng.normal(size=(n_rows, 4)), columns=['a', 'b', 'c', 'd'])
+    return X, X['a'] * 3 + X['b'] + rng.normal(scale=0.1, size=n_rows)
+
+
+def test_merge_forests():
+
+    # Set up: forests with the same parameters fitted with different seeds, and one with
+    # different parameters
+    X, y = _train_data(200)
+    forests = [RandomForestRegressor(n_estimators=n, max_features=2, random_state=seed).fit(X, y)
+               for n, seed in [(3, 0), (5, 1)]]
+    other = RandomForestRegressor(n_estimators=2, max_features=3).fit(X, y)
+
+    # Function call
+    merged = distributed.merge_forests(forests)
+
+    # Test that: the merged forest averages every tree and keeps the fitted attributes
+    expected = (forests[0].predict(X) * 3 + forests[1].predict(X) * 5) / 8
+    assert merged.n_estimators == 8
+    assert np.allclose(merged.predict(X), expected)
+    if hasattr(forests[0], 'feature_names_in_'):
+        assert list(merged.feature_names_in_) == ['a', 'b', 'c', 'd']
+    with pytest.raises(ValueError):
+        distributed.merge_forests([forests[0], other])
+
+
+def test_train_with_worker_processes(tmp_path, monkeypatch):
+
+    # Set up: training table in a sqlite database, shared by the worker processes
+    monkeypatch.setenv('SQL_SERVER_URL', 'sqlite:///')
+    monkeypatch.setenv('SQL_DATABASE', str(tmp_path / 'train.sqlite'))
+    X, y = _train_data(300)
+    database.save(X.assign(SalePrice=y), *database.get_config(), 'processed_train')
+
+    # Function call: 3 workers, each fitting its trees on its partition of the rows
+    forest, reports = distributed.train('processed_train', 3, str(tmp_path / 'shards'),
+                                        partitioned=True, n_estimators=7)
+
+    # Test that: the workers' trees are merged into one forest which fits the data, and the
+    # workers share the machine's CPUs
+    assert distributed.shard_trees(7, 3) == [3, 2, 2]
+    assert forest.n_estimators == len(forest.estimators_) == 7
+    assert [report['rows'] for report in reports] == [100, 100, 100]
+    assert [report['cpus'] for report in reports] == [max(1, resources.available_cpus() // 3)] * 3
+    assert np.corrcoef(forest.predict(X.to_numpy()), y)[0, 1] > 0.9
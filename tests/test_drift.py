@@ -0,0 +1,135 @@
+from src import drift
+
+import os
+import time
+import shutil
+import threading
+import numpy as np
+import pandas as pd
+
+
+def _raw_data(n_rows, shift=0., seed=0):
+    rng = np.random.RandomState(seed)
+    return pd.DataFrame({
+        'GrLivArea': rng.normal(1500 + shift, 300, n_rows),
+        'Neighborhood': rng.choice(['NAmes', 'OldTown', 'Edwards'], n_rows),
+        'MSSubClass': rng.choice([20, 60, 120], n_rows)
+    })
+
+
+def test_baseline_and_drift():
+
+    # Set up: baseline of training rows
+    train = _raw_data(2000)
+    y_train = train['GrLivArea'].to_numpy() * 100
+    baseline = drift.build_baseline(train, y_train, ['GrLivArea', 'Neighborhood', 'MSSubClass'])
+
+    # Function call: traffic like the training data, then shifted traffic with unseen values
+    similar, shifted = drift.DriftMonitor(baseline), drift.DriftMonitor(baseline)
+    similar.update(_raw_data(1000, seed=1), y_train[:1000])
+    X = _raw_data(1000, shift=600, seed=2)
+    X.loc[:99, 'Neighborhood'] = 'Unknown'
+    X.loc[100:199, 'Neighborhood'] = None
+    for start in range(0, 1000, 10):
+        shifted.update(X[start:start + 10], X['GrLivArea'].to_numpy()[start:start + 10] * 100)
+
+    # Test that: MSSubClass codes are categorical, the bins hold every row, and only the
+    # shifted distributions are reported as drifted
+    assert list(baseline['categorical']) == ['Neighborhood', 'MSSubClass']
+    assert sum(baseline['numeric']['GrLivArea']['counts']) == 2000
+    assert not any(values['drift'] for values in similar.report().values())
+    report = shifted.report()
+    assert report['GrLivArea']['drift'] and report['prediction']['drift']
+    assert report['Neighborhood']['drift'] and not report['MSSubClass']['drift']
+    assert shifted.counts()['Neighborhood'][-2:] == [100, 100]
+
+
+def test_merge_across_workers(tmp_path):
+
+    # Set up: two monitors (as in two worker processes) sharing a directory
+    train = _raw_data(500)
+    baseline = drift.build_baseline(train, train['GrLivArea'].to_numpy(), ['GrLivArea'])
+    first = drift.DriftMonitor(baseline, str(tmp_path))
+    second = drift.DriftMonitor(baseline, str(tmp_path))
+    second._path = lambda: str(tmp_path / 'other.json')
+
+    # Function call
+    first.update(train[:100], train['GrLivArea'].to_numpy()[:100])
+    second.update(train[100:300], train['GrLivArea'].to_numpy()[100:300])
+    second.flush()
+    report = first.report()
+
+    # Test that: the report counts the rows seen by both monitors
+    assert report['GrLivArea']['rows'] == 300
+    assert report['prediction']['rows'] == 300
+
+
+def test_stale_worker_files_expire(tmp_path):
+
+    # Set up: a monitor, and files of a stopped worker and of a worker idle for longer than the
+    # window (as if its PID had been recycled)
+    train = _raw_data(500)
+    baseline = drift.build_baseline(train, train['GrLivArea'].to_numpy(), ['GrLivArea'])
+    monitor = drift.DriftMonitor(baseline, str(tmp_path), window_seconds=600)
+    old = drift.DriftMonitor(baseline, str(tmp_path), window_seconds=600)
+    old.update(train[:200], train['GrLivArea'].to_numpy()[:200])
+    old.flush()
+    stopped, idle = tmp_path / '999999999-dead.json', tmp_path / f'{os.getpid()}-idle.json'
+    for path in [stopped, idle]:
+        shutil.copy(old._path(), path)
+    os.remove(old._path())
+    os.utime(idle, (time.time() - 3600, time.time() - 3600))
+
+    # Function call
+    monitor.update(train[:100], train['GrLivArea'].to_numpy()[:100])
+    report = monitor.report()
+
+    # Test that: only the live worker's rows are counted, and the stale files are removed
+    assert report['GrLivArea']['rows'] == 100
+    assert not stopped.exists() and not idle.exists()
+
+
+def test_window_drops_old_rows(monkeypatch):
+
+    # Set up: windowed monitor and a clock
+    train = _raw_data(500)
+    baseline = drift.build_baseline(train, train['GrLivArea'].to_numpy(), ['GrLivArea'])
+    monitor = drift.DriftMonitor(baseline, window_seconds=600)
+    now = [1000000.]
+    monkeypatch.setattr(drift.time, 'time', lambda: now[0])
+
+    # Function call: rows, then more rows half a window later, then a window later
+    monitor.update(train[:100], train['GrLivArea'].to_numpy()[:100])
+    now[0] += 300
+    monitor.update(train[100:150], train['GrLivArea'].to_numpy()[100:150])
+    both = monitor.report()['GrLivArea']['rows']
+    now[0] += 400
+    recent = monitor.report()['GrLivArea']['rows']
+
+    # Test that: rows older than the window are no longer counted
+    assert both == 150
+    assert recent == 50
+
+
+def test_one_flush_per_period(tmp_path):
+
+    # Set up: monitor whose flush is due, and a flush counter
+    train = _raw_data(100)
+    baseline = drift.build_baseline(train, train['GrLivArea'].to_numpy(), ['GrLivArea'])
+    monitor = drift.DriftMonitor(baseline, str(tmp_path), flush_seconds=60)
+    monitor._last_flush -= 120
+    flushes = []
+    monitor.flush = lambda: flushes.append(time.time())
+
+    # Function call: concurrent updates
+    threads = [threading.Thread(target=monitor.update,
+                                args=(train[:10], train['GrLivArea'].to_numpy()[:10]))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Test that: only one of the threads wrote the counts, and every update was counted
+    assert len(flushes) == 1
+    assert sum(monitor.counts()['prediction']) == 80
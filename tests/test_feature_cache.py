@@ -0,0 +1,50 @@
+from src import feature_cache
+from src import preprocessing
+from tests.test_preprocessing import _raw_data
+
+import os
+import numpy as np
+import pandas as pd
+
+
+def test_fit_transform_and_transform_are_cached(tmp_path):
+
+    # Set up: empty cache and raw data
+    cache = feature_cache.FeatureCache(os.path.join(tmp_path, 'cache'))
+    X = _raw_data()
+
+    # Function call: fit and transform twice
+    pp, X_pp = cache.fit_transform(preprocessing.PreProcessor(), X)
+    cached_pp, cached_X_pp = cache.fit_transform(preprocessing.PreProcessor(), X)
+
+    # Test that: the second call is read from the cache, with the fitted preprocessor
+    assert (cache.hits, cache.misses) == (1, 1)
+    pd.testing.assert_frame_equal(cached_X_pp, X_pp)
+    pd.testing.assert_frame_equal(cached_pp.transform(X), X_pp)
+
+    # Test that: transform is cached, and keyed on the rows and the fitted state
+    new_rows = _raw_data(30)
+    pd.testing.assert_frame_equal(cache.transform(pp, new_rows), pp.transform(new_rows))
+    cache.transform(pp, new_rows)
+    assert (cache.hits, cache.misses) == (2, 2)
+    cache.transform(pp, new_rows.assign(OverallQual=1))
+    cache.transform(preprocessing.PreProcessor().fit(new_rows), new_rows)
+    assert (cache.hits, cache.misses) == (2, 4)
+
+
+def test_eviction_removes_least_recently_used(tmp_path):
+
+    # Set up: cache holding about two entries
+    X_pp = pd.DataFrame(np.zeros((1000, 10)), columns=[f'x{i}' for i in range(10)])
+    cache = feature_cache.FeatureCache(os.path.join(tmp_path, 'cache'), max_bytes=2.5 * 80000)
+
+    # Function call: store three entries, reading the first before storing the third
+    cache.put('first', X_pp)
+    os.utime(os.path.join(tmp_path, 'cache', 'first'), (0, 0))
+    cache.put('second', X_pp)
+    os.utime(os.path.join(tmp_path, 'cache', 'second'), (1, 1))
+    cache.get('first')
+    cache.put('third', X_pp)
+
+    # Test that: the least recently used entry is evicted
+    assert sorted(cache.entries()['key']) == ['first', 'third']
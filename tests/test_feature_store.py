@@ -0,0 +1,131 @@
+from src import feature_store
+from src import preprocessing
+from tests.test_preprocessing import _raw_data
+
+import os
+import numpy as np
+import pandas as pd
+
+
+class _CountingModel():
+    """ Stand-in model predicting the first feature, counting the rows it scores """
+
+    def __init__(self):
+        self.rows = 0
+
+    def predict(self, X):
+        self.rows += len(X)
+        return np.asarray(X)[:, 0] * 1000
+
+
+def _houses(ids):
+    return _raw_data(len(ids)).assign(Id=ids)
+
+
+def test_refresh_and_lookup(tmp_path):
+
+    # Set up: fitted preprocessor and houses with dense Ids
+    raw = _houses(np.arange(1, 101))
+    pp = preprocessing.PreProcessor().fit(raw)
+    model = _CountingModel()
+    store = feature_store.FeatureStore(os.path.join(tmp_path, 'store'))
+
+    # Function call
+    stats = store.refresh(raw, pp, model, version='v1')
+
+    # Test that: features and predictions are looked up by Id, unknown Ids are -1
+    assert stats == {'rows': 100, 'features_computed': 100, 'predictions_computed': 100}
+    positions = store.positions([5, 1, 1000, 0])
+    assert positions.tolist() == [4, 0, -1, -1]
+    expected = pp.transform(raw.iloc[[4, 0]])
+    pd.testing.assert_frame_equal(store.features(positions[:2]), expected)
+    assert np.allclose(store.predictions(positions[:2]), expected.iloc[:, 0] * 1000)
+    assert store.model_version == 'v1'
+
+
+def test_incremental_refresh(tmp_path):
+
+    # Set up: store refreshed once, then a changed row, a new row and a removed row
+    raw = _houses(np.arange(1, 101))
+    pp = preprocessing.PreProcessor().fit(raw)
+    store = feature_store.FeatureStore(os.path.join(tmp_path, 'store'))
+    store.refresh(raw, pp, _CountingModel(), version='v1')
+    reader = feature_store.FeatureStore(os.path.join(tmp_path, 'store'))
+    reader.reload_if_changed()
+
+    updated = pd.concat([raw.iloc[1:], _houses([500])], ignore_index=True)
+    updated.loc[updated['Id'] == 2, 'OverallQual'] = 10
+
+    # Function call
+    stats = store.refresh(updated, pp, _CountingModel(), version='v1')
+    new_model_stats = store.refresh(updated, pp, _CountingModel(), version='v2')
+
+    # Test that: only the changed and new rows are recomputed, and every row for a new model
+    assert stats == {'rows': 100, 'features_computed': 2, 'predictions_computed': 2}
+    assert new_model_stats == {'rows': 100, 'features_computed': 0, 'predictions_computed': 100}
+
+    # Test that: readers switch to the new generation, which has the new Ids
+    assert reader.reload_if_changed()
+    assert reader.model_version == 'v2'
+    assert reader.positions([1, 2, 500]).tolist() == [-1, 0, 99]
+    pd.testing.assert_frame_equal(reader.features([0]), pp.transform(updated.iloc[[0]]))
+
+
+def test_sparse_ids_use_binary_search(tmp_path):
+
+    # Set up: store with sparse Ids
+    raw = _houses(np.array([10**9, 7, 10**6]))
+    store = feature_store.FeatureStore(os.path.join(tmp_path, 'store'))
+
+    # Function call
+    store.refresh(raw, preprocessing.PreProcessor().fit(raw))
+
+    # Test that: Ids are looked up without a dense index, and there are no predictions
+    assert store.index is None
+    assert store.positions([7, 10**6, 10**9, 8, 10**10]).tolist() == [1, 2, 0, -1, -1]
+    assert store.predictions([0]) is None
+
+
+def test_refresh_new_rows_only(tmp_path):
+
+    # Set up: store refreshed once, then new and changed rows only
+    raw = _houses(np.arange(1, 101))
+    pp = preprocessing.PreProcessor().fit(raw)
+    store = feature_store.FeatureStore(os.path.join(tmp_path, 'store'))
+    store.refresh(raw, pp, _CountingModel(), version='v1')
+    delta = pd.concat([raw.iloc[[1]], _houses([500, 501])], ignore_index=True)
+    delta.loc[0, 'OverallQual'] = 10
+
+    # Function call
+    stats = store.refresh(delta, pp, _CountingModel(), version='v1', incremental=True)
+    new_model_stats = store.refresh(delta.iloc[1:], pp, _CountingModel(), version='v2',
+                                    incremental=True)
+
+    # Test that: the other rows are kept, and only the delta is transformed
+    assert stats == {'rows': 102, 'features_computed': 3, 'predictions_computed': 3}
+    assert new_model_stats == {'rows': 102, 'features_computed': 0, 'predictions_computed': 102}
+    assert (store.positions([1, 2, 500, 501]) >= 0).all()
+    expected = pp.transform(delta.iloc[[0]])
+    pd.testing.assert_frame_equal(store.features(store.positions([2])), expected)
+    pd.testing.assert_frame_equal(store.features(store.positions([3])),
+                                  pp.transform(raw.iloc[[2]]))
+
+
+def test_snapshot_is_consistent_across_refresh(tmp_path):
+
+    # Set up: a reader's snapshot of the store, then a refresh with other Ids and prices
+    raw = _houses(np.arange(1, 11))
+    pp = preprocessing.PreProcessor().fit(raw)
+    store = feature_store.FeatureStore(os.path.join(tmp_path, 'store'))
+    store.refresh(raw, pp, _CountingModel(), version='v1')
+    snapshot = store.snapshot()
+    positions = snapshot.positions([3, 10])
+    expected = snapshot.predictions(positions).copy()
+
+    # Function call
+    store.refresh(_houses(np.arange(5, 21)), pp, _CountingModel(), version='v2')
+
+    # Test that: the snapshot still reads the generation its positions come from
+    assert np.array_equal(snapshot.predictions(positions), expected)
+    assert snapshot.model_version == 'v1' and store.model_version == 'v2'
+    assert store.snapshot().positions([3]).tolist() == [-1]
@@ -0,0 +1,65 @@
+from src.app import metrics
+
+import time
+
+
+def test_histogram_exposition():
+
+    # Set up: histogram with two buckets
+    histogram = metrics.Histogram('latency_seconds', 'Latency', ['stage'], buckets=(0.1, 1))
+
+    # Function call
+    for value in [0.05, 0.5, 5]:
+        histogram.observe(value, stage='predict')
+    lines = histogram.expose()
+
+    # Test that: buckets are cumulative and sum / count are exposed
+    assert lines[:2] == ['# HELP latency_seconds Latency', '# TYPE latency_seconds histogram']
+    assert 'latency_seconds_bucket{stage="predict",le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{stage="predict",le="1"} 2' in lines
+    assert 'latency_seconds_bucket{stage="predict",le="+Inf"} 3' in lines
+    assert 'latency_seconds_sum{stage="predict"} 5.55' in lines
+    assert 'latency_seconds_count{stage="predict"} 3' in lines
+
+
+def test_registry_exposition():
+
+    # Set up: registry with a counter and a gauge
+    registry = metrics.Registry()
+    counter = registry.register(metrics.Counter('errors_total', 'Errors', ['status']))
+    gauge = registry.register(metrics.Gauge('model_info', 'Model', ['model_version']))
+
+    # Function call
+    counter.inc(status='429')
+    counter.inc(2, status='429')
+    gauge.set(1, model_version='a"b')
+    text = registry.expose()
+
+    # Test that: values are accumulated and label values are escaped
+    assert 'errors_total{status="429"} 3\n' in text
+    assert 'model_info{model_version="a\\"b"} 1\n' in text
+
+
+def test_timed():
+
+    # Function call
+    with metrics.timed('test_stage', 'v1'):
+        pass
+
+    # Test that: the stage duration is recorded
+    assert ('test_stage', 'v1') in metrics.STAGE_SECONDS._values
+
+
+def test_mark_startup():
+
+    # Set up: process start time
+    start = metrics.process_start_time()
+
+    # Function call: the same phase reached twice
+    metrics.mark_startup('test_phase')
+    first = metrics.STARTUP_SECONDS._values[('test_phase',)]
+    metrics.mark_startup('test_phase')
+
+    # Test that: the time since process start is recorded the first time only
+    assert 0 < first <= time.time() - start + 1
+    assert metrics.STARTUP_SECONDS._values[('test_phase',)] == first
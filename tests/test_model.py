@@ -0,0 +1,47 @@
+from src import model
+from src import feature_cache
+from tests.test_preprocessing import _raw_data
+
+import os
+
+
+def test_cross_validate_with_feature_cache(tmp_path):
+
+    # Set up: raw training data and an empty feature cache
+    raw = _raw_data(200)
+    raw['SalePrice'] = raw['OverallQual'] * 20000 + raw['1stFlrSF'] * 50
+    cache = feature_cache.FeatureCache(os.path.join(tmp_path, 'cache'))
+
+    # Function call
+    scores = model.cross_validate(raw, n_splits=3)
+    cached_scores = model.cross_validate(raw, n_splits=3, cache=cache)
+    rerun_scores = model.cross_validate(raw, n_splits=3, cache=cache)
+
+    # Test that: one RMSE per fold, and the fold features are reused on the second run
+    assert len(scores) == 3
+    assert (scores < raw['SalePrice'].std()).all()
+    assert cache.hits == 6
+    assert abs(cached_scores.mean() - scores.mean()) < 0.2 * scores.mean()
+    assert abs(rerun_scores.mean() - scores.mean()) < 0.2 * scores.mean()
+
+
+def test_fit_and_parallel_cross_validate():
+
+    # Set up: raw training data, and a config fitting two folds at a time in worker processes
+    raw = _raw_data(200)
+    raw['SalePrice'] = raw['OverallQual'] * 20000 + raw['1stFlrSF'] * 50
+    X = raw.drop('SalePrice', axis=1).select_dtypes('number').fillna(0)
+    config = model.get_config(*X.shape, n_folds=3)
+    config.update(cv_jobs=2, n_jobs=2, max_samples=0.5)
+
+    # Function call
+    fitted, report = model.fit(X, raw['SalePrice'], config)
+    scores = model.cross_validate(raw, n_splits=3, config=config)
+
+    # Test that: trees are fitted on subsamples, the fitted model predicts single-threaded,
+    # and the report has the fit time and peak memory
+    assert fitted.bootstrap and fitted.max_samples == 0.5
+    assert fitted.n_jobs is None
+    assert report['fit_seconds'] > 0 and report['peak_mb'] >= 0
+    assert len(scores) == 3
+    assert (scores < raw['SalePrice'].std()).all()
@@ -0,0 +1,72 @@
+from src import pipeline
+
+import os
+import sys
+
+
+def _copy_stage(name, source, target, code):
+    """ Stage copying a file, with the code file as its code version """
+    command = [sys.executable, '-c',
+               f'import shutil; shutil.copy({source!r}, {target!r}); print("copied")']
+    return pipeline.Stage(name, command, code=[code], inputs=[source], outputs=[target])
+
+
+def test_pipeline_skips_current_stages(tmp_path):
+
+    # Set up: raw file -> interim file -> two independent outputs
+    paths = {name: os.path.join(tmp_path, name) for name in
+             ['raw.txt', 'interim.txt', 'a.txt', 'b.txt', 'code.py', 'state.json']}
+    for name in ['raw.txt', 'code.py']:
+        with open(paths[name], 'w') as f:
+            f.write('v1')
+    stages = [
+        _copy_stage('interim', paths['raw.txt'], paths['interim.txt'], paths['code.py']),
+        _copy_stage('a', paths['interim.txt'], paths['a.txt'], paths['code.py']),
+        _copy_stage('b', paths['interim.txt'], paths['b.txt'], paths['code.py'])
+    ]
+    db_config = ('sqlite:///', os.path.join(tmp_path, 'db.sqlite'), None)
+
+    def run(**kwargs):
+        report = pipeline.Pipeline(stages, db_config, paths['state.json']).run(**kwargs)
+        return dict(zip(report['stage'], report['status']))
+
+    # Test that: the independent stages depend only on the stage producing their input
+    assert pipeline.Pipeline(stages, db_config).dependencies == {
+        'interim': set(), 'a': {'interim'}, 'b': {'interim'}
+    }
+
+    # Test that: every stage runs the first time, and none the second time
+    assert run() == {'interim': 'ran', 'a': 'ran', 'b': 'ran'}
+    assert open(paths['b.txt']).read() == 'v1'
+    assert run() == {'interim': 'skipped', 'a': 'skipped', 'b': 'skipped'}
+
+    # Test that: a deleted output only reruns its stage
+    os.remove(paths['a.txt'])
+    assert run() == {'interim': 'skipped', 'a': 'ran', 'b': 'skipped'}
+
+    # Test that: a changed input reruns every downstream stage
+    with open(paths['raw.txt'], 'w') as f:
+        f.write('v2 with a different size')
+    assert run(dry_run=True) == {'interim': 'pending', 'a': 'pending', 'b': 'pending'}
+    assert run() == {'interim': 'ran', 'a': 'ran', 'b': 'ran'}
+    assert open(paths['b.txt']).read() == 'v2 with a different size'
+
+    # Test that: forced stages rerun
+    assert run(force=['b']) == {'interim': 'skipped', 'a': 'skipped', 'b': 'ran'}
+
+
+def test_pipeline_blocks_stages_after_failure(tmp_path):
+
+    # Set up: failing stage with a dependent stage
+    output = os.path.join(tmp_path, 'out.txt')
+    stages = [
+        pipeline.Stage('fail', [sys.executable, '-c', 'raise SystemExit(1)'], outputs=[output]),
+        pipeline.Stage('after', [sys.executable, '-c', 'pass'], inputs=[output])
+    ]
+    db_config = ('sqlite:///', os.path.join(tmp_path, 'db.sqlite'), None)
+
+    # Function call
+    report = pipeline.Pipeline(stages, db_config, os.path.join(tmp_path, 'state.json')).run()
+
+    # Test that: the failure is reported and the dependent stage is not run
+    assert report['status'].tolist() == ['failed', 'blocked']
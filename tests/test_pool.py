@@ -0,0 +1,83 @@
+from src.app import pool
+from src.app import scoring
+from src.preprocessing import PreProcessor
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestRegressor
+
+
+def _raw_data(n_rows):
+    rng = np.random.RandomState(0)
+    return pd.DataFrame({
+        'TotalBsmtSF': rng.randint(0, 3000, n_rows).astype(float),
+        '1stFlrSF': rng.randint(300, 3000, n_rows),
+        '2ndFlrSF': rng.randint(0, 2000, n_rows),
+        'OverallQual': rng.randint(1, 11, n_rows),
+        'YearBuilt': rng.randint(1880, 2010, n_rows),
+        'FullBath': rng.randint(0, 4, n_rows),
+        'Fireplaces': rng.randint(0, 4, n_rows),
+        'GarageCars': rng.randint(0, 5, n_rows).astype(float),
+        'KitchenQual': rng.choice(['Ex', 'Gd', 'TA', 'Fa', None], n_rows),
+        'Foundation': rng.choice(['PConc', 'CBlock', 'BrkTil'], n_rows),
+        'Neighborhood': rng.choice(['NAmes', 'CollgCr', 'OldTown'], n_rows),
+        'MSSubClass': rng.choice([20, 60, 50, 190], n_rows),
+        'SalePrice': rng.randint(50000, 500000, n_rows)
+    })
+
+
+def test_share_frame_round_trip(tmp_path):
+
+    # Set up: data with numeric, string and missing values
+    X = pd.DataFrame({'a': [1.5, np.nan, 3., 4.], 'b': ['x', None, 'y', np.nan]})
+
+    # Function call
+    columns = pool._share_frame(X, str(tmp_path))
+    shard = pool._load_shard(columns, 1, 4)
+
+    # Test that: the shard has the same rows and missing values as the original
+    assert shard['a'].isnull().tolist() == [True, False, False]
+    assert shard['b'].iloc[0] is None
+    assert shard['b'].iloc[1] == 'y'
+    assert shard['b'].iloc[2] is not None and np.isnan(shard['b'].iloc[2])
+
+
+def test_scoring_pool_matches_serial(tmp_path):
+
+    # Set up: pickled preprocessor and model
+    data = _raw_data(500)
+    pp = PreProcessor().fit(data)
+    model = RandomForestRegressor(n_estimators=5, random_state=0)
+    model.fit(pp.transform(data), data['SalePrice'])
+    joblib.dump(pp, os.path.join(tmp_path, 'PreProcessor.pkl'))
+    joblib.dump(model, os.path.join(tmp_path, 'Model.pkl'))
+
+    # Function call
+    scoring_pool = pool.ScoringPool(str(tmp_path), n_workers=2, min_shard_rows=100)
+    try:
+        y_pred = scoring_pool.predict(data[pp.raw_features])
+    finally:
+        scoring_pool.close()
+
+    # Test that: sharded predictions are identical and in the original order
+    assert np.allclose(y_pred, model.predict(pp.transform(data)))
+
+
+def test_get_pool_once_per_version(tmp_path):
+
+    # Set up: artifacts of a model version, requested by concurrent threads
+    model = {'pickle_dir': str(tmp_path), 'version': 'v1'}
+    with ThreadPoolExecutor(8) as executor:
+
+        # Function call: concurrent requests, then the version is removed
+        pools = list(executor.map(lambda _: scoring.get_pool(model), range(8)))
+    scoring.release(model)
+    after_release = scoring.get_pool(model)
+
+    # Test that: one pool is started and shared, and none is restarted for the removed version
+    assert len(set(map(id, pools))) == 1
+    assert after_release is None
+    assert (str(tmp_path), 'v1') not in scoring._pools
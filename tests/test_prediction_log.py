@@ -0,0 +1,87 @@
+from src.app import prediction_log
+from src import database
+
+import json
+import pandas as pd
+
+
+def _request(n_rows, offset=0):
+    X = pd.DataFrame({'GrLivArea': range(offset, offset + n_rows), 'Neighborhood': 'NAmes'})
+    return X, X['GrLivArea'].to_numpy() * 100.
+
+
+def test_write_behind_to_database(tmp_path):
+
+    # Set up: logger appending to a sqlite table, in batches of 5 rows
+    db_config = ('sqlite:///', str(tmp_path / 'predictions.sqlite'), None)
+
+    def write(data):
+        database.save(data, *db_config, 'predictions', if_exists='append')
+
+    log = prediction_log.PredictionLogger(write, batch_rows=5, flush_seconds=60).start()
+
+    # Function call: requests are buffered, then written when the logger stops
+    for offset in range(0, 12, 3):
+        assert log.log(*_request(3, offset), 'v1', 0.002)
+    log.stop()
+    logged = database.load(*db_config, 'predictions')
+
+    # Test that: every row is appended, with its features, prediction and latency
+    assert log.pending() == 0
+    assert len(logged) == 12
+    assert logged['prediction'].tolist() == [100. * i for i in range(12)]
+    assert json.loads(logged['features'][4]) == {'GrLivArea': 4, 'Neighborhood': 'NAmes'}
+    assert (logged['model_version'] == 'v1').all()
+    assert (logged['latency_ms'] == 2).all()
+
+
+def test_spill_and_drop(tmp_path):
+
+    # Set up: a database which is down, loggers holding at most 4 rows
+    written = []
+    down = True
+
+    def write(data):
+        if down:
+            raise ConnectionError('Database is down')
+        written.append(data)
+
+    spill = prediction_log.PredictionLogger(write, max_rows=4, policy='spill',
+                                            spill_dir=str(tmp_path))
+    drop = prediction_log.PredictionLogger(write, max_rows=4)
+
+    # Function call: more rows than the buffer holds, then a flush while the database is down,
+    # and another once it is back
+    accepted = [spill.log(*_request(3, offset), 'v1', 0.) for offset in (0, 3)]
+    dropped = [drop.log(*_request(3, offset), 'v1', 0.) for offset in (0, 3)]
+    spill.flush()
+    n_spilled = len(spill.spilled())
+    down = False
+    spill.flush()
+
+    # Test that: the overflowing request and the failed batch are spilled, then written
+    assert accepted == [True, False] and dropped == [True, False]
+    assert n_spilled == 2
+    assert spill.spilled() == []
+    assert sorted(pd.concat(written)['prediction']) == [100. * i for i in range(6)]
+
+
+def test_spill_on_writer_thread(tmp_path):
+
+    # Set up: a logger holding at most 2 rows, and 3 more rows to spill
+    written = []
+    log = prediction_log.PredictionLogger(written.append, max_rows=2, policy='spill',
+                                          spill_dir=str(tmp_path), max_spill_rows=3)
+
+    # Function call: a buffered request, a request to spill and one beyond the spill buffer,
+    # then a flush by the writer
+    accepted = [log.log(*_request(n_rows, 10 * n_rows), 'v1', 0.) for n_rows in (2, 3, 1)]
+    spilled_by_log = log.spilled()
+    log.flush()
+
+    # Test that: the callers never write to disk, the writer spills and then writes the
+    # overflowing request, and the request beyond the spill buffer is dropped
+    assert accepted == [True, False, False]
+    assert spilled_by_log == []
+    assert len(pd.concat(written)) == 5
+    assert log.spilled() == []
@@ -0,0 +1,68 @@
+from src import preprocessing
+
+import os
+import sys
+import subprocess
+import numpy as np
+import pandas as pd
+
+
+def _raw_data(n_rows=50):
+    rng = np.random.RandomState(0)
+    return pd.DataFrame({
+        'TotalBsmtSF': rng.randint(0, 3000, n_rows).astype(float),
+        '1stFlrSF': rng.randint(300, 3000, n_rows),
+        '2ndFlrSF': rng.randint(0, 2000, n_rows),
+        'OverallQual': rng.randint(1, 11, n_rows),
+        'YearBuilt': rng.randint(1880, 2010, n_rows),
+        'FullBath': rng.randint(0, 4, n_rows),
+        'Fireplaces': rng.randint(0, 4, n_rows),
+        'GarageCars': rng.randint(0, 5, n_rows).astype(float),
+        'KitchenQual': rng.choice(['Ex', 'Gd', 'TA', 'Fa'], n_rows),
+        'Foundation': rng.choice(['PConc', 'CBlock', 'BrkTil'], n_rows),
+        'Neighborhood': rng.choice(['NAmes', 'CollgCr', 'OldTown'], n_rows),
+        'MSSubClass': rng.choice([20, 60, 50, 190], n_rows)
+    })
+
+
+def test_instrument():
+
+    # Set up: step hook collecting records
+    X = _raw_data()
+    records = []
+    preprocessing.add_step_hook(records.append)
+
+    # Function call
+    try:
+        pp = preprocessing.PreProcessor().instrument()
+        X_pp = pp.fit_transform(X)
+    finally:
+        preprocessing.remove_step_hook(records.append)
+
+    # Test that: every step of every branch is reported for fit and transform
+    steps = {(record['step'], record['method']) for record in records}
+    assert ('num/std_scaler', 'fit') in steps
+    assert ('cat/one_hot_encoder', 'transform') in steps
+    assert ('mssubclass/custom_ohe', 'transform') in steps
+    assert all(record['rows'] == len(X) for record in records)
+
+    # Test that: removing the wrappers does not change the output
+    pp.uninstrument()
+    assert np.allclose(pp.transform(X), X_pp)
+    assert list(pp.transform(X).columns) == list(X_pp.columns)
+
+
+def test_serving_imports_skip_database():
+
+    # Set up: fresh interpreter with the flattened serving modules on the path
+    app_dir = os.path.join(os.path.dirname(preprocessing.__file__), 'app')
+    code = ('import sys, scoring, preprocessing, compression, anytime, profiling, drift; '
+            'print(sorted({"database", "sqlalchemy"} & set(sys.modules)))')
+
+    # Function call
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([os.path.dirname(app_dir), app_dir]))
+    output = subprocess.run([sys.executable, '-c', code], env=env, stdout=subprocess.PIPE,
+                            universal_newlines=True, check=True).stdout
+
+    # Test that: scoring doesn't import the database modules
+    assert output.strip() == '[]'
@@ -0,0 +1,89 @@
+from src import profiling
+from tests.test_preprocessing import _raw_data
+
+import json
+
+
+def test_step_profiler(tmp_path):
+
+    # Set up: instrumented preprocessor (from the module profiling registers its hook in)
+    X = _raw_data()
+    pp = profiling.preprocessing.PreProcessor().instrument()
+
+    # Function call
+    with profiling.StepProfiler() as profiler:
+        pp.fit_transform(X)
+    prefix = str(tmp_path / 'profile')
+    profiler.export(prefix)
+
+    # Test that: each call is recorded with shapes and allocations
+    calls = profiler.to_frame()
+    one_hot = calls[(calls['step'] == 'cat/one_hot_encoder') & (calls['method'] == 'transform')]
+    assert one_hot['input_shape'].iloc[0] == (len(X), 2)
+    assert one_hot['output_shape'].iloc[0][0] == len(X)
+    assert calls['alloc_bytes'].notnull().all()
+
+    # Test that: the summary has one row per step and method
+    summary = profiler.summary()
+    assert len(summary) == len(calls.groupby(['step', 'method']))
+
+    # Test that: folded stacks and trace events are exported
+    with open(prefix + '.folded') as f:
+        lines = f.read().splitlines()
+    assert any(line.startswith('transform;num;std_scaler ') for line in lines)
+    with open(prefix + '.trace.json') as f:
+        assert len(json.load(f)['traceEvents']) == len(calls)
+
+    # Test that: the profiler stops collecting when the context exits
+    pp.transform(X)
+    assert len(profiler.to_frame()) == len(calls)
+
+
+class _Step():
+    """ Stand-in pipeline step allocating a list, and optionally calling another step """
+
+    def __init__(self, inner=None, size=100000):
+        self.inner = inner
+        self.size = size
+
+    def transform(self, X):
+        if self.inner is not None:
+            self.inner.transform(X)
+        return [0.] * self.size
+
+
+def test_peak_only_without_overlapping_calls():
+
+    # Set up: a step alone, and a step calling another step during its own call
+    hooked = profiling.preprocessing._HookedStep
+    alone = hooked('alone', _Step())
+    outer = hooked('outer', _Step(hooked('inner', _Step())))
+
+    # Function call
+    with profiling.StepProfiler() as profiler:
+        alone.transform([1.])
+        outer.transform([1.])
+
+    # Test that: the peak is only reported for the call which no other call overlapped
+    peaks = profiler.to_frame().set_index('step')['peak_bytes']
+    assert peaks['alone'] > 0
+    assert peaks[['inner', 'outer']].isnull().all()
+
+
+def test_peak_without_reset_peak(monkeypatch):
+
+    # Set up: Python < 3.9 (no tracemalloc.reset_peak), a large step and a smaller one
+    monkeypatch.delattr(profiling.preprocessing.tracemalloc, 'reset_peak', raising=False)
+    hooked = profiling.preprocessing._HookedStep
+    large, small = hooked('large', _Step(size=1000000)), hooked('small', _Step())
+
+    # Function call
+    with profiling.StepProfiler() as profiler:
+        large.transform([1.])
+        small.transform([1.])
+
+    # Test that: the peak is reported for the call which raised the peak, and not guessed for
+    # the other one
+    peaks = profiler.to_frame().set_index('step')['peak_bytes']
+    assert peaks['large'] >= 8 * 1000000
+    assert peaks[['small']].isnull().all()
@@ -0,0 +1,120 @@
+from src.app import registry
+
+import os
+import numpy as np
+import pandas as pd
+
+
+class _ConstantModel():
+    """ Stand-in preprocessor and model: predicts a constant """
+
+    def __init__(self, value):
+        self.value = value
+
+    def transform(self, X):
+        return X
+
+    def predict(self, X):
+        return np.full(len(X), self.value)
+
+
+def _load(folder):
+    """ Stand-in loader: the constant is written in Model.pkl """
+    with open(os.path.join(folder, 'Model.pkl')) as f:
+        value = float(f.read())
+    return {'preprocessor': _ConstantModel(value), 'model': _ConstantModel(value),
+            'version': f'v{value:g}'}
+
+
+def _write_version(directory, name, value, mtime):
+    folder = os.path.join(directory, name)
+    os.makedirs(folder)
+    for file_name, content in [('PreProcessor.pkl', ''), ('Model.pkl', str(value))]:
+        with open(os.path.join(folder, file_name), 'w') as f:
+            f.write(content)
+    os.utime(folder, (mtime, mtime))
+
+
+def test_registry_swaps_versions(tmp_path):
+
+    # Set up: two versions, a smoke batch and hooks recording swaps and removals
+    directory = str(tmp_path)
+    pd.DataFrame({'a': [1, 2]}).to_csv(os.path.join(directory, 'smoke.csv'), index=False)
+    _write_version(directory, 'one', 1, 1000)
+    _write_version(directory, 'two', 2, 2000)
+    defaults, removed = [], []
+    models = registry.ModelRegistry(directory, _load, max_versions=2,
+                                    on_default=defaults.append, on_remove=removed.append)
+
+    # Function call
+    models.refresh()
+
+    # Test that: both versions are loaded and the newest one is the default
+    assert [v['name'] for v in models.versions()] == ['one', 'two']
+    assert models.get()['version'] == 'v2'
+    assert models.get('one')['version'] == 'v1'
+    assert [a['name'] for a in defaults] == ['two']
+
+    # Test that: a version failing the smoke batch is not loaded
+    _write_version(directory, 'broken', float('nan'), 3000)
+    models.refresh()
+    assert models.get()['version'] == 'v2'
+    assert 'broken' not in [v['name'] for v in models.versions()]
+
+    # Test that: CURRENT sets the default, and an unchanged directory doesn't reload anything
+    with open(os.path.join(directory, 'CURRENT'), 'w') as f:
+        f.write('one')
+    held = models.get('two')
+    models.refresh()
+    assert models.get()['version'] == 'v1'
+    assert models.get('two') is held
+    assert [a['name'] for a in defaults] == ['two', 'one']
+
+    # Test that: the oldest versions beyond max_versions are dropped, except the default
+    _write_version(directory, 'three', 3, 4000)
+    models.refresh()
+    assert [v['name'] for v in models.versions()] == ['one', 'three']
+    assert [a['name'] for a in removed] == ['two']
+
+
+def test_registry_reloads_same_version(tmp_path):
+
+    # Set up: a default version whose pickles are rewritten with the same model
+    directory = str(tmp_path)
+    _write_version(directory, 'one', 1, 1000)
+    calls = []
+    models = registry.ModelRegistry(
+        directory, _load, on_default=lambda a: calls.append(('default', a['version'])),
+        on_remove=lambda a: calls.append(('remove', a['version'])))
+    models.refresh()
+    with open(os.path.join(directory, 'one', 'Model.pkl'), 'w') as f:
+        f.write('1.0')
+
+    # Function call
+    models.refresh()
+
+    # Test that: the reloaded version is made the default again and never released
+    assert calls == [('default', 'v1'), ('default', 'v1')]
+
+
+def test_publish(tmp_path):
+
+    # Set up: a folder of pickles and an empty registry directory
+    source = os.path.join(tmp_path, 'pickle')
+    directory = os.path.join(tmp_path, 'models')
+    os.makedirs(directory)
+    _write_version(str(tmp_path), 'pickle', 5, 1000)
+    models = registry.ModelRegistry(directory, _load)
+
+    # Function call
+    name = registry.publish(source, directory, name='five', default=True)
+    models.refresh()
+
+    # Test that: the version is published under its name and is the default
+    assert name == 'five'
+    assert models.versions() == [{'name': 'five', 'model_version': 'v5', 'default': True}]
+    try:
+        models.get('unknown')
+        assert False
+    except KeyError:
+        pass
@@ -0,0 +1,36 @@
+from src import resources
+
+import numpy as np
+
+
+def test_training_config():
+
+    # Set up: a small data set, and a large one on a machine with little memory
+    n_estimators = 60
+
+    # Function call
+    small = resources.training_config(1000, 50, n_estimators, n_folds=5, cpus=8, memory=2**33)
+    large = resources.training_config(10**6, 50, n_estimators, n_folds=5, cpus=8,
+                                      memory=2**32)
+
+    # Test that: small data is cross-validated in one process with every CPU fitting trees,
+    # and large data uses fewer folds at a time and subsamples rows to fit in memory
+    assert small['cv_jobs'] == 1 and small['n_jobs'] == 8
+    assert small['max_samples'] is None
+    assert 1 <= large['cv_jobs'] < 5
+    assert large['n_jobs'] == 8 // large['cv_jobs']
+    assert 0 < large['max_samples'] < 1
+    assert large['chunk_rows'] <= 10**6
+
+
+def test_available_resources_and_peak_memory():
+
+    # Function call
+    with resources.PeakMemory(interval=0.001) as usage:
+        block = np.ones(2**24)
+
+    # Test that: the machine has resources, and the 128MB allocation is measured
+    assert resources.available_cpus() >= 1
+    assert resources.available_memory() > 0
+    assert usage.peak_bytes >= 0.9 * block.nbytes
+    assert usage.seconds > 0
@@ -0,0 +1,60 @@
+from src.app import shadow
+
+import numpy as np
+import pandas as pd
+
+
+class _ScaledModel():
+    """ Stand-in preprocessor and model: predicts the sum of the columns times a factor """
+
+    def __init__(self, factor=1.):
+        self.factor = factor
+
+    def transform(self, X):
+        return X * 2
+
+    def predict(self, X):
+        return np.asarray(X).sum(axis=1) * self.factor
+
+
+def test_shadow_scoring():
+
+    # Set up: a candidate sharing the primary's features, one with its own preprocessor and
+    # one that fails
+    candidates = [
+        {'name': 'shared', 'version': 'a', 'model': _ScaledModel(1.1)},
+        {'name': 'own', 'version': 'b', 'model': _ScaledModel(1.), 'preprocessor': _ScaledModel()},
+        {'name': 'broken', 'version': 'c', 'model': None}
+    ]
+    scorer = shadow.ShadowScorer(candidates).start()
+    X = pd.DataFrame({'x': [1., 2.], 'y': [3., 4.]})
+    X_pp = X.copy()
+    y_pred = _ScaledModel().predict(X_pp)
+
+    # Function call
+    scorer.submit(X, y_pred, 0.01, X_pp)
+    scorer.join()
+    summary = {c['name']: c for c in scorer.summary()['candidates']}
+    scorer.stop()
+
+    # Test that: differences with the primary predictions are recorded for each candidate
+    assert summary['shared']['rows'] == 2
+    assert np.isclose(summary['shared']['mean_relative_diff'], 0.1)
+    assert np.isclose(summary['shared']['max_abs_diff'], 0.6)
+    assert np.isclose(summary['own']['mean_abs_diff'], 5.)
+    assert summary['broken']['errors'] == 1
+    assert summary['broken']['rows'] == 0
+
+
+def test_shadow_drops_when_full():
+
+    # Set up: scorer whose queue is not consumed
+    scorer = shadow.ShadowScorer([{'version': 'a', 'model': _ScaledModel()}], max_queue=1)
+    X = pd.DataFrame({'x': [1.]})
+
+    # Function call
+    accepted = [scorer.submit(X, [1.], 0.01, X) for _ in range(3)]
+
+    # Test that: batches beyond the queue size are dropped, not waited for
+    assert accepted == [True, False, False]
+    assert scorer.summary()['dropped'] == 2
@@ -0,0 +1,52 @@
+from src import sharding
+
+import numpy as np
+import pandas as pd
+
+
+def _features(n_rows, neighborhoods, seed=0):
+    """ Preprocessed-like features: a numeric column and one-hot encoded neighborhoods """
+    rng = np.random.RandomState(seed)
+    names = rng.choice(neighborhoods, n_rows, p=[0.45, 0.45, 0.1])
+    X = pd.DataFrame({'OverallQual': rng.normal(size=n_rows)})
+    for name in neighborhoods:
+        X[sharding.PREFIX + name] = (names == name).astype(float)
+    return X, names
+
+
+def test_group_neighborhoods():
+
+    # Set up: three neighborhoods with different prices
+    names = np.array(['A'] * 50 + ['B'] * 30 + ['C'] * 20)
+    y = np.array([300.] * 50 + [100.] * 30 + [200.] * 20)
+
+    # Function call
+    groups = sharding.group_neighborhoods(names, y, 2)
+
+    # Test that: neighborhoods are ordered by price and split into groups of about equal rows
+    assert groups == {'B': 0, 'C': 0, 'A': 1}
+
+
+def test_sharded_model():
+
+    # Set up: two large neighborhoods with their own group and a sparse one
+    X, names = _features(1000, ['A', 'B', 'C'])
+    y = np.where(names == 'A', 100., 300.) + X['OverallQual'] * 10
+    model = sharding.ShardedModel(X.columns, {'A': 0, 'B': 1, 'C': 2}, min_group_rows=200)
+
+    # Function call
+    model.fit(X, y, params={'n_estimators': 5})
+    y_pred = model.predict(X)
+    first_trees = model.predict(X, trees=[0, 1])
+
+    # Test that: rows are scored by their group's forest, the sparse group by the global forest
+    routes = model._routes(X.to_numpy(np.float32))
+    assert sorted(model.forests_) == [0, 1] and model.global_ is not None
+    assert (routes[names == 'C'] == -1).all()
+    assert np.allclose(y_pred[names == 'A'],
+                       model.forests_[0].predict(X[names == 'A'].to_numpy(np.float32)))
+    assert np.allclose(y_pred[names == 'C'],
+                       model.global_.predict(X[names == 'C'].to_numpy(np.float32)))
+    assert np.sqrt(np.mean((y_pred - y) ** 2)) < 10
+    assert first_trees.shape == y_pred.shape
+    assert set(model.summary()) == {-1, 0, 1}
@@ -0,0 +1,79 @@
+from src import synthetic
+
+import os
+import numpy as np
+import pandas as pd
+
+
+def _raw_data(n_rows=2000):
+    rng = np.random.RandomState(0)
+    neighborhood = rng.choice(['Old', 'New'], n_rows)
+    quality = rng.randint(1, 11, n_rows)
+    return pd.DataFrame({
+        'Id': np.arange(1, n_rows + 1),
+        'Neighborhood': neighborhood,
+        'YearBuilt': np.where(neighborhood == 'Old', 1900, 2000) + rng.randint(0, 20, n_rows),
+        'OverallQual': quality,
+        'SalePrice': quality * 30000 + rng.randint(0, 10000, n_rows),
+        'LotFrontage': np.where(rng.rand(n_rows) < 0.2, np.nan, rng.normal(70, 20, n_rows)),
+        'Alley': rng.choice(['Grvl', 'Pave', None], n_rows)
+    })
+
+
+def test_sample_schema_and_dependencies():
+
+    # Set up: fitted synthesizer
+    raw = _raw_data()
+    synthesizer = synthetic.HouseSynthesizer().fit(raw)
+
+    # Function call
+    sample = synthesizer.sample(5000, np.random.default_rng(0), start_id=11)
+
+    # Test that: the sample has the raw schema and sequential Ids
+    assert list(sample.columns) == list(raw.columns)
+    assert sample['Id'].tolist() == list(range(11, 5011))
+    assert sample['OverallQual'].dtype == raw['OverallQual'].dtype
+    assert set(sample['Neighborhood']) == {'Old', 'New'}
+
+    # Test that: dependent columns follow their parent
+    old = sample[sample['Neighborhood'] == 'Old']['YearBuilt']
+    new = sample[sample['Neighborhood'] == 'New']['YearBuilt']
+    assert old.max() < 1920 and new.min() >= 2000
+    price_by_quality = sample.groupby('OverallQual')['SalePrice'].mean()
+    assert price_by_quality.is_monotonic_increasing
+
+    # Test that: missing value rates are approximately preserved
+    assert abs(sample['LotFrontage'].isnull().mean() - 0.2) < 0.03
+    assert abs(sample['Alley'].isnull().mean() - raw['Alley'].isnull().mean()) < 0.03
+
+
+def test_generate_is_deterministic():
+
+    # Set up: fitted synthesizer
+    synthesizer = synthetic.HouseSynthesizer().fit(_raw_data())
+
+    # Function call
+    first = pd.concat(synthesizer.generate(2500, chunk_rows=1000, seed=3))
+    second = pd.concat(synthesizer.generate(2500, chunk_rows=1000, seed=3))
+    other = pd.concat(synthesizer.generate(2500, chunk_rows=1000, seed=4))
+
+    # Test that: the same seed gives the same rows and a different seed different rows
+    assert len(first) == 2500
+    assert first['Id'].tolist() == list(range(1, 2501))
+    pd.testing.assert_frame_equal(first, second)
+    assert not first.equals(other)
+
+
+def test_write_csv(tmp_path):
+
+    # Set up: fitted synthesizer
+    synthesizer = synthetic.HouseSynthesizer().fit(_raw_data())
+    output = os.path.join(tmp_path, 'synthetic.csv')
+
+    # Function call
+    synthetic.write(synthesizer.generate(2500, chunk_rows=1000), 'csv', output)
+
+    # Test that: all chunks are written with a single header
+    written = pd.read_csv(output)
+    assert len(written) == 2500
+    assert list(written.columns) == list(_raw_data().columns)